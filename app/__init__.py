@@ -1,10 +1,17 @@
 from flask import Flask
 from dotenv import load_dotenv
-from app.config.sqlite import init_db
-from app.config.mongo_db import mongo_init_db
+from app.config.sqlite import init_db, ensure_db
+from app.config.sqlite_pool import claim_connection, release_connection, close_pool
+from app.config.mongo_db import mongo_init_db, close_db
 import os
+import atexit
 from flask_wtf.csrf import CSRFProtect
-from app.config.mongo_seed import seed_mongo
+from app.config.mongo_seed import seed_mongo, start_background_seed
+from utils.passwords import shutdown_hasher, hasher_stats
+from utils.metrics import init_metrics, has_metrics_token, REGISTRY
+from utils.fragment_cache import fragment_cache
+from app.models.async_access import shutdown_executor
+from app.models.audit import AuditLog
 
 load_dotenv()
 
@@ -18,10 +25,55 @@ def create_app():
     
     app = Flask(__name__)
 
+    # Request timing goes first so it also covers the hooks registered below
+    init_metrics(app)
+
+    # LAZY_INIT=1 skips connecting at startup, databases connect on first use.
+    # SEED_ON_START is "sync", "background" or "off" (then run `flask seed-db`).
+    lazy_init = os.getenv("LAZY_INIT", "0") == "1"
+    seed_on_start = os.getenv("SEED_ON_START", "off" if lazy_init else "sync")
+
+    # The request thread keeps one pooled SQLite connection for the request
+    app.before_request(claim_connection)
+
     # Database setup
-    init_db()
-    mongo_init_db()
-    seed_mongo()
+    if lazy_init:
+        app.before_request(ensure_db)
+    else:
+        init_db()
+        mongo_init_db()
+
+    if seed_on_start == "sync":
+        seed_mongo()
+    elif seed_on_start == "background":
+        start_background_seed()
+
+    @app.cli.command("seed-db")
+    def seed_db_command():
+        """Seed the patients collection from the CSV."""
+        seed_mongo()
+
+    @app.cli.command("build-seed-cache")
+    def build_seed_cache_command():
+        """Convert the seed CSV into the memory-mapped column cache."""
+        from app.config.mongo_seed import load_seed_table, SEED_CSV
+        print(f"{SEED_CSV}: {len(load_seed_table())} rows cached.")
+
+    @app.cli.command("score-risk")
+    def score_risk_command():
+        """Refit the stroke risk model and rescore every patient."""
+        from app.models.risk import RiskModel
+        print(RiskModel.refresh())
+
+    # Hand pooled SQLite connections back after each request, close the
+    # SQLite and MongoDB pools on exit (per request would defeat pooling)
+    app.teardown_appcontext(release_connection)
+    atexit.register(close_pool)
+    atexit.register(close_db)
+    atexit.register(shutdown_hasher)
+    atexit.register(shutdown_executor)
+    # Registered after close_pool so queued audit events are written first
+    atexit.register(AuditLog.shutdown)
     
     # Read secret key 
     app.secret_key = os.getenv("SECRET_KEY")
@@ -40,6 +92,18 @@ def create_app():
     app.register_blueprint(auth.auth_blueprint)
     app.register_blueprint(dashboard.dashboard_blueprint)
 
+    # Pool and queue gauges, read at scrape time
+    from app.config.mongo_db import get_pool_stats
+    from app.models.snapshot import PatientSnapshot
+    REGISTRY.gauge("mongo_pool_connections", "MongoDB connections by state.",
+                   lambda: {k: get_pool_stats()[k] for k in ("open", "in_use")}, "state")
+    REGISTRY.gauge("password_hash_in_flight", "Password hashes queued or running.",
+                   lambda: hasher_stats()["in_flight"])
+    REGISTRY.gauge("patient_snapshot_rows", "Patients held in the columnar snapshot.",
+                   lambda: PatientSnapshot.stats().get("rows"))
+    REGISTRY.gauge("login_rate_limited_total", "Login attempts refused by the rate limiter.",
+                   lambda: {"ip": auth.ip_limiter.limited, "email": auth.email_limiter.limited}, "limiter")
+
     # Provide current_user in all templates
     @app.context_processor
     def inject_user():
@@ -51,13 +115,42 @@ def create_app():
         user_id = session.get("user_id")
         if user_id is not None:
             try:
-                # User model uses integer IDs in SQLite
-                user = User.get_by_id(int(user_id))
+                # User model uses integer IDs in SQLite, cached per request
+                user = User.get_cached(user_id)
             except Exception:
                 user = None
 
         return dict(current_user=user)
 
+    # Readiness probe, cheap enough to poll. Anyone gets readiness and seed
+    # progress, the pool, queue and cache internals need METRICS_TOKEN
+    @app.route('/healthz')
+    def healthz():
+        """Report database reachability and seed progress"""
+        from app.config.mongo_db import get_db, get_pool_stats
+        from app.config.mongo_seed import seed_status
+        from app.models.snapshot import PatientSnapshot
+
+        checks = {"sqlite": True, "mongo": True}
+        try:
+            ensure_db()
+        except Exception:
+            checks["sqlite"] = False
+        try:
+            get_db().client.admin.command('ping')
+        except Exception:
+            checks["mongo"] = False
+
+        ready = all(checks.values())
+        seed = {key: seed_status[key] for key in ("state", "rows_done", "started_at", "finished_at")}
+        body = {"status": "ready" if ready else "unavailable", "checks": checks, "seed": seed}
+        if has_metrics_token():
+            body.update({"seed_error": seed_status["error"], "mongo_pool": get_pool_stats(),
+                         "snapshot": PatientSnapshot.stats(), "password_hashing": hasher_stats(),
+                         "login_limits": {"ip": auth.ip_limiter.stats(), "email": auth.email_limiter.stats()},
+                         "fragment_cache": fragment_cache.stats(), "audit": AuditLog.stats()})
+        return body, 200 if ready else 503
+
     # Register 404 error handler
     @app.errorhandler(404)
     def page_not_found(e):
@@ -1,6 +1,7 @@
 import os
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
+import threading
+from pymongo import MongoClient, ASCENDING, DESCENDING, monitoring
+from pymongo.errors import ConnectionFailure, OperationFailure
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -11,26 +12,142 @@ MONGO_URL = os.getenv("MONGO_URL")
 DB_NAME = os.getenv("DB_NAME", "HealthcareDB")
 COLLECTION_NAME = os.getenv("PATIENT_COLLECTION", "StrokeData")
 
-# Initialize MongoDB client
+# Indexes for the patients collection: (name, keys, options).
+# 'id' is used by every single-patient lookup, the compound ones cover the
+# dashboard filters and sort keys with _id as the tie-breaker.
+PATIENT_INDEXES = [
+    ("id_unique", [("id", ASCENDING)], {"unique": True}),
+    ("stroke_age", [("stroke", ASCENDING), ("age", DESCENDING), ("_id", DESCENDING)], {}),
+    ("hypertension_smoking_age", [("hypertension", ASCENDING), ("smoking_status", ASCENDING),
+                                  ("age", DESCENDING), ("_id", DESCENDING)], {}),
+    ("gender_age", [("gender", ASCENDING), ("age", DESCENDING), ("_id", DESCENDING)], {}),
+    ("work_type_id", [("work_type", ASCENDING), ("_id", DESCENDING)], {}),
+    ("age_id", [("age", DESCENDING), ("_id", DESCENDING)], {}),
+    ("avg_glucose_level_id", [("avg_glucose_level", DESCENDING), ("_id", DESCENDING)], {}),
+    ("bmi_id", [("bmi", DESCENDING), ("_id", DESCENDING)], {}),
+    ("risk_score_id", [("risk_score", DESCENDING), ("_id", DESCENDING)], {}),
+]
+
+# Connection pool settings, size MONGO_MAX_POOL_SIZE x workers against
+# the server's connection limit
+CLIENT_OPTIONS = {
+    "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", 50)),
+    "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", 0)),
+    "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_MS", 60000)),
+    "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_MS", 5000)),
+    "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000)),
+    "socketTimeoutMS": int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 30000)),
+}
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Counts pool events so get_pool_stats can report connection usage"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Zero every counter"""
+        self.open = 0
+        self.in_use = 0
+        self.created = 0
+        self.closed = 0
+        self.checkout_failures = 0
+
+    def _add(self, **changes):
+        with self.lock:
+            for name, amount in changes.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_check_out_started(self, event): pass
+
+    def connection_created(self, event):
+        self._add(open=1, created=1)
+
+    def connection_closed(self, event):
+        self._add(open=-1, closed=1)
+
+    def connection_check_out_failed(self, event):
+        self._add(checkout_failures=1)
+
+    def connection_checked_out(self, event):
+        self._add(in_use=1)
+
+    def connection_checked_in(self, event):
+        self._add(in_use=-1)
+
+
+# One client per process, recreated in a child after fork
 client = None
 db = None
+_client_pid = None
+_client_lock = threading.Lock()
+pool_stats = PoolStatsListener()
+
+
+def _forget_client():
+    """Drop the parent's client in a forked child, it must not be reused"""
+    global client, db, _client_pid
+    client = None
+    db = None
+    _client_pid = None
+    pool_stats.reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_client)
+
+
+def get_client():
+    """Get this process's MongoClient, creating it on first use or after a fork"""
+    global client, db, _client_pid
+    if client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if client is None or _client_pid != os.getpid():
+                if not MONGO_URL:
+                    raise ValueError("MONGO_URL not found in environment variables")
+                pool_stats.reset()
+                client = MongoClient(MONGO_URL, event_listeners=[pool_stats], **CLIENT_OPTIONS)
+                _client_pid = os.getpid()
+                db = None
+    return client
+
+
+def get_pool_stats():
+    """Connection pool usage for this process"""
+    with pool_stats.lock:
+        return {
+            "pid": os.getpid(),
+            "max_pool_size": CLIENT_OPTIONS["maxPoolSize"],
+            "open": pool_stats.open,
+            "in_use": pool_stats.in_use,
+            "created": pool_stats.created,
+            "closed": pool_stats.closed,
+            "checkout_failures": pool_stats.checkout_failures,
+        }
+
 
 def mongo_init_db():
     """Initialize MongoDB connection"""
-    global client, db
+    global db
     
     try:
-        if not MONGO_URL:
-            raise ValueError("MONGO_URL not found in environment variables")
-        
-        # Create MongoDB client
-        client = MongoClient(MONGO_URL)
+        # Create (or reuse) the MongoDB client
+        mongo_client = get_client()
         
         # Test the connection
-        client.admin.command('ping')
+        mongo_client.admin.command('ping')
         
         # Get database
-        db = client[DB_NAME]
+        db = mongo_client[DB_NAME]
+
+        ensure_indexes(db[COLLECTION_NAME])
         
         print(f"Successfully connected to MongoDB: {DB_NAME}")
         return db
@@ -42,9 +159,29 @@ def mongo_init_db():
         print(f"Error initializing MongoDB: {e}")
         raise
 
+def ensure_indexes(collection):
+    """
+    Create the patient indexes if they are missing.
+    Safe to run on every startup, existing indexes are left alone.
+    """
+    existing = collection.index_information()
+    created = []
+    for name, keys, options in PATIENT_INDEXES:
+        if name in existing:
+            continue
+        try:
+            collection.create_index(keys, name=name, **options)
+            created.append(name)
+        except OperationFailure as e:
+            # e.g. duplicate ids in old data stop the unique index being built
+            print(f"Could not create index {name}: {e}")
+    if created:
+        print(f"Created MongoDB indexes: {', '.join(created)}")
+    return created
+
 def get_db():
     """Get database instance"""
-    if db is None:
+    if db is None or _client_pid != os.getpid():
         return mongo_init_db()
     return db
 
@@ -53,15 +190,16 @@ def get_collection():
     database = get_db()
     return database[COLLECTION_NAME]
 
-def close_db():
+def close_db(exception=None):
     """Close MongoDB connection"""
-    global client, db
-    if client:
+    global client, db, _client_pid
+    # A client inherited over fork belongs to the parent, only forget it
+    if client is not None and _client_pid == os.getpid():
         try:
             client.close()
             print("MongoDB connection closed")
         except Exception as e:
             print(f"Error closing MongoDB connection: {e}")
-        finally:
-            client = None
-            db = None
+    client = None
+    db = None
+    _client_pid = None
@@ -1,13 +1,259 @@
-import pandas as pd
+import csv
+import hashlib
+import json
+import math
 import os
-from pymongo import MongoClient
+import threading
+import time
+from pymongo import ReplaceOne, UpdateOne
+from app.config.mongo_db import get_client
+from utils.column_cache import load_table
+
+SEED_CSV = os.getenv("SEED_CSV", "healthcare-dataset-stroke-data.csv")
+SEED_BATCH_SIZE = int(os.getenv("SEED_BATCH_SIZE", 1000))
+
+# Parsed CSVs are kept as memory-mapped .npy columns keyed by the file's hash,
+# by default in .seed_cache next to the CSV. SEED_CACHE=0 always parses the CSV
+SEED_CACHE = os.getenv("SEED_CACHE", "1") == "1"
+SEED_CACHE_DIR = os.getenv("SEED_CACHE_DIR")
+
+# "full" wipes and reloads once, "delta" syncs only changed rows on every start
+SEED_MODE = os.getenv("SEED_MODE", "full")
+
+# Per-patient content hashes of the last synced CSV rows
+FINGERPRINT_COLLECTION = "SeedFingerprints"
+
+# Marker names stored in the SeedMarkers collection
+SEED_DONE = "stroke_seed_done"
+SEED_PROGRESS = "stroke_seed_progress"
+
+# Progress of the current/last seed run in this process, shown by /healthz
+seed_status = {"state": "idle", "rows_done": 0, "started_at": None, "finished_at": None, "error": None}
+_seed_thread = None
+_seed_thread_lock = threading.Lock()
+
+INT_COLUMNS = ["id", "age", "hypertension", "heart_disease", "stroke"]
+FLOAT_COLUMNS = ["avg_glucose_level", "bmi"]
+
+
+def _to_float(value):
+    """Parse a number, treating blanks and values like 'N/A' as 0"""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if math.isnan(number) else number
+
+
+def coerce_row(row):
+    """
+    Apply the seed type rules to one CSV row:
+    bmi/glucose as floats (N/A -> 0), age and the 0/1 flags as ints
+    """
+    record = dict(row)
+    for col in FLOAT_COLUMNS:
+        record[col] = _to_float(record.get(col))
+    for col in INT_COLUMNS:
+        record[col] = int(_to_float(record.get(col)))
+    return record
+
+
+def parse_csv(path):
+    """Yield the CSV's rows as coerced records"""
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            yield coerce_row(row)
+
+
+def cache_dir_for(path):
+    return SEED_CACHE_DIR or os.path.join(os.path.dirname(os.path.abspath(path)), ".seed_cache")
+
+
+def load_seed_table(path=SEED_CSV):
+    """
+    The CSV as a ColumnTable of coerced values, memory-mapped from the cache.
+    The CSV is only parsed (and the cache rebuilt) when its contents change.
+    """
+    started = time.perf_counter()
+    table, cached = load_table(path, parse_csv, cache_dir_for(path))
+    if not cached:
+        print(f"Built seed cache for {path}: {len(table)} rows in {time.perf_counter() - started:.2f}s.")
+    return table
+
+
+def load_seed_frame(path=SEED_CSV):
+    """The CSV as a pandas DataFrame for analytics, see load_seed_table"""
+    return load_seed_table(path).frame()
+
+
+def read_batches(path, batch_size=SEED_BATCH_SIZE, skip_rows=0):
+    """Stream the CSV as lists of coerced records, batch_size rows at a time"""
+    table = None
+    if SEED_CACHE:
+        try:
+            table = load_seed_table(path)
+        except (OSError, ValueError) as e:
+            print(f"Seed cache unavailable, parsing the CSV: {e}")
+    if table is not None:
+        yield from table.batches(batch_size, skip_rows)
+        return
+
+    batch = []
+    for line_no, record in enumerate(parse_csv(path)):
+        if line_no < skip_rows:
+            continue
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def stream_seed(patients, markers, path=SEED_CSV, batch_size=SEED_BATCH_SIZE):
+    """
+    Load the CSV into the patients collection in batches.
+    Progress is saved in SeedMarkers after every batch, so an interrupted
+    seed carries on from the last finished batch instead of starting over.
+    Returns number of rows written
+    """
+    progress = markers.find_one({"name": SEED_PROGRESS})
+    rows_done = progress["rows_done"] if progress else 0
+
+    if not progress:
+        patients.delete_many({})
+    else:
+        print(f"Resuming seed after {rows_done} rows.")
+
+    started = time.perf_counter()
+    written = 0
+    for batch in read_batches(path, batch_size, skip_rows=rows_done):
+        # Upsert by id so a batch repeated after a crash does not duplicate rows
+        patients.bulk_write(
+            [ReplaceOne({"id": record["id"]}, record, upsert=True) for record in batch],
+            ordered=False,
+        )
+        written += len(batch)
+        seed_status["rows_done"] = rows_done + written
+        markers.update_one(
+            {"name": SEED_PROGRESS},
+            {"$set": {"rows_done": rows_done + written}},
+            upsert=True,
+        )
+
+    elapsed = time.perf_counter() - started
+    rate = written / elapsed if elapsed > 0 else 0
+    print(f"Seeded {written} rows in {elapsed:.2f}s ({rate:,.0f} rows/s).")
+
+    # marker to confirm the db has already been seeded
+    markers.insert_one({"name": SEED_DONE})
+    markers.delete_one({"name": SEED_PROGRESS})
+    return written
+
+
+def fingerprint(record):
+    """Stable hash of a coerced CSV row, used to spot changed patients"""
+    raw = json.dumps(record, sort_keys=True, default=str).encode()
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+def delta_sync(patients, fingerprints, path=SEED_CSV, batch_size=SEED_BATCH_SIZE):
+    """
+    Bring the patients collection in line with the CSV without reloading it.
+    Only rows whose fingerprint changed are upserted, and only patients that
+    came from an earlier sync but are missing from the CSV are deleted.
+    Patients added through the app are never touched. Changed patients get
+    their version bumped, and the collection version after every batch
+    that wrote, so cached pages and ETags showing the old rows go stale.
+    Returns dict with counts of upserted, deleted and unchanged rows
+    """
+    from app.models.patient import Patient
+    known = {doc["_id"]: doc["fp"] for doc in fingerprints.find({}, {"fp": 1})}
+    seen = set()
+    stats = {"upserted": 0, "deleted": 0, "unchanged": 0}
+    started = time.perf_counter()
+
+    for batch in read_batches(path, batch_size):
+        patient_ops, fingerprint_ops = [], []
+        for record in batch:
+            patient_id = record["id"]
+            seen.add(patient_id)
+            fp = fingerprint(record)
+            if known.get(patient_id) == fp:
+                stats["unchanged"] += 1
+                continue
+            # $set keeps any fields the app added to the document
+            patient_ops.append(UpdateOne({"id": patient_id}, {"$set": record, "$inc": {"version": 1}},
+                                         upsert=True))
+            fingerprint_ops.append(UpdateOne({"_id": patient_id}, {"$set": {"fp": fp}}, upsert=True))
+
+        if patient_ops:
+            patients.bulk_write(patient_ops, ordered=False)
+            fingerprints.bulk_write(fingerprint_ops, ordered=False)
+            Patient.bump_collection_version(patients)
+            stats["upserted"] += len(patient_ops)
+        seed_status["rows_done"] += len(batch)
+
+    removed = [patient_id for patient_id in known if patient_id not in seen]
+    for i in range(0, len(removed), batch_size):
+        chunk = removed[i:i + batch_size]
+        patients.delete_many({"id": {"$in": chunk}})
+        fingerprints.delete_many({"_id": {"$in": chunk}})
+    if removed:
+        Patient.bump_collection_version(patients)
+    stats["deleted"] = len(removed)
+
+    elapsed = time.perf_counter() - started
+    print(f"Delta sync: {stats['upserted']} upserted, {stats['deleted']} deleted, "
+          f"{stats['unchanged']} unchanged in {elapsed:.2f}s.")
+    return stats
+
+
+def _after_seed(patients):
+    """
+    Seeding bypasses the Patient model, so rebuild cohort stats and the
+    patient snapshot on next read, mark cached patient lists stale and
+    refit the risk model on the new rows
+    """
+    from app.models.cohort import CohortStats
+    from app.models.patient import Patient
+    from app.models.risk import RiskModel
+    from app.models.snapshot import PatientSnapshot
+    CohortStats.invalidate()
+    PatientSnapshot.reset()
+    Patient.bump_collection_version(patients)
+    try:
+        RiskModel.refresh(patients)
+    except Exception as e:
+        print("Risk scoring failed, scores will be refreshed on next use:", e)
+
 
 def seed_mongo():
-    client = None
+    """Run the seed and record its progress in seed_status"""
+    seed_status.update(state="running", rows_done=0, started_at=time.time(), finished_at=None, error=None)
+    result = _run_seed()
+    seed_status.update(state=result, finished_at=time.time())
+    return result
+
+
+def start_background_seed():
+    """
+    Run seed_mongo on a daemon thread so the app can serve requests meanwhile.
+    Returns the thread, or the one already running
+    """
+    global _seed_thread
+    with _seed_thread_lock:
+        if _seed_thread is None or not _seed_thread.is_alive():
+            _seed_thread = threading.Thread(target=seed_mongo, name="seed-mongo", daemon=True)
+            _seed_thread.start()
+        return _seed_thread
+
+
+def _run_seed():
+    """Seed the patients collection, returns the final seed state"""
     try:
-        # MongoDB connection
-        uri = os.getenv("MONGO_URL")
-        client = MongoClient(uri, serverSelectionTimeoutMS=3000)
+        # Shared MongoDB client, no second connection pool just for seeding
+        client = get_client()
 
         db = client[os.getenv("DB_NAME", "HealthcareDB")]
         patients = db[os.getenv("PATIENT_COLLECTION", "StrokeData")]
@@ -18,49 +264,40 @@ def seed_mongo():
             client.admin.command("ping")
         except Exception:
             print("Mongo unreachable. Skipping seeding")
-            return
+            return "skipped"
+
+        if SEED_MODE == "delta":
+            if not os.path.exists(SEED_CSV):
+                print("CSV missing or unreadable. Skipping seeding.")
+                return "skipped"
+            delta_sync(patients, db[FINGERPRINT_COLLECTION])
+            _after_seed(patients)
+            markers.update_one({"name": SEED_DONE}, {"$set": {"name": SEED_DONE}}, upsert=True)
+            return "done"
 
         # Check marker
-        if markers.find_one({"name": "stroke_seed_done"}):
+        if markers.find_one({"name": SEED_DONE}):
             print("Seed skipped (already done).")
-            return
+            return "done"
 
-        # Load CSV
-        try:
-            df = pd.read_csv("healthcare-dataset-stroke-data.csv")
-        except Exception:
+        if not os.path.exists(SEED_CSV):
             print("CSV missing or unreadable. Skipping seeding.")
-            return
-
-        # bmi: numeric (float), NaN -> 0
-        df["bmi"] = pd.to_numeric(df["bmi"], errors="coerce").fillna(0)
-
-        # age: numeric -> int
-        df["age"] = pd.to_numeric(df["age"], errors="coerce").fillna(0).astype(int)
-
-        # ensure these are integers as well
-        for col in ["hypertension", "heart_disease", "stroke"]:
-            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0).astype(int)
-
-        records = df.to_dict("records")
+            return "skipped"
 
         # Insert records to mongo
         try:
-            patients.delete_many({})
-            if records:
-                patients.insert_many(records)
-        except Exception:
-            print("Database insert failed. Skipping seeding.....")
-            return
-
-        # marker to confirm the db has already been seeded
-        markers.insert_one({"name": "stroke_seed_done"})
+            total = stream_seed(patients, markers)
+        except Exception as e:
+            print("Database insert failed. Skipping seeding.....", e)
+            seed_status["error"] = str(e)
+            return "failed"
 
-        print(f"Seed complete. Inserted {len(records)} records.")
+        _after_seed(patients)
+        print(f"Seed complete. Inserted {total} records.")
+        return "done"
 
     except Exception as e:
         # NEVER let the app break
         print("Unexpected error during seeding, but continuing:", e)
-    finally:
-        if client is not None:
-            client.close()
\ No newline at end of file
+        seed_status["error"] = str(e)
+        return "failed"
@@ -1,10 +1,19 @@
 import sqlite3
+import threading
 from app.models.user import User
+from app.config.sqlite_pool import DB_NAME, configure_pool, connection
 
 """Database initialisation to store user authentication details"""
 
-def init_db():
-    with sqlite3.connect("london_health.db") as conn:
+_db_ready = False
+_db_ready_lock = threading.Lock()
+
+def init_db(db_name=DB_NAME):
+    global _db_ready
+    # Set up the shared connection pool (WAL, busy timeout, statement cache)
+    configure_pool(db_name)
+
+    with connection() as conn:
         cursor = conn.cursor()
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -19,6 +28,59 @@ def init_db():
             )
         ''')
         
+        # Full-text index of user names and emails for the user search
+        # (User.get_keyset_users), kept in step with users by the triggers.
+        # prefix='2 3' indexes short prefixes so "ad"* does not scan every term
+        fts_exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users_fts'").fetchone()
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+                first_name, last_name, email,
+                content='users', content_rowid='id', prefix='2 3'
+            )
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+                INSERT INTO users_fts (rowid, first_name, last_name, email)
+                VALUES (new.id, new.first_name, new.last_name, new.email);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+                INSERT INTO users_fts (users_fts, rowid, first_name, last_name, email)
+                VALUES ('delete', old.id, old.first_name, old.last_name, old.email);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF first_name, last_name, email ON users BEGIN
+                INSERT INTO users_fts (users_fts, rowid, first_name, last_name, email)
+                VALUES ('delete', old.id, old.first_name, old.last_name, old.email);
+                INSERT INTO users_fts (rowid, first_name, last_name, email)
+                VALUES (new.id, new.first_name, new.last_name, new.email);
+            END
+        ''')
+        if not fts_exists:
+            # Index the users stored before the search existed
+            cursor.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+
+        # Change counters bumped by triggers in the writing transaction, so
+        # every worker's cached user table rows go stale on any write
+        # (User.table_version, part of the 'users' fragment key)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS table_versions (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO table_versions (name, version) VALUES ('users', 0)")
+        for name, event in (('insert', 'INSERT'), ('delete', 'DELETE'),
+                            ('update', 'UPDATE OF first_name, last_name, email, role')):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS users_version_{name} AFTER {event} ON users BEGIN
+                    UPDATE table_versions SET version = version + 1 WHERE name = 'users';
+                END
+            ''')
+
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS roles (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -38,6 +100,29 @@ def init_db():
             )
         ''')
         
+        # Who changed what, written in batches by app.models.audit
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS audit_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at DATETIME NOT NULL,
+                actor_id INTEGER,
+                action TEXT NOT NULL,
+                target_type TEXT NOT NULL,
+                target_id TEXT,
+                changes TEXT
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_audit_log_actor ON audit_log (actor_id, id)')
+        # The log is append-only
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS audit_log_no_update BEFORE UPDATE ON audit_log
+            BEGIN SELECT RAISE(ABORT, 'audit_log is append-only'); END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS audit_log_no_delete BEFORE DELETE ON audit_log
+            BEGIN SELECT RAISE(ABORT, 'audit_log is append-only'); END
+        ''')
+
         default_roles = ['admin', 'doctor']
         for role in default_roles:
             cursor.execute('''
@@ -46,10 +131,24 @@ def init_db():
             
         conn.commit()
 
+    _db_ready = True
+
+
+
+def ensure_db():
+    """Run init_db once per process, used when the app starts lazily"""
+    global _db_ready
+    if _db_ready:
+        return
+    with _db_ready_lock:
+        if not _db_ready:
+            init_db()
+            _db_ready = True
+
 
 # Helper function
 def get_user_by_email(email):
-    with sqlite3.connect("london_health.db") as conn:
+    with connection() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
         value = cursor.fetchone()
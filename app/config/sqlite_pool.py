@@ -0,0 +1,168 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from flask import g, has_app_context
+
+"""Pooled SQLite connections shared by the User model and auth routes.
+Each request borrows one connection for its whole app context and gives it
+back on teardown, so a login no longer pays for several connection setups."""
+
+DB_NAME = "london_health.db"
+
+
+class SQLitePool:
+    """
+    Small thread-safe pool of reusable SQLite connections
+    """
+
+    def __init__(self, path=DB_NAME, size=5, busy_timeout_ms=5000, cached_statements=128):
+        """Set up an empty pool, connections are opened on first use"""
+        self.path = path
+        self.size = size
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._closed = False
+        self.opened = 0
+
+    def _connect(self):
+        """Open a new connection with WAL and the tuned pragmas"""
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        with self._lock:
+            self.opened += 1
+        return conn
+
+    def acquire(self):
+        """Take an idle connection from the pool or open a new one"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn):
+        """Give a connection back, closing it if the pool is full or closed"""
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if not self._closed:
+                try:
+                    self._idle.put_nowait(conn)
+                    return
+                except queue.Full:
+                    pass
+            self.opened -= 1
+        conn.close()
+
+    def close_all(self):
+        """Close every idle connection"""
+        with self._lock:
+            self._closed = True
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                    self.opened -= 1
+                except queue.Empty:
+                    break
+
+    def stats(self):
+        """Open connections (idle or borrowed) and idle ones"""
+        return {"open": self.opened, "idle": self._idle.qsize()}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure_pool(path=DB_NAME, size=None, busy_timeout_ms=None, cached_statements=None):
+    """
+    Create the shared pool, replacing (and closing) any previous one.
+    Unset values are read from the environment.
+    """
+    global _pool
+    new_pool = SQLitePool(
+        path,
+        size=size or int(os.getenv("SQLITE_POOL_SIZE", 5)),
+        busy_timeout_ms=busy_timeout_ms or int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000)),
+        cached_statements=cached_statements or int(os.getenv("SQLITE_CACHED_STATEMENTS", 128)),
+    )
+    with _pool_lock:
+        old_pool, _pool = _pool, new_pool
+    if old_pool is not None:
+        old_pool.close_all()
+    return new_pool
+
+
+def get_pool():
+    """Get the shared pool, creating one with default settings if needed"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = SQLitePool(DB_NAME)
+    return _pool
+
+
+@contextmanager
+def connection():
+    """
+    Borrow a pooled connection.
+    On the thread handling a request the same connection is reused until
+    app teardown, anywhere else it goes straight back to the pool. Commits
+    on success and rolls back on error, like `with sqlite3.connect(...)` did.
+    """
+    # Only the request thread (see claim_connection) keeps a connection in g.
+    # Worker threads of the async views share that g, so they always borrow
+    # and release their own instead of racing to set or share g.sqlite_conn
+    if has_app_context() and g.get("sqlite_owner") == threading.get_ident():
+        if "sqlite_conn" not in g:
+            g.sqlite_conn = get_pool().acquire()
+        conn = g.sqlite_conn
+        owned = False
+    else:
+        conn = get_pool().acquire()
+        owned = True
+
+    try:
+        yield conn
+        if conn.in_transaction:
+            conn.commit()
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        if owned:
+            get_pool().release(conn)
+
+
+def claim_connection():
+    """Let this thread keep one connection for the request (registered as before_request)"""
+    g.sqlite_owner = threading.get_ident()
+
+
+def release_connection(exception=None):
+    """Return the request's connection to the pool (registered as app teardown)"""
+    g.pop("sqlite_owner", None)
+    conn = g.pop("sqlite_conn", None)
+    if conn is not None:
+        get_pool().release(conn)
+
+
+def close_pool():
+    """Close all pooled connections"""
+    global _pool
+    with _pool_lock:
+        old_pool, _pool = _pool, None
+    if old_pool is not None:
+        old_pool.close_all()
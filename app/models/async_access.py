@@ -0,0 +1,61 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+"""Awaitable access to the User and Patient data methods for the async
+dashboard views. Each call runs the existing (pooled, instrumented) method
+on a shared thread pool with the caller's request context, so independent
+MongoDB and SQLite queries of one request overlap instead of queueing."""
+
+# Threads running data calls for async views, per worker process. Keep it
+# within MONGO_MAX_POOL_SIZE plus SQLITE_POOL_SIZE or calls wait for sockets
+ASYNC_DB_THREADS = int(os.getenv("ASYNC_DB_THREADS", 32))
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """This process's data-call threads, started on first use or after a fork"""
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(max_workers=ASYNC_DB_THREADS, thread_name_prefix="db-call")
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def shutdown_executor():
+    """Stop the data-call threads (registered with atexit by the app)"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None and _executor_pid == os.getpid():
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Await func(*args, **kwargs) run on the data-call threads.
+    The request context (session, g, metrics) is copied into the thread.
+    """
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(_get_executor(), call)
+
+
+async def gather(*calls):
+    """
+    Run (func, *args) tuples concurrently and return their results in order.
+    The first exception raised is re-raised once every call has finished.
+    """
+    results = await asyncio.gather(*(run_blocking(*call) for call in calls), return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
@@ -0,0 +1,240 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from app.config.sqlite_pool import connection
+
+"""Who changed which patient or user, written behind the request.
+Routes call AuditLog.record, which only queues the event; a background
+thread inserts queued events into the append-only audit_log table in
+batches. The table and its no-update/no-delete triggers are created by
+init_db."""
+
+# Events waiting to be written, per worker process. When the queue is full
+# a request waits up to AUDIT_PUT_TIMEOUT seconds for room, then writes
+# its event itself, so events are delayed under load but never dropped
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", 10000))
+AUDIT_PUT_TIMEOUT = float(os.getenv("AUDIT_PUT_TIMEOUT", 0.5))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", 200))
+# Longest an event waits in the queue when traffic is light
+AUDIT_FLUSH_SECONDS = float(os.getenv("AUDIT_FLUSH_SECONDS", 1))
+# Attempts at writing a batch before its events are reported lost
+AUDIT_WRITE_ATTEMPTS = 3
+
+# Propagates to the Flask app's logger ("app")
+logger = logging.getLogger(__name__)
+
+INSERT_EVENTS = ("INSERT INTO audit_log (created_at, actor_id, action, target_type, target_id, changes) "
+                 "VALUES (?, ?, ?, ?, ?, ?)")
+
+
+def field_diff(old, new):
+    """{field: [old, new]} for every field of new whose value differs from old"""
+    old = old or {}
+    return {field: [old.get(field), value] for field, value in new.items() if old.get(field) != value}
+
+
+def _insert(events):
+    with connection() as conn:
+        conn.executemany(INSERT_EVENTS, events)
+        conn.commit()
+
+
+class _AuditWriter:
+    """Queue plus the thread draining it, one per process"""
+
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=AUDIT_QUEUE_SIZE)
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.counts_lock = threading.Lock()
+        self.queued = 0
+        self.written = 0
+        self.batches = 0
+        self.direct_writes = 0
+        self.lost = 0
+
+    def submit(self, event):
+        """
+        Queue an event, writing it on the caller's thread if the queue stays
+        full or the writer has been shut down
+        """
+        self._start()
+        try:
+            if self.stopping.is_set():
+                raise queue.Full
+            self.queue.put(event, timeout=AUDIT_PUT_TIMEOUT)
+            with self.counts_lock:
+                self.queued += 1
+        except queue.Full:
+            _insert([event])
+            with self.counts_lock:
+                self.direct_writes += 1
+
+    def _start(self):
+        if self.thread is None or not self.thread.is_alive():
+            with self.lock:
+                if (self.thread is None or not self.thread.is_alive()) and not self.stopping.is_set():
+                    self.thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+                    self.thread.start()
+
+    def _run(self):
+        while not (self.stopping.is_set() and self.queue.empty()):
+            try:
+                batch = [self.queue.get(timeout=AUDIT_FLUSH_SECONDS)]
+            except queue.Empty:
+                continue
+            while len(batch) < AUDIT_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _write(self, batch):
+        for attempt in range(1, AUDIT_WRITE_ATTEMPTS + 1):
+            try:
+                _insert(batch)
+                with self.counts_lock:
+                    self.written += len(batch)
+                    self.batches += 1
+                return
+            except Exception as e:
+                if attempt == AUDIT_WRITE_ATTEMPTS:
+                    with self.counts_lock:
+                        self.lost += len(batch)
+                    logger.error("Audit log: %d events lost: %s", len(batch), e)
+                else:
+                    time.sleep(0.1 * attempt)
+
+    def flush(self, timeout=None):
+        """Wait until every queued event is written. Returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+
+    def shutdown(self, timeout=5):
+        """Write what is queued and stop the thread"""
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        # Anything left (thread never started or stuck) is written here
+        leftover = []
+        while True:
+            try:
+                leftover.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if leftover:
+            self._write(leftover)
+
+
+_writer = _AuditWriter()
+
+
+def _forget_writer():
+    """A forked child has no writer thread and must not write the parent's events"""
+    global _writer
+    _writer = _AuditWriter()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_writer)
+
+
+class AuditLog:
+    """
+    Audit events: (id, created_at, actor_id, action, target_type, target_id, changes)
+    """
+
+    @staticmethod
+    def record(actor_id, action, target_type, target_id=None, changes=None):
+        """
+        Queue an audit event, e.g. record(1, 'update', 'patient', 42, {'age': [40, 41]})
+        The event time is taken now, it is written within AUDIT_FLUSH_SECONDS
+        """
+        created_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        _writer.submit((created_at, actor_id, action, target_type,
+                        None if target_id is None else str(target_id),
+                        json.dumps(changes, default=str) if changes else None))
+
+    @staticmethod
+    def flush(timeout=None):
+        """Wait for queued events to be written, returns False on timeout"""
+        return _writer.flush(timeout)
+
+    @staticmethod
+    def shutdown():
+        """Write queued events and stop the writer (registered with atexit by the app)"""
+        _writer.shutdown()
+
+    @staticmethod
+    def get_page(before=None, after=None, per_page=50, actor_id=None, target_type=None):
+        """
+        Get a page of events, newest first, using keyset pagination on id.
+        before/after are ids from a previous page (older/newer events).
+        Returns tuple of (events list, id for an older page or None, id for a newer page or None)
+        """
+        conditions, params = [], []
+        if actor_id is not None:
+            conditions.append("actor_id = ?")
+            params.append(actor_id)
+        if target_type:
+            conditions.append("target_type = ?")
+            params.append(target_type)
+        newer = after is not None and before is None
+        if newer:
+            conditions.append("id > ?")
+            params.append(after)
+        elif before is not None:
+            conditions.append("id < ?")
+            params.append(before)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        # One extra row tells whether there is another page in that direction
+        with connection() as conn:
+            rows = conn.execute(
+                f"SELECT id, created_at, actor_id, action, target_type, target_id, changes FROM audit_log "
+                f"{where} ORDER BY id {'ASC' if newer else 'DESC'} LIMIT ?",
+                params + [per_page + 1],
+            ).fetchall()
+
+        more = len(rows) > per_page
+        rows = rows[:per_page]
+        if newer:
+            rows.reverse()
+        events = [{'id': row[0], 'created_at': row[1], 'actor_id': row[2], 'action': row[3],
+                   'target_type': row[4], 'target_id': row[5],
+                   'changes': json.loads(row[6]) if row[6] else {}} for row in rows]
+        if not events:
+            return events, None, None
+        older = events[-1]['id'] if (more or newer) else None
+        newer_cursor = events[0]['id'] if (more if newer else before is not None) else None
+        return events, older, newer_cursor
+
+    @staticmethod
+    def stats():
+        """Queue depth and write counts of this process's writer, for /healthz"""
+        writer = _writer
+        return {
+            "enqueued": writer.queued,
+            "queued": writer.queue.qsize(),
+            "queue_limit": AUDIT_QUEUE_SIZE,
+            "written": writer.written,
+            "batches": writer.batches,
+            "direct_writes": writer.direct_writes,
+            "lost": writer.lost,
+        }
@@ -0,0 +1,184 @@
+import os
+import time
+from pymongo import ReplaceOne, UpdateOne
+from app.config.mongo_db import get_db, get_collection
+
+# Materialized stroke counts per cohort, one document per (dimension, value)
+SUMMARY_COLLECTION = os.getenv("COHORT_COLLECTION", "CohortSummary")
+META_ID = "_meta"
+
+# Dashboard breakdowns: dimension name -> patient field
+DIMENSIONS = {
+    'age_band': 'age',
+    'smoking_status': 'smoking_status',
+    'work_type': 'work_type',
+    'Residence_type': 'Residence_type',
+}
+
+# Lower bounds of the age bands, the last band is open ended
+AGE_BANDS = [(0, '0-17'), (18, '18-39'), (40, '40-59'), (60, '60-79'), (80, '80+')]
+
+
+def age_band(age):
+    """Label of the age band an age falls into"""
+    try:
+        age = float(age)
+    except (TypeError, ValueError):
+        return 'Unknown'
+    label = 'Unknown'
+    for lower, name in AGE_BANDS:
+        if age >= lower:
+            label = name
+    return label
+
+
+def cohort_keys(doc):
+    """Summary document ids a patient document is counted under"""
+    keys = []
+    for dimension, field in DIMENSIONS.items():
+        value = doc.get(field)
+        if dimension == 'age_band':
+            value = age_band(value)
+        keys.append((dimension, 'Unknown' if value in (None, '') else str(value)))
+    return keys
+
+
+def _summary_id(dimension, value):
+    return f"{dimension}:{value}"
+
+
+class CohortStats:
+    """
+    CohortStats class - stroke rate breakdowns by cohort
+    Built with aggregation pipelines, stored in SUMMARY_COLLECTION and
+    kept up to date by the Patient write methods
+    """
+
+    @staticmethod
+    def refresh():
+        """
+        Rebuild the whole summary from the patients collection.
+        Grouping runs in Mongo, only one row per distinct value comes back.
+        Returns number of summary documents written
+        """
+        patients = get_collection()
+        summary = get_db()[SUMMARY_COLLECTION]
+        counts = {}
+
+        for dimension, field in DIMENSIONS.items():
+            pipeline = [
+                {'$group': {'_id': f'${field}', 'patients': {'$sum': 1}, 'strokes': {'$sum': '$stroke'}}}
+            ]
+            for row in patients.aggregate(pipeline):
+                value = row['_id']
+                if dimension == 'age_band':
+                    value = age_band(value)
+                key = (dimension, 'Unknown' if value in (None, '') else str(value))
+                bucket = counts.setdefault(key, {'patients': 0, 'strokes': 0})
+                bucket['patients'] += row['patients']
+                bucket['strokes'] += row['strokes'] or 0
+
+        ops = [
+            ReplaceOne(
+                {'_id': _summary_id(dimension, value)},
+                {'dimension': dimension, 'value': value, **bucket},
+                upsert=True,
+            )
+            for (dimension, value), bucket in counts.items()
+        ]
+        ops.append(ReplaceOne({'_id': META_ID}, {'built_at': time.time()}, upsert=True))
+        summary.bulk_write(ops, ordered=False)
+
+        # Drop cohorts that no longer have any patients
+        keep = [_summary_id(dimension, value) for dimension, value in counts] + [META_ID]
+        summary.delete_many({'_id': {'$nin': keep}})
+        return len(counts)
+
+    @staticmethod
+    def record_change(old_doc=None, new_doc=None):
+        """
+        Apply one patient create (old_doc None), update or delete (new_doc None)
+        to the summary with $inc, instead of re-aggregating everything.
+        Does nothing until the summary has been built once.
+        """
+        CohortStats.record_changes([(old_doc, new_doc)])
+
+    @staticmethod
+    def record_changes(changes):
+        """Apply many (old_doc, new_doc) pairs in one bulk write, see record_change"""
+        summary = get_db()[SUMMARY_COLLECTION]
+        if summary.find_one({'_id': META_ID}, {'_id': 1}) is None:
+            return
+
+        deltas = {}
+        for old_doc, new_doc in changes:
+            for doc, sign in ((old_doc, -1), (new_doc, 1)):
+                if not doc:
+                    continue
+                stroke = 1 if doc.get('stroke') == 1 else 0
+                for key in cohort_keys(doc):
+                    patients, strokes = deltas.get(key, (0, 0))
+                    deltas[key] = (patients + sign, strokes + sign * stroke)
+
+        ops = [
+            UpdateOne(
+                {'_id': _summary_id(dimension, value)},
+                {'$inc': {'patients': patients, 'strokes': strokes},
+                 '$set': {'dimension': dimension, 'value': value}},
+                upsert=True,
+            )
+            for (dimension, value), (patients, strokes) in deltas.items()
+            if patients or strokes
+        ]
+        if ops:
+            summary.bulk_write(ops, ordered=False)
+
+    @staticmethod
+    def invalidate():
+        """Throw the summary away so the next read rebuilds it (e.g. after seeding)"""
+        get_db()[SUMMARY_COLLECTION].delete_many({})
+
+    @staticmethod
+    def get_summary():
+        """
+        Get the stroke breakdowns, building the summary on first use
+        Returns dict with totals and a list of cohorts per dimension
+        """
+        summary = get_db()[SUMMARY_COLLECTION]
+        docs = list(summary.find())
+        if not any(doc['_id'] == META_ID for doc in docs):
+            CohortStats.refresh()
+            docs = list(summary.find())
+
+        result = {dimension: [] for dimension in DIMENSIONS}
+        built_at = None
+        for doc in docs:
+            if doc['_id'] == META_ID:
+                built_at = doc.get('built_at')
+                continue
+            if doc.get('patients', 0) <= 0 or doc.get('dimension') not in result:
+                continue
+            result[doc['dimension']].append({
+                'value': doc['value'],
+                'patients': doc['patients'],
+                'strokes': doc['strokes'],
+                'stroke_rate': doc['strokes'] / doc['patients'],
+            })
+
+        for dimension, rows in result.items():
+            if dimension == 'age_band':
+                order = [name for _, name in AGE_BANDS] + ['Unknown']
+                rows.sort(key=lambda row: order.index(row['value']) if row['value'] in order else len(order))
+            else:
+                rows.sort(key=lambda row: -row['patients'])
+
+        # Every patient is in exactly one age band, so it gives the totals
+        total = sum(row['patients'] for row in result['age_band'])
+        strokes = sum(row['strokes'] for row in result['age_band'])
+        return {
+            'total_patients': total,
+            'total_strokes': strokes,
+            'stroke_rate': strokes / total if total else 0,
+            'built_at': built_at,
+            'cohorts': result,
+        }
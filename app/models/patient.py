@@ -1,16 +1,133 @@
 from app.config.mongo_db import get_collection
+from app.models.cohort import CohortStats
+from app.models.risk import RiskModel
+from app.models.snapshot import PatientSnapshot
+from app.models.audit import field_diff
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
 from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from utils.cache import TTLCache
+from utils.metrics import instrument_class
+from utils.fragment_cache import fragment_cache
+import base64
+import json
+
+# How long (in seconds) the dashboard's patient counts are reused
+COUNT_CACHE_TTL = 30
+_count_cache = TTLCache(maxsize=128, ttl=COUNT_CACHE_TTL)
+
+
+# Document fields a patient row is built from, in Patient.__init__ order
+# (after patient_id/_id). Used as the Mongo projection so nothing else is decoded.
+DOC_FIELDS = ('gender', 'age', 'hypertension', 'heart_disease', 'ever_married', 'work_type',
+              'Residence_type', 'avg_glucose_level', 'bmi', 'smoking_status', 'stroke')
+# risk_score is derived (see RiskModel), so it is fetched but not a DOC_FIELD
+PATIENT_PROJECTION = {field: 1 for field in ('id',) + DOC_FIELDS + ('risk_score',)}
+# Single patient pages also need the version counter for their ETag
+DETAIL_PROJECTION = {**PATIENT_PROJECTION, 'version': 1}
+
+# Collection (in the patients' database) holding per-collection change
+# counters, bumped by every patient write so list pages can be revalidated
+VERSION_COLLECTION = "Versions"
+
+# Dashboard filters: exact matches and (min, max) ranges, keyed by filter name
+MATCH_FILTERS = {
+    'gender': 'gender',
+    'work_type': 'work_type',
+    'smoking_status': 'smoking_status',
+    'hypertension': 'hypertension',
+    'heart_disease': 'heart_disease',
+    'stroke': 'stroke',
+}
+RANGE_FILTERS = {
+    'age': 'age',
+    'glucose': 'avg_glucose_level',
+    'bmi': 'bmi',
+}
+
+# Fields the dashboard can sort by, "_id" is newest/oldest first
+SORT_FIELDS = ('_id', 'id', 'age', 'avg_glucose_level', 'bmi', 'risk_score')
+
+
+def build_query(filters=None):
+    """
+    Turn dashboard filters into a Mongo query.
+    filters uses MATCH_FILTERS names for exact values and
+    <RANGE_FILTERS name>_min / _max for ranges; None values are ignored.
+    """
+    query = {}
+    for name, field in MATCH_FILTERS.items():
+        value = (filters or {}).get(name)
+        if value is not None and value != '':
+            query[field] = value
+    for name, field in RANGE_FILTERS.items():
+        bounds = {}
+        low = (filters or {}).get(f"{name}_min")
+        high = (filters or {}).get(f"{name}_max")
+        if low is not None:
+            bounds['$gte'] = low
+        if high is not None:
+            bounds['$lte'] = high
+        if bounds:
+            query[field] = bounds
+    return query
+
+
+def encode_cursor(direction, object_id, sort_field="_id", value=None):
+    """Turn a page direction, sort position and Mongo _id into an opaque url-safe token"""
+    raw = json.dumps([direction, str(object_id), sort_field, value]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token, sort_field="_id"):
+    """
+    Turn a token made by encode_cursor back into (direction, ObjectId, value)
+    Raises ValueError if the token is not valid or was made for another sort
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        direction, object_id, token_sort, value = json.loads(base64.urlsafe_b64decode(padded))
+        if direction not in ("next", "prev") or token_sort != sort_field:
+            raise ValueError
+        return direction, ObjectId(object_id), value
+    except (ValueError, TypeError, InvalidId, UnicodeDecodeError):
+        raise ValueError("Invalid page cursor.")
+
+
+def _after(sort_field, order, value, object_id):
+    """
+    Query for rows that come after (value, object_id) in the given sort order.
+    MongoDB sorts null and missing values before any number, so they come
+    first ascending and last descending; a range alone never matches them
+    """
+    op = '$gt' if order == 1 else '$lt'
+    if sort_field == '_id':
+        return {'_id': {op: object_id}}
+    same = {sort_field: value, '_id': {op: object_id}}
+    if value is None:
+        # {field: None} matches null and missing
+        return {'$or': [same, {sort_field: {'$ne': None}}]} if order == 1 else same
+    after = [{sort_field: {op: value}}, same]
+    if order != 1:
+        after.append({sort_field: None})
+    return {'$or': after}
 
 
 class Patient:
     """
     Patient class - handles all patient database operations
     CREATE, READ, UPDATE, DELETE patients
+    Read methods return Patient rows (slotted, no per-row dict)
     """
 
+    __slots__ = ('patient_id', 'id', 'gender', 'age', 'hypertension', 'heart_disease',
+                 'ever_married', 'work_type', 'residence_type', 'avg_glucose_level',
+                 'bmi', 'smoking_status', 'stroke', 'risk_score', 'version')
+
     def __init__(self, patient_id, id, gender, age, hypertension, heart_disease, 
                  ever_married, work_type, residence_type, avg_glucose_level, 
-                 bmi, smoking_status, stroke):
+                 bmi, smoking_status, stroke, risk_score=None, version=0):
         """Initialize a patient object with their details"""
         self.patient_id = patient_id
         self.id = id
@@ -25,6 +142,35 @@ class Patient:
         self.bmi = bmi
         self.smoking_status = smoking_status
         self.stroke = stroke
+        self.risk_score = risk_score
+        self.version = version
+
+    @classmethod
+    def from_doc(cls, doc):
+        """Build a patient row from a Mongo document fetched with PATIENT_PROJECTION"""
+        get = doc.get
+        return cls(get('id'), str(doc['_id']), *[get(field) for field in DOC_FIELDS],
+                   risk_score=get('risk_score'), version=get('version', 0))
+
+    @property
+    def Residence_type(self):
+        """Same name as the Mongo field, used by the templates"""
+        return self.residence_type
+
+    def __getitem__(self, key):
+        """Allow dictionary style access, e.g. patient['age']"""
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def to_dict(self):
+        """Plain dictionary of the row, keyed like the Mongo document"""
+        return {
+            'patient_id': self.patient_id,
+            'id': self.id,
+            **{field: getattr(self, field) for field in DOC_FIELDS},
+        }
 
     @staticmethod
     def create_patient(id, gender, age, hypertension, heart_disease, ever_married, 
@@ -34,7 +180,7 @@ class Patient:
         Add a new patient to the database
         Raises ValueError if patient id already exists
         """
-        existing_patient = Patient.get_by_patient_id(id)
+        existing_patient = get_collection().find_one({'id': id}, {'_id': 1})
         if existing_patient:
             raise ValueError("A patient with this ID already exists")
 
@@ -52,39 +198,90 @@ class Patient:
             'avg_glucose_level': avg_glucose_level,
             'bmi': bmi,
             'smoking_status': smoking_status,
-            'stroke': stroke
+            'stroke': stroke,
+            'version': 1
         }
+        Patient._add_risk_scores([patient_data])
         result = collection.insert_one(patient_data)
+        Patient.clear_count_cache()
+        Patient._record_change(None, patient_data)
         return str(result.inserted_id)
 
+    @staticmethod
+    def bulk_create(records):
+        """
+        Add many already validated patient documents at once
+        Duplicate ids (in the database or repeated in records) are found
+        with a single $in query, the rest go in one unordered insert.
+        Returns tuple of (number inserted, list of (index, error message))
+        """
+        collection = get_collection()
+        errors = []
+        ids = [record['id'] for record in records]
+        existing = {doc['id'] for doc in collection.find({'id': {'$in': ids}}, {'id': 1, '_id': 0})}
+
+        seen = set()
+        to_insert, positions = [], []
+        for index, record in enumerate(records):
+            if record['id'] in existing:
+                errors.append((index, "A patient with this ID already exists"))
+            elif record['id'] in seen:
+                errors.append((index, "Duplicate patient ID in upload"))
+            else:
+                seen.add(record['id'])
+                record['version'] = 1
+                to_insert.append(record)
+                positions.append(index)
+
+        failed = set()
+        if to_insert:
+            Patient._add_risk_scores(to_insert)
+            try:
+                collection.insert_many(to_insert, ordered=False)
+            except BulkWriteError as e:
+                # e.g. another request inserted the same id in the meantime
+                for error in e.details.get('writeErrors', []):
+                    failed.add(error['index'])
+                    message = ("A patient with this ID already exists"
+                               if error.get('code') == 11000 else error.get('errmsg', 'Insert failed'))
+                    errors.append((positions[error['index']], message))
+
+        inserted = [record for i, record in enumerate(to_insert) if i not in failed]
+        if inserted:
+            Patient.clear_count_cache()
+            try:
+                CohortStats.record_changes([(None, record) for record in inserted])
+            except Exception as e:
+                print(f"Could not update cohort summary: {e}")
+            PatientSnapshot.record_changes([(None, record) for record in inserted])
+            Patient.bump_collection_version()
+        errors.sort()
+        return len(inserted), errors
+
     @staticmethod
     def get_all_patients():
         """
         Get all patients from database
-        Returns list of patient dictionaries
+        Returns list of Patient rows
         """
         collection = get_collection()
-        patients = []
-        
-        for doc in collection.find():
-            patient = {
-                'patient_id': doc.get('id'), 
-                'id': str(doc['_id']) ,            
-                'gender': doc.get('gender'),
-                'age': doc.get('age'),
-                'hypertension': doc.get('hypertension'),
-                'heart_disease': doc.get('heart_disease'),
-                'ever_married': doc.get('ever_married'),
-                'work_type': doc.get('work_type'),
-                'Residence_type': doc.get('Residence_type'),
-                'avg_glucose_level': doc.get('avg_glucose_level'),
-                'bmi': doc.get('bmi'),
-                'smoking_status': doc.get('smoking_status'),
-                'stroke': doc.get('stroke')
-            }
-            patients.append(patient)
+        return [Patient.from_doc(doc) for doc in collection.find({}, PATIENT_PROJECTION)]
 
-        return patients
+    @staticmethod
+    def iter_patients(filters=None, batch_size=1000):
+        """
+        Stream patients matching the dashboard filters, oldest first
+        Yields plain documents (id plus DOC_FIELDS) one at a time, so
+        memory stays flat however many patients there are
+        """
+        collection = get_collection()
+        projection = {'_id': 0, **PATIENT_PROJECTION}
+        cursor = collection.find(build_query(filters), projection).sort('_id', 1).batch_size(batch_size)
+        try:
+            for doc in cursor:
+                yield doc
+        finally:
+            cursor.close()
 
     @staticmethod
     def get_paginated_patients(page=1, per_page=10):
@@ -92,131 +289,153 @@ class Patient:
             Get paginated patients from database
             Returns tuple of (patients list, total count)
             """
-            collection = get_collection()
-            
-            # Get total count
-            total = collection.count_documents({})
-            
-            # Calculate skip value
             skip = (page - 1) * per_page
-            
-            # Get paginated results, sorted by newest first
-            patients = []
-            cursor = (
-                collection.find()
-                .sort("_id", -1)      # sort by Mongo's _id
-                .skip(skip)
-                .limit(per_page)
-            )
+            patients, _, _ = Patient.get_keyset_patients(per_page=per_page, skip=skip)
+            return patients, Patient.get_total_count()
 
-            for doc in cursor:
-                patient = {
-                    'patient_id': doc.get('id'),
-                    'gender': doc.get('gender'),
-                    'age': doc.get('age'),
-                    'hypertension': doc.get('hypertension'),
-                    'heart_disease': doc.get('heart_disease'),
-                    'ever_married': doc.get('ever_married'),
-                    'work_type': doc.get('work_type'),
-                    'Residence_type': doc.get('Residence_type'),
-                    'avg_glucose_level': doc.get('avg_glucose_level'),
-                    'bmi': doc.get('bmi'),
-                    'smoking_status': doc.get('smoking_status'),
-                    'stroke': doc.get('stroke')
-                }
-                patients.append(patient)
-
-            return patients, total
+    @staticmethod
+    def get_keyset_patients(cursor=None, per_page=10, skip=0, filters=None, sort_by="_id", order=-1):
+        """
+        Get a page of patients using keyset (cursor) pagination.
+        Rows are filtered in Mongo (see build_query) and ordered by
+        sort_by/order with _id as tie-breaker, newest first by default.
+        cursor is a token from a previous page; without one the page
+        starts `skip` rows from the top.
+        Returns tuple of (patients list, next cursor, prev cursor)
+        Raises ValueError if the cursor or sort field is not valid
+        """
+        if sort_by not in SORT_FIELDS:
+            raise ValueError("Invalid sort field.")
+        order = 1 if order == 1 else -1
+
+        collection = get_collection()
+        query = build_query(filters)
+
+        if cursor:
+            direction, object_id, value = decode_cursor(cursor, sort_by)
+        else:
+            direction, object_id, value = "next", None, None
+
+        # Walking backwards means reading in the opposite order, then flipping
+        read_order = order if direction == "next" else -order
+        if object_id is not None:
+            position = _after(sort_by, read_order, value, object_id)
+            query = {'$and': [query, position]} if query else position
+
+        sort = [(sort_by, read_order)] if sort_by == '_id' else [(sort_by, read_order), ('_id', read_order)]
+
+        # Fetch one extra row to find out if there is another page after this one
+        docs = list(
+            collection.find(query, PATIENT_PROJECTION)
+            .sort(sort)
+            .skip(skip if object_id is None else 0)
+            .limit(per_page + 1)
+        )
+        has_more = len(docs) > per_page
+        docs = docs[:per_page]
+
+        if direction == "next":
+            has_next, has_prev = has_more, object_id is not None or skip > 0
+        else:
+            docs = docs[::-1]
+            has_next, has_prev = True, has_more
+
+        patients = [Patient.from_doc(doc) for doc in docs]
+
+        def token(direction, doc):
+            value = None if sort_by == '_id' else doc.get(sort_by)
+            return encode_cursor(direction, doc['_id'], sort_by, value)
+
+        next_cursor = token("next", docs[-1]) if docs and has_next else None
+        prev_cursor = token("prev", docs[0]) if docs and has_prev else None
+
+        return patients, next_cursor, prev_cursor
+
+    @staticmethod
+    def get_total_count(filters=None):
+        """
+        Get the number of patients matching the dashboard filters
+        Without filters the collection metadata count is used. Counts are
+        cached for COUNT_CACHE_TTL seconds so page views do not rescan
+        """
+        query = build_query(filters)
+        key = json.dumps(query, sort_keys=True, default=str)
+        total = _count_cache.get(key)
+        if total is None:
+            collection = get_collection()
+            total = collection.count_documents(query) if query else collection.estimated_document_count()
+            _count_cache.set(key, total)
+        return total
+
+    @staticmethod
+    def clear_count_cache():
+        """Forget the cached patient counts after patients are added or removed"""
+        _count_cache.clear()
 
     @staticmethod
     def get_by_id(patient_id):
         """
-        Get a specific patient by their MongoDB _id
-        Returns patient dictionary or None if not found
+        Get a specific patient by their patient id
+        Returns Patient row or None if not found
         """
         collection = get_collection()
         
         try:
-            doc = collection.find_one({'id': patient_id})
+            doc = collection.find_one({'id': patient_id}, DETAIL_PROJECTION)
         except:
             return None
 
-        if doc:
-            patient = {
-                'id': str(doc['_id']) ,
-                'patient_id':doc.get('id'),
-                'id': doc.get('id'),
-                'gender': doc.get('gender'),
-                'age': doc.get('age'),
-                'hypertension': doc.get('hypertension'),
-                'heart_disease': doc.get('heart_disease'),
-                'ever_married': doc.get('ever_married'),
-                'work_type': doc.get('work_type'),
-                'Residence_type': doc.get('Residence_type'),
-                'avg_glucose_level': doc.get('avg_glucose_level'),
-                'bmi': doc.get('bmi'),
-                'smoking_status': doc.get('smoking_status'),
-                'stroke': doc.get('stroke')
-            }
-            return patient
-        
-        return None
+        return Patient.from_doc(doc) if doc else None
 
     @staticmethod
     def get_by_patient_id(id):
         """
         Find a patient by their patient id field
-        Returns patient dictionary or None if not found
+        Returns Patient row or None if not found
         """
         collection = get_collection()
-        doc = collection.find_one({'id': id})
-
-        if doc:
-            patient = {
-                'id': str(doc['_id']),
-                'patient_id': doc.get('id'),
-                'gender': doc.get('gender'),
-                'age': doc.get('age'),
-                'hypertension': doc.get('hypertension'),
-                'heart_disease': doc.get('heart_disease'),
-                'ever_married': doc.get('ever_married'),
-                'work_type': doc.get('work_type'),
-                'Residence_type': doc.get('Residence_type'),
-                'avg_glucose_level': doc.get('avg_glucose_level'),
-                'bmi': doc.get('bmi'),
-                'smoking_status': doc.get('smoking_status'),
-                'stroke': doc.get('stroke')
-            }
-            return patient
-        
-        return None
+        doc = collection.find_one({'id': id}, PATIENT_PROJECTION)
+        return Patient.from_doc(doc) if doc else None
 
     @staticmethod
     def update(patient_id, gender, age, hypertension, heart_disease, ever_married,
                work_type, residence_type, avg_glucose_level, bmi, smoking_status, stroke):
         """
         Update a patient's information
-        Returns True if successful, False if patient not found
+        Returns {field: [old, new]} for the fields that changed, None if patient not found
         """
         try:
             collection = get_collection()
-            result = collection.update_one(
+            changes = {
+                'gender': gender,
+                'age': age,
+                'hypertension': hypertension,
+                'heart_disease': heart_disease,
+                'ever_married': ever_married,
+                'work_type': work_type,
+                'Residence_type': residence_type,
+                'avg_glucose_level': avg_glucose_level,
+                'bmi': bmi,
+                'smoking_status': smoking_status,
+                'stroke': stroke
+            }
+            scored = dict(changes)
+            Patient._add_risk_scores([scored])
+            # The old values are needed to move the patient between cohorts
+            old_doc = collection.find_one_and_update(
                 {'id': patient_id},
-                {'$set': {
-                    'gender': gender,
-                    'age': age,
-                    'hypertension': hypertension,
-                    'heart_disease': heart_disease,
-                    'ever_married': ever_married,
-                    'work_type': work_type,
-                    'Residence_type': residence_type,
-                    'avg_glucose_level': avg_glucose_level,
-                    'bmi': bmi,
-                    'smoking_status': smoking_status,
-                    'stroke': stroke
-                }}
+                {'$set': scored, '$inc': {'version': 1}},
+                projection=PATIENT_PROJECTION,
+                return_document=ReturnDocument.BEFORE
             )
-            return result.modified_count > 0
+            if old_doc is None:
+                return None
+            diff = field_diff(old_doc, changes)
+            if diff:
+                # Filtered counts may have changed
+                Patient.clear_count_cache()
+                Patient._record_change(old_doc, {**old_doc, **scored})
+            return diff
         except Exception as e:
             raise ValueError(f"Failed to update patient: {e}")
 
@@ -226,5 +445,63 @@ class Patient:
         Delete a patient from database
         """
         collection = get_collection()
-        result = collection.delete_one({'id': patient_id})
-        return result.deleted_count > 0
+        old_doc = collection.find_one_and_delete({'id': patient_id}, projection=PATIENT_PROJECTION)
+        if old_doc is not None:
+            Patient.clear_count_cache()
+            Patient._record_change(old_doc, None)
+        return old_doc is not None
+
+    @staticmethod
+    def get_version(patient_id):
+        """
+        A patient's version counter, one lookup on the id index
+        Returns 0 for patients stored before versions existed, None if not found
+        """
+        doc = get_collection().find_one({'id': patient_id}, {'version': 1, '_id': 0})
+        return None if doc is None else doc.get('version', 0)
+
+    @staticmethod
+    def collection_version():
+        """Change counter for the whole patients collection, 0 before the first write"""
+        collection = get_collection()
+        doc = collection.database[VERSION_COLLECTION].find_one({'_id': collection.name})
+        return doc['version'] if doc else 0
+
+    @staticmethod
+    def bump_collection_version(collection=None):
+        """Mark every patient list (and cached table rows) stale, a failure must not fail the write"""
+        fragment_cache.invalidate('patients')
+        try:
+            collection = collection if collection is not None else get_collection()
+            collection.database[VERSION_COLLECTION].update_one(
+                {'_id': collection.name}, {'$inc': {'version': 1}}, upsert=True)
+        except Exception as e:
+            print(f"Could not bump patients version: {e}")
+
+    @staticmethod
+    def _record_change(old_doc, new_doc):
+        """
+        Keep the cohort summary, this process's snapshot and the collection
+        version in step, a stats failure must not fail the write
+        """
+        try:
+            CohortStats.record_change(old_doc, new_doc)
+        except Exception as e:
+            print(f"Could not update cohort summary: {e}")
+        PatientSnapshot.record_change(old_doc, new_doc)
+        Patient.bump_collection_version()
+
+    @staticmethod
+    def _add_risk_scores(docs):
+        """Set risk_score on documents about to be written, a scoring failure must not fail the write"""
+        try:
+            model = RiskModel.current()
+            if model is not None:
+                for doc, score in zip(docs, model.score_docs(docs)):
+                    doc['risk_score'] = score
+        except Exception as e:
+            print(f"Could not score patient risk: {e}")
+
+
+# Time every data method for /metrics and the Server-Timing header
+instrument_class(Patient, "mongo")
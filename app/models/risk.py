@@ -0,0 +1,276 @@
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+from pymongo import UpdateOne
+from app.config.mongo_db import get_db, get_collection
+from app.models.snapshot import PatientSnapshot
+from utils.cache import TTLCache
+from utils.fragment_cache import fragment_cache
+
+# Fitted coefficients are stored here so every worker scores the same way
+MODEL_COLLECTION = os.getenv("RISK_MODEL_COLLECTION", "RiskModel")
+MODEL_ID = "current"
+
+# How long (in seconds) a worker reuses the stored model before re-reading it
+RISK_MODEL_TTL = int(os.getenv("RISK_MODEL_TTL", 60))
+# How long a worker remembers that no model has been fitted yet
+RISK_MODEL_MISS_TTL = float(os.getenv("RISK_MODEL_MISS_TTL", 5))
+_model_cache = TTLCache(maxsize=1, ttl=RISK_MODEL_TTL)
+_NO_MODEL = object()
+_refresh_lock = threading.Lock()
+
+# Rows per bulk write when storing scores
+SCORE_BATCH_SIZE = int(os.getenv("RISK_SCORE_BATCH_SIZE", 1000))
+
+# Patient fields the model reads, and the model's input features
+SOURCE_FIELDS = ('age', 'hypertension', 'heart_disease', 'avg_glucose_level', 'bmi', 'smoking_status')
+FEATURES = ('age', 'hypertension', 'heart_disease', 'avg_glucose_level', 'bmi', 'smokes', 'formerly_smoked')
+FEATURE_LABELS = {
+    'age': 'Age',
+    'hypertension': 'Hypertension',
+    'heart_disease': 'Heart disease',
+    'avg_glucose_level': 'Glucose level',
+    'bmi': 'BMI',
+    'smokes': 'Smokes',
+    'formerly_smoked': 'Formerly smoked',
+}
+
+# Upper bounds of the risk bands shown next to a score
+RISK_BANDS = [(0.05, 'Low'), (0.15, 'Moderate'), (1.01, 'High')]
+
+
+def risk_band(score):
+    """Label for a stroke probability, None when there is no score"""
+    if score is None:
+        return None
+    for upper, name in RISK_BANDS:
+        if score < upper:
+            return name
+    return RISK_BANDS[-1][1]
+
+
+def load_frame(collection=None, batch_size=SCORE_BATCH_SIZE):
+    """
+    Columnar snapshot of the fields the model needs, one row per patient.
+    Only _id, stroke, the current risk_score and SOURCE_FIELDS are fetched.
+    """
+    collection = collection if collection is not None else get_collection()
+    columns = ('_id', 'stroke', 'risk_score') + SOURCE_FIELDS
+    cursor = collection.find({}, {field: 1 for field in columns}).batch_size(batch_size)
+    return pd.DataFrame.from_records(cursor, columns=columns)
+
+
+def _numeric(frame, field, fill=0.0):
+    """One column as float64, missing or non numeric values replaced by fill"""
+    if field not in frame:
+        return np.full(len(frame), fill)
+    return pd.to_numeric(frame[field], errors='coerce').fillna(fill).to_numpy(dtype=np.float64)
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -35, 35)))
+
+
+def fit_logistic(X, y, l2=1.0, max_iter=50, tol=1e-8):
+    """
+    Fit an L2 regularised logistic regression with Newton's method.
+    X should already be standardised; the intercept is not penalised.
+    Returns (coefficients, intercept)
+    """
+    rows, width = X.shape
+    design = np.hstack([np.ones((rows, 1)), X])
+    weights = np.zeros(width + 1)
+    penalty = np.eye(width + 1) * l2
+    penalty[0, 0] = 0.0
+
+    for _ in range(max_iter):
+        p = _sigmoid(design @ weights)
+        gradient = design.T @ (p - y) + penalty @ weights
+        hessian = (design * (p * (1 - p))[:, None]).T @ design + penalty
+        step = np.linalg.solve(hessian + np.eye(width + 1) * 1e-9, gradient)
+        weights -= step
+        if np.max(np.abs(step)) < tol:
+            break
+    return weights[1:], weights[0]
+
+
+class RiskModel:
+    """
+    RiskModel class - logistic stroke risk model over the patient fields
+    fit and score work on whole DataFrames at once, the scores are stored
+    on the patient documents as risk_score so the dashboard can sort by them
+    """
+
+    def __init__(self, mean, scale, coef, intercept, bmi_fill, patients=0, strokes=0, fitted_at=None):
+        """Initialize a model from its fitted parameters"""
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.coef = np.asarray(coef, dtype=np.float64)
+        self.intercept = float(intercept)
+        self.bmi_fill = float(bmi_fill)
+        self.patients = patients
+        self.strokes = strokes
+        self.fitted_at = fitted_at
+
+    @staticmethod
+    def features(frame, bmi_fill):
+        """Feature matrix (rows x FEATURES) for a frame of patient fields"""
+        bmi = _numeric(frame, 'bmi')
+        # The seed stores missing BMI as 0
+        bmi = np.where(bmi > 0, bmi, bmi_fill)
+        smoking = frame['smoking_status'] if 'smoking_status' in frame else pd.Series([''] * len(frame))
+        return np.column_stack([
+            _numeric(frame, 'age'),
+            _numeric(frame, 'hypertension'),
+            _numeric(frame, 'heart_disease'),
+            _numeric(frame, 'avg_glucose_level'),
+            bmi,
+            (smoking == 'smokes').to_numpy(dtype=np.float64),
+            (smoking == 'formerly smoked').to_numpy(dtype=np.float64),
+        ])
+
+    @classmethod
+    def fit(cls, frame, l2=1.0):
+        """
+        Fit the model on a frame with SOURCE_FIELDS and the stroke label
+        Raises ValueError if the frame has no strokes or no non-strokes
+        """
+        y = (_numeric(frame, 'stroke') == 1).astype(np.float64)
+        if y.size == 0 or y.min() == y.max():
+            raise ValueError("Need patients with and without a stroke to fit the risk model.")
+
+        bmi = _numeric(frame, 'bmi')
+        bmi_fill = float(np.median(bmi[bmi > 0])) if (bmi > 0).any() else 0.0
+        X = cls.features(frame, bmi_fill)
+        mean = X.mean(axis=0)
+        scale = X.std(axis=0)
+        scale[scale == 0] = 1.0
+
+        coef, intercept = fit_logistic((X - mean) / scale, y, l2=l2)
+        return cls(mean, scale, coef, intercept, bmi_fill,
+                   patients=int(y.size), strokes=int(y.sum()), fitted_at=time.time())
+
+    def score(self, frame):
+        """Stroke probability for every row of the frame, as a numpy array"""
+        X = (self.features(frame, self.bmi_fill) - self.mean) / self.scale
+        return _sigmoid(X @ self.coef + self.intercept)
+
+    def score_docs(self, docs):
+        """Scores for a list of patient documents, rounded like the stored ones"""
+        if not docs:
+            return []
+        frame = pd.DataFrame.from_records(docs, columns=SOURCE_FIELDS)
+        return [round(float(score), 4) for score in self.score(frame)]
+
+    def explain(self, doc, top=3):
+        """
+        Features pushing one patient's risk up the most
+        Returns list of (label, contribution in log-odds) largest first
+        """
+        frame = pd.DataFrame.from_records([doc], columns=SOURCE_FIELDS)
+        contributions = ((self.features(frame, self.bmi_fill) - self.mean) / self.scale)[0] * self.coef
+        ranked = sorted(zip(FEATURES, contributions), key=lambda item: -item[1])
+        return [(FEATURE_LABELS[name], float(value)) for name, value in ranked[:top] if value > 0]
+
+    def to_doc(self):
+        """Mongo document for the model"""
+        return {
+            'features': list(FEATURES),
+            'mean': self.mean.tolist(),
+            'scale': self.scale.tolist(),
+            'coef': self.coef.tolist(),
+            'intercept': self.intercept,
+            'bmi_fill': self.bmi_fill,
+            'patients': self.patients,
+            'strokes': self.strokes,
+            'fitted_at': self.fitted_at,
+        }
+
+    @classmethod
+    def from_doc(cls, doc):
+        """Model from a document made by to_doc, None if it is for other features"""
+        if doc is None or doc.get('features') != list(FEATURES):
+            return None
+        return cls(doc['mean'], doc['scale'], doc['coef'], doc['intercept'], doc['bmi_fill'],
+                   doc.get('patients', 0), doc.get('strokes', 0), doc.get('fitted_at'))
+
+    @staticmethod
+    def current():
+        """
+        The stored model, cached for RISK_MODEL_TTL seconds
+        Returns RiskModel or None if none has been fitted yet. Never fits one,
+        that is left to the seeder, `flask score-risk` or a background job
+        """
+        model = _model_cache.get(MODEL_ID)
+        if model is None:
+            model = RiskModel.from_doc(get_db()[MODEL_COLLECTION].find_one({'_id': MODEL_ID}))
+            if model is not None:
+                _model_cache.set(MODEL_ID, model)
+            else:
+                # Pages keep rendering "no score" without a lookup each time
+                _model_cache.set(MODEL_ID, _NO_MODEL, ttl=RISK_MODEL_MISS_TTL)
+        return None if model is _NO_MODEL else model
+
+    @staticmethod
+    def refresh(collection=None):
+        """
+        Refit the model on every patient and store the new scores.
+        Reads the process's PatientSnapshot unless a collection is passed
+        (the seeder does, as it writes behind the snapshot's back).
+        Only documents whose rounded score changed are written.
+        Returns dict with counts and timings, or None if the model could not be fitted
+        """
+        with _refresh_lock:
+            started = time.perf_counter()
+            snapshot = None
+            if collection is not None:
+                frame = load_frame(collection)
+            else:
+                collection = get_collection()
+                snapshot = PatientSnapshot.current()
+                frame = snapshot.frame(('stroke', 'risk_score') + SOURCE_FIELDS, with_object_ids=True)
+            try:
+                model = RiskModel.fit(frame)
+            except ValueError as e:
+                print(f"Risk model not fitted: {e}")
+                return None
+            fitted = time.perf_counter()
+
+            scores = np.round(model.score(frame), 4)
+            old = pd.to_numeric(frame['risk_score'], errors='coerce').to_numpy(dtype=np.float64)
+            changed = np.flatnonzero(np.isnan(old) | (old != scores))
+            ids = frame['_id'].to_numpy()
+            scored = time.perf_counter()
+
+            for start in range(0, changed.size, SCORE_BATCH_SIZE):
+                chunk = changed[start:start + SCORE_BATCH_SIZE]
+                collection.bulk_write(
+                    [UpdateOne({'_id': ids[i]}, {'$set': {'risk_score': float(scores[i])}}) for i in chunk],
+                    ordered=False,
+                )
+            if snapshot is not None:
+                snapshot.set_values('risk_score', ids[changed], scores[changed])
+
+            get_db()[MODEL_COLLECTION].replace_one({'_id': MODEL_ID}, model.to_doc(), upsert=True)
+            _model_cache.set(MODEL_ID, model)
+            # The dashboard's cached rows show the old scores
+            fragment_cache.invalidate('patients')
+
+            finished = time.perf_counter()
+            stats = {
+                'patients': len(frame),
+                'updated': int(changed.size),
+                'fit_seconds': round(fitted - started, 3),
+                'score_seconds': round(scored - fitted, 3),
+                'seconds': round(finished - started, 3),
+            }
+            print(f"Risk scores refreshed: {stats['updated']} of {stats['patients']} changed "
+                  f"in {stats['seconds']:.2f}s.")
+            return stats
+
+    @staticmethod
+    def clear_cache():
+        """Forget the cached model so the next use re-reads it"""
+        _model_cache.clear()
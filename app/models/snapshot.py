@@ -0,0 +1,446 @@
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+from bson.objectid import ObjectId
+from app.config.mongo_db import get_collection
+
+# Without change streams (standalone mongod, mongomock) the snapshot is
+# rebuilt on first use after it is this many seconds old
+SNAPSHOT_POLL_SECONDS = int(os.getenv("SNAPSHOT_POLL_SECONDS", 60))
+SNAPSHOT_BATCH_SIZE = int(os.getenv("SNAPSHOT_BATCH_SIZE", 5000))
+
+# Numeric patient fields and how they are stored. Missing values are NaN
+# for floats and -1 for ints
+NUMERIC_COLUMNS = {
+    'id': np.int64,
+    'age': np.float64,
+    'hypertension': np.int8,
+    'heart_disease': np.int8,
+    'avg_glucose_level': np.float64,
+    'bmi': np.float64,
+    'stroke': np.int8,
+    # Stored rounded to 4 places, so float32 is exact enough
+    'risk_score': np.float32,
+}
+# Text fields, stored as int8 codes into a per-field list of values (-1 = missing)
+CATEGORY_COLUMNS = ('gender', 'ever_married', 'work_type', 'Residence_type', 'smoking_status')
+
+_current = None
+_current_lock = threading.Lock()
+
+
+def _missing(dtype):
+    return np.nan if np.issubdtype(dtype, np.floating) else -1
+
+
+def _key(object_id):
+    # numpy 'S' arrays drop trailing NUL bytes, so keys are compared without them
+    return object_id.binary.rstrip(b'\0')
+
+
+def _object_id(raw):
+    return ObjectId(bytes(raw).ljust(12, b'\0'))
+
+
+def _to_number(value, dtype):
+    """One document value as a column value, missing/bad values become _missing"""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return _missing(dtype)
+    if np.isnan(number):
+        return _missing(dtype)
+    return number if np.issubdtype(dtype, np.floating) else int(number)
+
+
+class PatientSnapshot:
+    """
+    PatientSnapshot class - process-local columnar copy of the patients collection
+    One NumPy array per field, text fields as small integer codes and the
+    Mongo _id as 12 raw bytes, so a patient costs about 60 bytes instead of
+    a Python dict. Kept current by a change stream where the server has
+    them, by the Patient write methods, and otherwise by polling.
+    """
+
+    def __init__(self, capacity=0):
+        """Empty snapshot with room for capacity rows"""
+        self.lock = threading.RLock()
+        self.size = 0
+        self.columns = {name: np.full(capacity, _missing(dtype), dtype=dtype)
+                        for name, dtype in NUMERIC_COLUMNS.items()}
+        self.columns.update({name: np.full(capacity, -1, dtype=np.int8) for name in CATEGORY_COLUMNS})
+        self.categories = {name: [] for name in CATEGORY_COLUMNS}
+        self._codes = {name: {} for name in CATEGORY_COLUMNS}
+        self.object_ids = np.zeros(capacity, dtype='S12')
+        self.alive = np.zeros(capacity, dtype=bool)
+        # Row order sorted by id / by _id, rebuilt lazily; rows appended
+        # (or given a new id) since are found through _recent_ids / _recent
+        self._id_order = None
+        self._oid_order = None
+        self._recent_ids = {}
+        self._recent = {}
+        self.built_at = None
+        self.mode = 'poll'
+        self.version = 0
+        self._stream = None
+
+    # -- building ---------------------------------------------------------
+
+    @classmethod
+    def load(cls, collection=None, batch_size=SNAPSHOT_BATCH_SIZE):
+        """
+        Build a snapshot of every patient in one pass over the collection.
+        Documents are copied into the arrays batch_size at a time, so only
+        one batch is ever held as Python objects
+        """
+        collection = collection if collection is not None else get_collection()
+        fields = ('_id',) + tuple(NUMERIC_COLUMNS) + CATEGORY_COLUMNS
+        try:
+            capacity = collection.estimated_document_count()
+        except Exception:
+            capacity = 0
+        snapshot = cls(capacity=capacity)
+
+        batch = []
+        for doc in collection.find({}, {field: 1 for field in fields}).batch_size(batch_size):
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                snapshot._append_batch(batch, fields)
+                batch = []
+        if batch:
+            snapshot._append_batch(batch, fields)
+        snapshot.built_at = time.time()
+        return snapshot
+
+    def _append_batch(self, docs, fields):
+        """Copy documents into the rows after the last one, growing the arrays as needed"""
+        frame = pd.DataFrame.from_records(docs, columns=fields)
+        start, end = self.size, self.size + len(frame)
+        while end > len(self.alive):
+            self._grow()
+        self.alive[start:end] = True
+        self.object_ids[start:end] = [oid.binary for oid in frame['_id']]
+        for name, dtype in NUMERIC_COLUMNS.items():
+            values = pd.to_numeric(frame[name], errors='coerce')
+            self.columns[name][start:end] = values.fillna(_missing(dtype)).to_numpy(dtype=dtype)
+        for name in CATEGORY_COLUMNS:
+            values = frame[name].where(frame[name].notna() & (frame[name] != ''), None)
+            codes, uniques = pd.factorize(values, use_na_sentinel=True)
+            # Batch codes to snapshot codes, the extra last entry keeps missing (-1) as -1
+            mapping = np.array([self._code(name, value) for value in uniques] + [-1], dtype=np.int16)
+            self.columns[name][start:end] = mapping[codes]
+        self.size = end
+
+    def _code(self, name, value):
+        """Code of one text value, adding it to the field's categories if new"""
+        if value is None or value == '':
+            return -1
+        value = str(value)
+        code = self._codes[name].get(value)
+        if code is None:
+            code = len(self.categories[name])
+            self.categories[name].append(value)
+            self._codes[name][value] = code
+            if code >= np.iinfo(self.columns[name].dtype).max:
+                self.columns[name] = self.columns[name].astype(np.int16)
+        return code
+
+    def _grow(self):
+        """Double the capacity of every array"""
+        capacity = max(16, len(self.alive) * 2)
+        for name, column in self.columns.items():
+            grown = np.full(capacity, _missing(column.dtype) if name in NUMERIC_COLUMNS else -1,
+                            dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            self.columns[name] = grown
+        object_ids = np.zeros(capacity, dtype='S12')
+        object_ids[:self.size] = self.object_ids[:self.size]
+        self.object_ids = object_ids
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self.size] = self.alive[:self.size]
+        self.alive = alive
+
+    # -- lookups ----------------------------------------------------------
+
+    def _row_by_oid(self, oid):
+        """Row holding a Mongo _id (as made by _key), or None"""
+        row = self._recent.get(oid)
+        if row is not None:
+            return row
+        if self._oid_order is None:
+            self._oid_order = np.argsort(self.object_ids[:self.size], kind='stable').astype(np.int32)
+            self._recent = {}
+        # The sorted order covers the rows up to the last rebuild
+        keys = self.object_ids[:len(self._oid_order)]
+        position = np.searchsorted(keys, oid, sorter=self._oid_order)
+        if position < len(keys):
+            row = int(self._oid_order[position])
+            if keys[row] == oid and self.alive[row]:
+                return row
+        return None
+
+    def row_for(self, patient_id):
+        """Row of a live patient by the id field, or None"""
+        with self.lock:
+            ids = self.columns['id']
+            row = self._recent_ids.get(patient_id)
+            if row is not None and self.alive[row] and ids[row] == patient_id:
+                return row
+            if self._id_order is None:
+                self._id_order = np.argsort(ids[:self.size], kind='stable').astype(np.int32)
+                self._recent_ids = {}
+            # The sorted order covers the rows up to the last rebuild
+            indexed = ids[:len(self._id_order)]
+            start = np.searchsorted(indexed, patient_id, sorter=self._id_order)
+            # Deleted rows keep their id, so step over dead matches
+            for position in range(start, len(indexed)):
+                row = int(self._id_order[position])
+                if indexed[row] != patient_id:
+                    break
+                if self.alive[row]:
+                    return row
+            return None
+
+    def get(self, patient_id):
+        """One patient as a plain dict of the snapshot fields, or None"""
+        with self.lock:
+            row = self.row_for(patient_id)
+            if row is None:
+                return None
+            doc = {'_id': _object_id(self.object_ids[row])}
+            for name, dtype in NUMERIC_COLUMNS.items():
+                value = self.columns[name][row]
+                if value != value or value == _missing(dtype):
+                    doc[name] = None
+                else:
+                    doc[name] = round(value.item(), 4) if dtype == np.float32 else value.item()
+            for name in CATEGORY_COLUMNS:
+                code = int(self.columns[name][row])
+                doc[name] = self.categories[name][code] if code >= 0 else None
+            return doc
+
+    def __len__(self):
+        return int(self.alive[:self.size].sum())
+
+    @property
+    def nbytes(self):
+        """Bytes held by the arrays (categories and indexes are extra but small)"""
+        arrays = list(self.columns.values()) + [self.object_ids, self.alive]
+        return sum(array.nbytes for array in arrays)
+
+    def frame(self, columns=None, with_object_ids=False):
+        """
+        pandas DataFrame of the live patients.
+        Text fields come back as pandas Categoricals built on the stored codes
+        """
+        with self.lock:
+            live = np.flatnonzero(self.alive[:self.size])
+            data = {}
+            if with_object_ids:
+                data['_id'] = [_object_id(oid) for oid in self.object_ids[live]]
+            for name in columns or tuple(NUMERIC_COLUMNS) + CATEGORY_COLUMNS:
+                values = self.columns[name][live]
+                if name in CATEGORY_COLUMNS:
+                    data[name] = pd.Categorical.from_codes(values.astype(np.int16), self.categories[name])
+                elif values.dtype == np.float32:
+                    data[name] = values.astype(np.float64).round(4)
+                elif values.dtype == np.int8:
+                    # 0/1 flags, missing (-1) comes back as NaN like an absent field
+                    data[name] = np.where(values < 0, np.nan, values)
+                else:
+                    data[name] = values
+            return pd.DataFrame(data)
+
+    # -- changes ----------------------------------------------------------
+
+    def _write_row(self, row, doc):
+        old_id = self.columns['id'][row]
+        for name, dtype in NUMERIC_COLUMNS.items():
+            self.columns[name][row] = _to_number(doc.get(name), dtype)
+        for name in CATEGORY_COLUMNS:
+            self.columns[name][row] = self._code(name, doc.get(name))
+        new_id = int(self.columns['id'][row])
+        # Keep the id index usable instead of re-sorting after every write
+        if self._id_order is None or new_id == old_id and row < len(self._id_order):
+            return
+        if row < len(self._id_order):
+            # A sorted row changed its id, the order no longer holds
+            self._id_order = None
+            self._recent_ids = {}
+            return
+        self._recent_ids[new_id] = row
+        if len(self._recent_ids) > 1024:
+            self._id_order = None
+
+    def upsert(self, doc):
+        """Add or replace one patient document (it must have an _id)"""
+        oid = _key(doc['_id'])
+        with self.lock:
+            row = self._row_by_oid(oid)
+            if row is None:
+                if self.size == len(self.alive):
+                    self._grow()
+                row = self.size
+                self.size += 1
+                self.object_ids[row] = oid
+                self.alive[row] = True
+                self._recent[oid] = row
+                # Rebuild the sorted _id index once enough rows are waiting
+                if len(self._recent) > 1024:
+                    self._oid_order = None
+            self._write_row(row, doc)
+            self.version += 1
+
+    def remove(self, object_id):
+        """Drop the patient with this Mongo _id, if present"""
+        with self.lock:
+            row = self._row_by_oid(_key(object_id))
+            if row is not None:
+                self.alive[row] = False
+                self._recent.pop(_key(object_id), None)
+                self.version += 1
+
+    def set_values(self, name, object_ids, values):
+        """Overwrite one numeric column for the given _ids, e.g. fresh risk scores"""
+        with self.lock:
+            dtype = NUMERIC_COLUMNS[name]
+            for object_id, value in zip(object_ids, values):
+                row = self._row_by_oid(_key(object_id))
+                if row is not None:
+                    self.columns[name][row] = _to_number(value, dtype)
+            self.version += 1
+
+    def apply(self, old_doc=None, new_doc=None):
+        """Apply a create (old_doc None), update or delete (new_doc None)"""
+        if new_doc is not None and new_doc.get('_id') is not None:
+            self.upsert(new_doc)
+        elif old_doc is not None and old_doc.get('_id') is not None:
+            self.remove(old_doc['_id'])
+
+    def apply_event(self, change):
+        """Apply one change stream event"""
+        operation = change.get('operationType')
+        if operation in ('insert', 'replace', 'update'):
+            doc = change.get('fullDocument')
+            if doc is not None:
+                self.upsert(doc)
+            else:
+                # Looked up after a later delete
+                self.remove(change['documentKey']['_id'])
+        elif operation == 'delete':
+            self.remove(change['documentKey']['_id'])
+        elif operation in ('drop', 'rename', 'dropDatabase', 'invalidate'):
+            self.built_at = 0
+
+    def is_stale(self):
+        """True when polling and the snapshot is older than SNAPSHOT_POLL_SECONDS"""
+        if not self.built_at:
+            return True
+        return self.mode != 'change_stream' and time.time() - self.built_at > SNAPSHOT_POLL_SECONDS
+
+    # -- process-wide snapshot ----------------------------------------------
+
+    def _watch(self):
+        """Apply change stream events until the stream closes or fails"""
+        try:
+            with self._stream as stream:
+                for change in stream:
+                    self.apply_event(change)
+        except Exception as e:
+            if self._stream is not None:
+                print(f"Patient snapshot change stream stopped, polling instead: {e}")
+        self.mode = 'poll'
+
+    def close(self):
+        """Stop following the change stream"""
+        stream, self._stream = self._stream, None
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+    @staticmethod
+    def build(collection=None):
+        """
+        Load a snapshot and follow the collection's change stream if the
+        server supports one. The stream is opened before loading so no
+        change between the two is missed (replaying one twice is harmless)
+        """
+        collection = collection if collection is not None else get_collection()
+        try:
+            stream = collection.watch(full_document='updateLookup')
+        except Exception:
+            stream = None
+        snapshot = PatientSnapshot.load(collection)
+        if stream is not None:
+            snapshot._stream = stream
+            snapshot.mode = 'change_stream'
+            threading.Thread(target=snapshot._watch, name="patient-snapshot", daemon=True).start()
+        return snapshot
+
+    @staticmethod
+    def current():
+        """This process's snapshot, built on first use and rebuilt when stale"""
+        global _current
+        snapshot = _current
+        if snapshot is None or snapshot.is_stale():
+            with _current_lock:
+                if _current is None or _current.is_stale():
+                    if _current is not None:
+                        _current.close()
+                    started = time.perf_counter()
+                    _current = PatientSnapshot.build()
+                    print(f"Patient snapshot built: {len(_current)} rows, {_current.nbytes:,} bytes "
+                          f"in {time.perf_counter() - started:.2f}s ({_current.mode}).")
+                snapshot = _current
+        return snapshot
+
+    @staticmethod
+    def record_change(old_doc=None, new_doc=None):
+        """Apply a Patient write to this process's snapshot, if one is built"""
+        snapshot = _current
+        if snapshot is not None:
+            snapshot.apply(old_doc, new_doc)
+
+    @staticmethod
+    def record_changes(changes):
+        """Apply many (old_doc, new_doc) pairs, see record_change"""
+        for old_doc, new_doc in changes:
+            PatientSnapshot.record_change(old_doc, new_doc)
+
+    @staticmethod
+    def reset():
+        """Throw away this process's snapshot (e.g. after seeding or a fork)"""
+        global _current
+        with _current_lock:
+            if _current is not None:
+                _current.close()
+            _current = None
+
+    @staticmethod
+    def stats():
+        """Size and freshness of this process's snapshot, for /healthz"""
+        snapshot = _current
+        if snapshot is None:
+            return {"built": False}
+        return {
+            "built": True,
+            "rows": len(snapshot),
+            "bytes": snapshot.nbytes,
+            "mode": snapshot.mode,
+            "age_seconds": round(time.time() - snapshot.built_at, 1) if snapshot.built_at else None,
+            "version": snapshot.version,
+        }
+
+
+def _forget_snapshot():
+    """A forked child has no watcher thread, it builds its own snapshot"""
+    global _current
+    _current = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_snapshot)
@@ -1,7 +1,65 @@
+import base64
+import json
+import os
+import re
 import sqlite3
 from datetime import datetime
+from flask import g, has_request_context
+from app.config.sqlite_pool import DB_NAME, connection
+from utils.cache import TTLCache
+from utils.metrics import instrument_class
+from utils.fragment_cache import fragment_cache
+from app.models.audit import field_diff
 
-DB_NAME = "london_health.db"
+# Process-wide cache of logged-in users, off (0) by default. With a TTL a
+# worker can show another worker's renamed or deleted user for that long
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 0))
+_user_cache = TTLCache(maxsize=int(os.getenv("USER_CACHE_SIZE", 256)), ttl=USER_CACHE_TTL)
+
+# Emails that failed a login lookup, so repeats skip SQLite. Kept short:
+# another worker may not see a new registration for up to this long
+UNKNOWN_EMAIL_TTL = int(os.getenv("UNKNOWN_EMAIL_TTL", 30))
+_unknown_emails = TTLCache(maxsize=int(os.getenv("UNKNOWN_EMAIL_CACHE_SIZE", 10000)), ttl=UNKNOWN_EMAIL_TTL)
+
+# Search relevance: bm25 over (first_name, last_name, email), a name match
+# counts more than the same word in an email address
+SEARCH_RANK = "bm25(users_fts, 10.0, 10.0, 1.0)"
+# Words of a search beyond this are ignored
+SEARCH_MAX_TERMS = 8
+USER_LIST_COLUMNS = "users.id, users.first_name, users.last_name, users.email, users.role, users.created_at"
+
+
+def search_query(text):
+    """
+    Turn what was typed in the search box into an FTS5 query that matches
+    users having every word as a prefix, e.g. 'ada lov' -> '"ada"* "lov"*'
+    Returns None if there is nothing to search for
+    """
+    terms = re.findall(r"\w+", (text or "").lower())[:SEARCH_MAX_TERMS]
+    return " ".join(f'"{term}"*' for term in terms) or None
+
+
+def encode_user_cursor(direction, user_id, score=None):
+    """Turn a page direction and position (id, plus search score) into an opaque url-safe token"""
+    raw = json.dumps([direction, user_id, score]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_user_cursor(token, searching=False):
+    """
+    Turn a token made by encode_user_cursor back into (direction, id, score)
+    Raises ValueError if the token is not valid or was made for another listing
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        direction, user_id, score = json.loads(base64.urlsafe_b64decode(padded))
+        if direction not in ("next", "prev") or not isinstance(user_id, int) or (score is not None) != searching:
+            raise ValueError
+        if searching and not isinstance(score, (int, float)):
+            raise ValueError
+        return direction, user_id, score
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise ValueError("Invalid page cursor.")
 
 
 class User:
@@ -30,13 +88,15 @@ class User:
             if existing_user:
                 raise ValueError("A user with this email already exists")
 
-            with sqlite3.connect(DB_NAME) as conn:
+            with connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute(
                     "INSERT INTO users (first_name, last_name, email, password_hash, role) VALUES (?, ?, ?, ?, ?)",
                     (first_name, last_name, email, password_hash, role)
                 )
                 conn.commit()
+                User.forget_unknown_email(email)
+                fragment_cache.invalidate('users')
                 return cursor.lastrowid
 
         except sqlite3.IntegrityError:
@@ -48,7 +108,7 @@ class User:
         Get all users from database
         Returns list of user dictionaries
         """
-        with sqlite3.connect(DB_NAME) as conn:
+        with connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM users")
             rows = cursor.fetchall()
@@ -74,7 +134,7 @@ class User:
         Get paginated users from database
         Returns tuple of (users list, total count)
         """
-        with sqlite3.connect(DB_NAME) as conn:
+        with connection() as conn:
             cursor = conn.cursor()
             
             # Get total count
@@ -106,13 +166,97 @@ class User:
 
         return users, total
 
+    @staticmethod
+    def get_keyset_users(cursor=None, per_page=10, skip=0, search=None):
+        """
+        Get a page of users using keyset (cursor) pagination.
+        Without search users are listed by id; with search (text from the
+        search box, see search_query) only users whose names or email
+        start with every word are listed, best match first, id breaking ties.
+        cursor is a token from a previous page; without one the page
+        starts `skip` rows from the top.
+        Returns tuple of (users list, next cursor, prev cursor)
+        Raises ValueError if the cursor is not valid
+        """
+        match = search_query(search)
+        if cursor:
+            direction, last_id, last_score = decode_user_cursor(cursor, searching=match is not None)
+        else:
+            direction, last_id, last_score = "next", None, None
+
+        # Walking backwards means reading in the opposite order, then flipping
+        forward = direction == "next"
+        op, order = (">", "ASC") if forward else ("<", "DESC")
+        conditions, params = [], []
+        if match is not None:
+            # The rank is named in full: "rank = ?" means something else to FTS5
+            sql = (f"SELECT {USER_LIST_COLUMNS}, {SEARCH_RANK} AS score FROM users_fts "
+                   f"JOIN users ON users.id = users_fts.rowid")
+            conditions.append("users_fts MATCH ?")
+            params.append(match)
+            if last_id is not None:
+                conditions.append(f"({SEARCH_RANK} {op} ? OR ({SEARCH_RANK} = ? AND users.id {op} ?))")
+                params += [last_score, last_score, last_id]
+            sort = f"score {order}, users.id {order}"
+        else:
+            sql = f"SELECT {USER_LIST_COLUMNS}, NULL AS score FROM users"
+            if last_id is not None:
+                conditions.append(f"users.id {op} ?")
+                params.append(last_id)
+            sort = f"users.id {order}"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+
+        # Fetch one extra row to find out if there is another page after this one
+        sql += f" ORDER BY {sort} LIMIT ? OFFSET ?"
+        params += [per_page + 1, skip if last_id is None else 0]
+        with connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        if not forward:
+            rows.reverse()
+
+        users = [{'id': row[0], 'first_name': row[1], 'last_name': row[2], 'email': row[3],
+                  'role': row[4], 'created_at': row[5]} for row in rows]
+        if not rows:
+            return users, None, None
+
+        # Going forward there is a previous page if we started past the top,
+        # going backward there is always a next page (the one we came from)
+        more_ahead = has_more if forward else True
+        more_behind = (last_id is not None or skip > 0) if forward else has_more
+        first, last = rows[0], rows[-1]
+        next_cursor = encode_user_cursor("next", last[0], last[6]) if more_ahead else None
+        prev_cursor = encode_user_cursor("prev", first[0], first[6]) if more_behind else None
+        return users, next_cursor, prev_cursor
+
+    @staticmethod
+    def count_users(search=None):
+        """
+        Count all users, or the users matching a search (see get_keyset_users)
+        """
+        match = search_query(search)
+        with connection() as conn:
+            if match is None:
+                return conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+            return conn.execute("SELECT COUNT(*) FROM users_fts WHERE users_fts MATCH ?", (match,)).fetchone()[0]
+
+    @staticmethod
+    def table_version():
+        """Change counter of the users table (bumped by triggers), 0 before the first write"""
+        with connection() as conn:
+            row = conn.execute("SELECT version FROM table_versions WHERE name = 'users'").fetchone()
+        return row[0] if row else 0
+
     @staticmethod
     def get_by_id(user_id):
         """
         Get a specific user by their id
         Returns user dictionary or None if not found
         """
-        with sqlite3.connect(DB_NAME) as conn:
+        with connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
             row = cursor.fetchone()
@@ -131,13 +275,75 @@ class User:
         
         return None
 
+    @staticmethod
+    def get_cached(user_id):
+        """
+        Get a user by id for identity checks (e.g. current_user)
+        Memoized on flask.g for the request and, if USER_CACHE_TTL is set,
+        kept in a short TTL cache across requests. The password hash is left
+        out. Returns user dictionary or None if not found
+        """
+        user_id = int(user_id)
+        in_request = has_request_context()
+        if in_request and g.get('cached_user_id') == user_id:
+            return g.cached_user
+
+        user = _user_cache.get(user_id) if USER_CACHE_TTL > 0 else None
+        if user is None:
+            user = User.get_by_id(user_id)
+            if user is not None:
+                user.pop('password_hash', None)
+                if USER_CACHE_TTL > 0:
+                    _user_cache.set(user_id, user, ttl=USER_CACHE_TTL)
+
+        if in_request:
+            g.cached_user_id = user_id
+            g.cached_user = user
+        return user
+
+    @staticmethod
+    def invalidate_cache(user_id):
+        """Forget any cached copy of a user after it changes"""
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return
+        _user_cache.delete(user_id)
+        if has_request_context() and g.get('cached_user_id') == user_id:
+            g.pop('cached_user_id', None)
+            g.pop('cached_user', None)
+
+    @staticmethod
+    def get_for_login(email):
+        """
+        Find a user by email for a login attempt
+        Always read from SQLite, never the user cache, so a changed password
+        or role applies at once. Misses are remembered for UNKNOWN_EMAIL_TTL seconds
+        Returns User object or None if not found
+        """
+        if _unknown_emails.get(email):
+            return None
+        with connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
+            row = cursor.fetchone()
+        if row is None:
+            _unknown_emails.set(email, True)
+            return None
+        return User(*row)
+
+    @staticmethod
+    def forget_unknown_email(email):
+        """Drop an email from the login miss cache once it is registered"""
+        _unknown_emails.delete(email)
+
     @staticmethod
     def get_by_email(email):
         """
         Find a user by their email
         Returns user dictionary or None if not found
         """
-        with sqlite3.connect(DB_NAME) as conn:
+        with connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
             row = cursor.fetchone()
@@ -160,17 +366,24 @@ class User:
     def update(user_id, first_name, last_name, role):
         """
         Update a user's information
-        Returns True if successful, False if user not found
+        Returns {field: [old, new]} for the fields that changed, None if user not found
         """
         try:
-            with sqlite3.connect(DB_NAME) as conn:
+            with connection() as conn:
                 cursor = conn.cursor()
+                old = cursor.execute("SELECT first_name, last_name, role FROM users WHERE id = ?",
+                                     (user_id,)).fetchone()
+                if old is None:
+                    return None
                 cursor.execute(
                     "UPDATE users SET first_name = ?, last_name = ?, role = ? WHERE id = ?",
                     (first_name, last_name, role, user_id)
                 )
                 conn.commit()
-                return cursor.rowcount > 0
+                User.invalidate_cache(user_id)
+                fragment_cache.invalidate('users')
+                return field_diff(dict(zip(('first_name', 'last_name', 'role'), old)),
+                                  {'first_name': first_name, 'last_name': last_name, 'role': role})
         except Exception as e:
             raise ValueError(f"Failed to update user: {e}")
 
@@ -181,13 +394,14 @@ class User:
         Returns True if successful, False if user not found
         """
         try:
-            with sqlite3.connect(DB_NAME) as conn:
+            with connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute(
                     "UPDATE users SET password_hash = ? WHERE id = ?",
                     (password_hash, user_id)
                 )
                 conn.commit()
+                User.invalidate_cache(user_id)
                 return cursor.rowcount > 0
         except Exception as e:
             raise ValueError(f"Failed to update password: {e}")
@@ -197,8 +411,14 @@ class User:
         """
         Delete a user from database
         """
-        with sqlite3.connect(DB_NAME) as conn:
+        with connection() as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
             conn.commit()
+            User.invalidate_cache(user_id)
+            fragment_cache.invalidate('users')
             return cursor.rowcount > 0
+
+
+# Time every data method for /metrics and the Server-Timing header
+instrument_class(User, "sqlite")
@@ -1,8 +1,13 @@
-import sqlite3
 from flask import Blueprint, flash, request, redirect, render_template, session, url_for
-from werkzeug.security import generate_password_hash, check_password_hash
+from utils.passwords import hash_password, verify_password, check_dummy, needs_rehash, rehash_later
+from utils.rate_limit import TokenBucketLimiter, make_store
+from utils.fragment_cache import fragment_cache
+import math
+import os
 import re
 from app.config.sqlite import get_user_by_email
+from app.config.sqlite_pool import connection
+from app.models.user import User
 
 """
 This is the authentication file that handles login, register,logout 
@@ -13,6 +18,12 @@ grouped within a blueprint.
 
 auth_blueprint = Blueprint('auth', __name__)
 
+# Login attempts allowed per client address per minute and per email per
+# 5 minutes. LOGIN_RATE_STORE=sqlite shares the limits between workers
+login_store = make_store(os.getenv("LOGIN_RATE_STORE", "memory"), os.getenv("LOGIN_RATE_DB"))
+ip_limiter = TokenBucketLimiter("login-ip", int(os.getenv("LOGIN_IP_LIMIT", 20)), 60, login_store)
+email_limiter = TokenBucketLimiter("login-email", int(os.getenv("LOGIN_EMAIL_LIMIT", 5)), 300, login_store)
+
 @auth_blueprint.route('/')
 def index():
     return render_template('landing_page.html')
@@ -27,14 +38,31 @@ def login():
 
             if not email or not password:
                 raise ValueError ("All fields are required.")
-                
 
-            user = get_user_by_email(email)
+            # Refuse floods before they reach SQLite or the hashing pool
+            wait = max(ip_limiter.hit(request.remote_addr or 'unknown'),
+                       email_limiter.hit(email.strip().lower()))
+            if wait:
+                wait = math.ceil(wait)
+                flash(f"Too many login attempts. Try again in {wait} seconds.", 'error')
+                return render_template('login.html'), 429, {'Retry-After': str(wait)}
+
+            user = User.get_for_login(email)
             if not user :
-                raise ValueError('user doesnt exist')
+                # Same work and message as a wrong password, so emails cannot be probed
+                check_dummy(password)
+                raise ValueError("Invalid email or password.")
     
-            if not check_password_hash(user.password_hash, password):
+            # Hashing runs in a worker process, not on this request thread
+            if not verify_password(user.password_hash, password):
                 raise ValueError("Invalid email or password.")
+
+            # Upgrade hashes made with older cost settings, without delaying the login
+            if needs_rehash(user.password_hash):
+                user_id = user.id
+                rehash_later(password, lambda new_hash: User.update_password(user_id, new_hash))
+
+            email_limiter.reset(email.strip().lower())
             
             session['user_id'] = user.id
             session['role'] = user.role
@@ -82,13 +110,15 @@ def register():
                 raise ValueError ("A user with this email already exists. Choose another.")
             
             # Hash the password
-            hashed_password = generate_password_hash(password)
+            hashed_password = hash_password(password)
 
             # Save to SQLite
-            with sqlite3.connect("london_health.db") as conn:
+            with connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("INSERT INTO users (first_name, last_name, email, role, password_hash) VALUES (?, ?, ?, ?, ?)", (first_name, last_name, email, role, hashed_password))
                 conn.commit()
+            User.forget_unknown_email(email)
+            fragment_cache.invalidate('users')
 
             flash("Registration successful! Please log in.", "success")
             return redirect(url_for('auth.login'))
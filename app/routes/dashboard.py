@@ -1,10 +1,25 @@
-from flask import Blueprint, render_template, request, flash, current_app, session, redirect, url_for
+from flask import Blueprint, render_template, request, flash, current_app, session, redirect, url_for, Response, stream_with_context, jsonify, make_response
 from app.models.user import User
 from utils.decorators import auth_required, admin_or_doctor_required, admin_required, doctor_required
-from app.models.patient import Patient
+from app.models.patient import Patient, DOC_FIELDS
+from app.models.cohort import CohortStats
+from app.models.risk import RiskModel, risk_band
+from app.models.async_access import gather, run_blocking
+from app.models.audit import AuditLog, field_diff
+from utils.fragment_cache import fragment_cache
+from markupsafe import Markup
+from flask_wtf.csrf import generate_csrf
 import re  
 from datetime import datetime
-from werkzeug.security import generate_password_hash
+from utils.passwords import hash_password
+from utils.export import csv_chunks, ndjson_chunks, gzip_chunks
+import os
+import io
+import csv
+import json
+import time
+import functools
+import hashlib
 
 
 dashboard_blueprint = Blueprint('dashboard', __name__)
@@ -12,42 +27,426 @@ dashboard_blueprint = Blueprint('dashboard', __name__)
 @dashboard_blueprint.route('/user_dashboard')
 @auth_required
 @admin_required
-def user_dashboard():
+async def user_dashboard():
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 10, type=int)
-    
-    users, total = User.get_paginated_users(page=page, per_page=per_page)
-    
+    cursor = request.args.get('cursor') or None
+    search = request.args.get('q', '').strip()
+    link_args = {'q': search} if search else {}
+
+    # The rows hide the delete button on the viewer's own account. The table
+    # version changes with every user write, whichever worker made it
+    skip = 0 if cursor else (page - 1) * per_page
+    version = await run_blocking(User.table_version)
+    parts = {'cursor': cursor, 'skip': skip, 'per_page': per_page, 'q': search, 'viewer': session['user_id'],
+             'version': version}
+    table = fragment_cache.get('users', parts)
+    if table is None:
+        # Previous/Next links carry a cursor, page number links skip. The page,
+        # the count and current_user for the template are looked up together
+        try:
+            (users, next_cursor, prev_cursor), total, _ = await gather(
+                (functools.partial(User.get_keyset_users, cursor=cursor, per_page=per_page, skip=skip,
+                                   search=search),),
+                (User.count_users, search),
+                (User.get_cached, session['user_id']),
+            )
+        except ValueError as e:
+            flash(f"{e}", 'error')
+            return redirect(url_for('dashboard.user_dashboard'))
+        table = {'rows': render_template('user_rows.html', users=users),
+                 'next_cursor': next_cursor, 'prev_cursor': prev_cursor, 'total': total}
+        fragment_cache.set('users', parts, table)
+    next_cursor, prev_cursor, total = table['next_cursor'], table['prev_cursor'], table['total']
+
     total_pages = (total + per_page - 1) // per_page
-    
+
     return render_template('user_dashboard.html',
-                         users=users,
+                         rows_html=Markup(table['rows']),
                          page=page,
                          per_page=per_page,
                          total_users=total,
                          total_pages=total_pages,
-                         has_prev=page > 1,
-                         has_next=page < total_pages)
+                         next_cursor=next_cursor,
+                         prev_cursor=prev_cursor,
+                         search=search,
+                         link_args=link_args,
+                         has_prev=prev_cursor is not None,
+                         has_next=next_cursor is not None)
+
+# Patient pages may be kept by the browser but never shared, and are
+# revalidated with If-None-Match on every visit
+PAGE_CACHE_CONTROL = "private, no-cache"
+
+
+def page_etag(*parts):
+    """
+    Strong ETag from the page's data versions and query (parts), the viewer
+    (pages show their name and role), the session's CSRF secret and the CSRF
+    token window, so a page kept by the browser never carries an expired
+    form token or one from an earlier login
+    """
+    # Makes the session's CSRF secret now if the page has not rendered a form yet
+    generate_csrf()
+    secret = session.get(current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token'), '')
+    window = (current_app.config.get('WTF_CSRF_TIME_LIMIT') or 3600) // 2
+    raw = "|".join(map(str, parts + (session.get('user_id'), session.get('role'),
+                                     hashlib.sha256(secret.encode()).hexdigest(), int(time.time() // window))))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def with_etag(response, etag):
+    """Attach the ETag and Cache-Control to a rendered page"""
+    response = make_response(response)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = PAGE_CACHE_CONTROL
+    return response
+
+
+def not_modified(etag):
+    """304 response if the client's copy matches etag, None if the page must be rendered"""
+    # A waiting flash message has to be rendered into a fresh page
+    if '_flashes' in session or not request.if_none_match.contains(etag):
+        return None
+    return with_etag(Response(status=304), etag)
+
+
+def _model_stamp():
+    """When the current risk model was fitted, part of every page ETag showing risk"""
+    try:
+        model = RiskModel.current()
+    except Exception:
+        return None
+    return model.fitted_at if model is not None else None
+
+
+# Sort choices offered on the dashboard: query value -> Patient field
+PATIENT_SORTS = {
+    'newest': '_id',
+    'patient_id': 'id',
+    'age': 'age',
+    'glucose': 'avg_glucose_level',
+    'bmi': 'bmi',
+    'risk': 'risk_score',
+}
+
+
+def patient_filters_from_args(args):
+    """
+    Read the dashboard filter and sort query parameters.
+    Returns (filters dict for Patient, query args to keep in links)
+    Bad numbers are ignored rather than raising
+    """
+    filters = {
+        'gender': args.get('gender') or None,
+        'work_type': args.get('work_type') or None,
+        'smoking_status': args.get('smoking_status') or None,
+        'hypertension': args.get('hypertension', type=int),
+        'heart_disease': args.get('heart_disease', type=int),
+        'stroke': args.get('stroke', type=int),
+        'age_min': args.get('age_min', type=float),
+        'age_max': args.get('age_max', type=float),
+        'glucose_min': args.get('glucose_min', type=float),
+        'glucose_max': args.get('glucose_max', type=float),
+        'bmi_min': args.get('bmi_min', type=float),
+        'bmi_max': args.get('bmi_max', type=float),
+    }
+    filters = {name: value for name, value in filters.items() if value is not None}
+
+    link_args = dict(filters)
+    if args.get('sort') in PATIENT_SORTS:
+        link_args['sort'] = args.get('sort')
+    if args.get('order') in ('asc', 'desc'):
+        link_args['order'] = args.get('order')
+    return filters, link_args
+
 
 @dashboard_blueprint.route('/dashboard')
 @auth_required
 @admin_or_doctor_required
-def dashboard():
+async def dashboard():
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 10, type=int)
-    
-    patients, total = Patient.get_paginated_patients(page=page, per_page=per_page)
-    
+    cursor = request.args.get('cursor')
+
+    filters, link_args = patient_filters_from_args(request.args)
+    sort_by = PATIENT_SORTS[link_args.get('sort', 'newest')]
+    order = 1 if link_args.get('order') == 'asc' else -1
+
+    # Read before the page, so a write racing the render only costs a re-render
+    version, model_stamp = await gather((Patient.collection_version,), (_model_stamp,))
+    etag = page_etag('dashboard', version, model_stamp, sorted(request.args.items(multi=True)))
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+
+    # The table rows are shared by everyone with the same role viewing the
+    # same page, only the surrounding page is rendered for each request
+    skip = 0 if cursor else (page - 1) * per_page
+    parts = {'cursor': cursor, 'skip': skip, 'per_page': per_page, 'filters': filters, 'sort': sort_by,
+             'order': order, 'role': session.get('role'), 'version': version, 'model': model_stamp}
+    table = fragment_cache.get('patients', parts)
+    if table is None:
+        # Previous/Next links carry a cursor so deep pages cost the same as page 1,
+        # page number links without one fall back to skipping. The page, the
+        # count and current_user are independent, so they are fetched together
+        try:
+            (patients, next_cursor, prev_cursor), total, _ = await gather(
+                (functools.partial(Patient.get_keyset_patients, cursor=cursor, per_page=per_page, skip=skip,
+                                   filters=filters, sort_by=sort_by, order=order),),
+                (Patient.get_total_count, filters),
+                (User.get_cached, session['user_id']),
+            )
+        except ValueError as e:
+            flash(f"{e}", 'error')
+            return redirect(url_for('dashboard.dashboard'))
+        table = {'rows': render_template('patient_rows.html', patients=patients, filters=filters),
+                 'next_cursor': next_cursor, 'prev_cursor': prev_cursor, 'total': total}
+        fragment_cache.set('patients', parts, table)
+    next_cursor, prev_cursor, total = table['next_cursor'], table['prev_cursor'], table['total']
+
     total_pages = (total + per_page - 1) // per_page
-    
-    return render_template('dashboard.html',
-                         patients=patients,
+
+    return with_etag(render_template('dashboard.html',
+                         rows_html=Markup(table['rows']),
                          page=page,
                          per_page=per_page,
                          total_patients=total,
                          total_pages=total_pages,
-                         has_prev=page > 1,
-                         has_next=page < total_pages)
+                         next_cursor=next_cursor,
+                         prev_cursor=prev_cursor,
+                         filters=filters,
+                         link_args=link_args,
+                         has_prev=prev_cursor is not None,
+                         has_next=next_cursor is not None), etag)
+
+# Mongo cursor batch size for exports
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+
+
+@dashboard_blueprint.route('/dashboard/export')
+@auth_required
+@admin_or_doctor_required
+def export_patients():
+    """Stream the patients matching the dashboard filters as CSV or NDJSON"""
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        flash("Invalid export format.", "error")
+        return redirect(url_for('dashboard.dashboard'))
+
+    filters, _ = patient_filters_from_args(request.args)
+    docs = Patient.iter_patients(filters, batch_size=EXPORT_BATCH_SIZE)
+    if export_format == 'csv':
+        chunks = csv_chunks(docs, ('id',) + DOC_FIELDS)
+        mimetype = 'text/csv'
+    else:
+        chunks = ndjson_chunks(docs)
+        mimetype = 'application/x-ndjson'
+
+    headers = {'Content-Disposition': f'attachment; filename=patients.{export_format}'}
+    if 'gzip' in request.accept_encodings:
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+        headers['Vary'] = 'Accept-Encoding'
+
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
+
+
+@dashboard_blueprint.route('/dashboard/cohorts')
+@auth_required
+@admin_or_doctor_required
+def cohort_stats():
+    """Stroke rates by cohort, read from the materialized summary"""
+    summary = CohortStats.get_summary()
+    if request.args.get('format') == 'json':
+        return summary
+    return render_template('cohorts.html', summary=summary)
+
+
+# Audit events shown per page, the log is read newest first
+AUDIT_PAGE_SIZE = 50
+
+
+@dashboard_blueprint.route('/dashboard/audit')
+@auth_required
+@admin_required
+def audit_log():
+    """
+    Page through the audit log with keyset cursors (?before=<id> / ?after=<id>)
+    Optional ?actor=<user id> and ?target=patient|user filters, ?format=json for JSON.
+    Events from the last AUDIT_FLUSH_SECONDS may still be queued; ?fresh=1
+    waits (up to half a second) for them to be written first
+    """
+    before = request.args.get('before', type=int)
+    after = request.args.get('after', type=int)
+    actor = request.args.get('actor', type=int)
+    target = request.args.get('target') or None
+    if request.args.get('fresh') == '1':
+        AuditLog.flush(timeout=0.5)
+    events, older, newer = AuditLog.get_page(before=before, after=after, per_page=AUDIT_PAGE_SIZE,
+                                             actor_id=actor, target_type=target)
+    if request.args.get('format') == 'json':
+        return {'events': events, 'older': older, 'newer': newer}
+    return render_template('audit_log.html', events=events, older=older, newer=newer,
+                           actor=actor, target=target)
+
+
+def validate_patient_values(gender, age, bmi, avg_glucose_level):
+    """
+    Range checks shared by the patient forms and bulk import
+    Raises ValueError with a message for the user
+    """
+    # Age validation
+    if age < 0 or age > 120:
+        raise ValueError("Invalid age.")
+
+    # Gender validation
+    gender_options = ['Male', 'Female']
+    if gender not in gender_options:
+        raise ValueError("Invalid gender selection.")
+
+    # BMI validation
+    if bmi < 10 or bmi > 100:
+        raise ValueError("Invalid BMI value.")
+
+    # Glucose level validation
+    if avg_glucose_level < 0 or avg_glucose_level > 500:
+        raise ValueError("Invalid glucose level.")
+
+
+def patient_from_row(row):
+    """
+    Turn one uploaded CSV/NDJSON row into a patient document
+    Accepts the seed CSV column names. Raises ValueError if it is not valid
+    """
+    def text(name):
+        return str(row.get(name) or '').strip()
+
+    def number(name, cast, default=None):
+        value = row.get(name)
+        if value is None or str(value).strip() == '':
+            if default is None:
+                raise ValueError("All fields are required.")
+            return default
+        try:
+            return cast(float(value))
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid value for {name}.")
+
+    record = {
+        'id': number('id', int),
+        'gender': text('gender'),
+        'age': number('age', int),
+        'hypertension': number('hypertension', int, 0),
+        'heart_disease': number('heart_disease', int, 0),
+        'ever_married': text('ever_married'),
+        'work_type': text('work_type'),
+        'Residence_type': text('Residence_type') or text('residence_type'),
+        'avg_glucose_level': number('avg_glucose_level', float),
+        'bmi': number('bmi', float),
+        'smoking_status': text('smoking_status'),
+        'stroke': number('stroke', int, 0),
+    }
+    if not all([record['gender'], record['ever_married'], record['work_type'],
+                record['Residence_type'], record['smoking_status']]):
+        raise ValueError("All fields are required.")
+    validate_patient_values(record['gender'], record['age'], record['bmi'], record['avg_glucose_level'])
+    return record
+
+
+def import_row_id(row):
+    """A row's patient id for the import report, as the int it would be stored as when it parses"""
+    value = row.get('id') if isinstance(row, dict) else None
+    try:
+        return int(float(value))
+    except (TypeError, ValueError, OverflowError):
+        return value
+
+
+def read_upload_rows(upload):
+    """Yield dict rows from an uploaded .csv or .ndjson/.jsonl file"""
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8', newline='')
+    if upload.filename.lower().endswith(('.ndjson', '.jsonl')):
+        for line in stream:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    yield None
+    else:
+        yield from csv.DictReader(stream)
+
+
+# Rows validated and written per round trip by the bulk import
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 500))
+# Cap on errors listed in the import report, all are still counted
+IMPORT_MAX_ERRORS = 1000
+
+
+def _audit(action, target_type, target_id, changes=None):
+    """Queue an audit event by the logged-in user, a failure must not fail the change itself"""
+    try:
+        AuditLog.record(session.get('user_id'), action, target_type, target_id, changes)
+    except Exception as e:
+        print(f"Could not record audit event: {e}")
+
+
+@dashboard_blueprint.route('/dashboard/patients/import', methods=['POST'])
+@auth_required
+@admin_required
+def import_patients():
+    """
+    Bulk import patients from a CSV or NDJSON upload
+    Returns a JSON report with per-row errors and throughput
+    """
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return jsonify(error="Upload a .csv or .ndjson file."), 400
+
+    started = time.perf_counter()
+    report = {'rows': 0, 'inserted': 0, 'failed': 0, 'errors': []}
+
+    def add_error(row_number, patient_id, message):
+        report['failed'] += 1
+        if len(report['errors']) < IMPORT_MAX_ERRORS:
+            report['errors'].append({'row': row_number, 'id': patient_id, 'error': message})
+
+    def flush(batch):
+        inserted, errors = Patient.bulk_create([record for _, record in batch])
+        report['inserted'] += inserted
+        for index, message in errors:
+            row_number, record = batch[index]
+            add_error(row_number, record['id'], message)
+
+    batch = []
+    try:
+        for row_number, row in enumerate(read_upload_rows(upload), start=1):
+            report['rows'] += 1
+            try:
+                if not isinstance(row, dict):
+                    raise ValueError("Row is not a JSON object.")
+                batch.append((row_number, patient_from_row(row)))
+            except ValueError as e:
+                add_error(row_number, import_row_id(row), str(e))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+    except (UnicodeDecodeError, csv.Error) as e:
+        return jsonify(error=f"Could not read upload: {e}", **report), 400
+
+    if report['inserted']:
+        _audit('import', 'patient', None, {'file': upload.filename, 'inserted': report['inserted'],
+                                           'failed': report['failed']})
+
+    # Form errors are found before a batch is written, duplicates after
+    report['errors'].sort(key=lambda error: error['row'])
+    elapsed = time.perf_counter() - started
+    report['seconds'] = round(elapsed, 3)
+    report['rows_per_second'] = round(report['rows'] / elapsed) if elapsed > 0 else None
+    return jsonify(report)
+
 
 @dashboard_blueprint.route('/register_patient', methods=['GET', 'POST'])
 @auth_required
@@ -72,28 +471,18 @@ def register_patient():
             if not all([patient_id, gender, age, ever_married, work_type, residence_type, avg_glucose_level, bmi, smoking_status is not None]):
                 raise ValueError("All fields are required.")
             
-            # Age validation
-            if age < 0 or age > 120:
-                raise ValueError("Invalid age.")
-            
-            # Gender validation
-            gender_options = ['Male', 'Female']
-            if gender not in gender_options:
-                raise ValueError("Invalid gender selection.") 
-            
-            # BMI validation
-            if bmi < 10 or bmi > 100:
-                raise ValueError("Invalid BMI value.")
-            
-            # Glucose level validation
-            if avg_glucose_level < 0 or avg_glucose_level > 500:
-                raise ValueError("Invalid glucose level.")
+            validate_patient_values(gender, age, bmi, avg_glucose_level)
             
             Patient.create_patient(
                 patient_id, gender, age, hypertension, heart_disease,
                 ever_married, work_type, residence_type, avg_glucose_level,
                 bmi, smoking_status, stroke
             )
+            _audit('create', 'patient', patient_id, field_diff(None, {
+                'gender': gender, 'age': age, 'hypertension': hypertension, 'heart_disease': heart_disease,
+                'ever_married': ever_married, 'work_type': work_type, 'Residence_type': residence_type,
+                'avg_glucose_level': avg_glucose_level, 'bmi': bmi, 'smoking_status': smoking_status,
+                'stroke': stroke}))
             flash("Patient registered successfully!", "success")
             return redirect(url_for('dashboard.dashboard'))
         
@@ -105,15 +494,47 @@ def register_patient():
             return redirect(url_for("dashboard.dashboard"))
             
             
+def _current_model():
+    """The fitted risk model, or None if there is none yet or it cannot be read (the page still shows)"""
+    try:
+        return RiskModel.current()
+    except Exception as e:
+        print(f"Could not load risk model: {e}")
+        return None
+
+
 @dashboard_blueprint.route('/dashboard/patients/<int:patient_id>')
 @auth_required
 @admin_or_doctor_required
-def view_patient(patient_id):
-    patient = Patient.get_by_id(patient_id)
+async def view_patient(patient_id):
+    # Revalidation costs one indexed version lookup instead of fetch, score and render
+    if request.if_none_match:
+        version, model_stamp = await gather((Patient.get_version, patient_id), (_model_stamp,))
+        if version is not None:
+            cached = not_modified(page_etag('patient', patient_id, version, model_stamp))
+            if cached is not None:
+                return cached
+
+    patient, model, _ = await gather(
+        (Patient.get_by_id, patient_id),
+        (_current_model,),
+        (User.get_cached, session['user_id']),
+    )
     if not patient:
         flash("Patient not found.", "error")
         return redirect(url_for('dashboard.dashboard'))
-    return render_template('view_patient.html', patient=patient)
+
+    # Scored live so the page reflects the latest fitted model
+    risk = None
+    try:
+        if model is not None:
+            doc = patient.to_dict()
+            score = model.score_docs([doc])[0]
+            risk = {'score': score, 'band': risk_band(score), 'factors': model.explain(doc)}
+    except Exception as e:
+        print(f"Could not score patient risk: {e}")
+    etag = page_etag('patient', patient_id, patient.version, model.fitted_at if model is not None else None)
+    return with_etag(render_template('view_patient.html', patient=patient, risk=risk), etag)
 
 
 @dashboard_blueprint.route('/dashboard/patients/<int:patient_id>/update', methods=['GET', 'POST'])
@@ -138,28 +559,15 @@ def update_patient(patient_id):
             if not all([gender, age, ever_married, work_type, residence_type, avg_glucose_level, bmi, smoking_status is not None]):
                 raise ValueError("All fields are required.")
             
-            # Age validation
-            if age < 0 or age > 120:
-                raise ValueError("Invalid age.")
-            
-            # Gender validation
-            gender_options = ['Male', 'Female']
-            if gender not in gender_options:
-                raise ValueError("Invalid gender selection.") 
-            
-            # BMI validation
-            if bmi < 10 or bmi > 100:
-                raise ValueError("Invalid BMI value.")
-            
-            # Glucose level validation
-            if avg_glucose_level < 0 or avg_glucose_level > 500:
-                raise ValueError("Invalid glucose level.")
+            validate_patient_values(gender, age, bmi, avg_glucose_level)
             
-            Patient.update(
+            changes = Patient.update(
                 patient_id, gender, age, hypertension, heart_disease,
                 ever_married, work_type, residence_type, avg_glucose_level,
                 bmi, smoking_status, stroke
             )
+            if changes:
+                _audit('update', 'patient', patient_id, changes)
             flash("Patient information updated successfully!", "success")
             return redirect(url_for('dashboard.view_patient', patient_id=patient_id))
         
@@ -176,7 +584,8 @@ def update_patient(patient_id):
 @admin_required
 def delete_patient(patient_id):
     try:
-        Patient.delete_patient(patient_id)
+        if Patient.delete_patient(patient_id):
+            _audit('delete', 'patient', patient_id)
         flash("Patient deleted successfully!", "success")
     except Exception as e:
         flash(f"Error deleting patient: {e}", "error")
@@ -212,9 +621,11 @@ def register_user():
             raise ValueError("Invalid role selection.")
         
         # Hash password
-        password_hash = generate_password_hash(password)
+        password_hash = hash_password(password)
         
-        User.create_user(first_name, last_name, email, password_hash, role)
+        new_id = User.create_user(first_name, last_name, email, password_hash, role)
+        _audit('create', 'user', new_id, field_diff(None, {
+            'first_name': first_name, 'last_name': last_name, 'email': email, 'role': role}))
         flash("User registered successfully!", "success")
         return redirect(url_for('dashboard.user_dashboard'))
     
@@ -253,7 +664,9 @@ def update_user(user_id):
         if role not in role_options:
             raise ValueError("Invalid role selection.")
         
-        User.update(user_id, first_name, last_name, role)
+        changes = User.update(user_id, first_name, last_name, role)
+        if changes:
+            _audit('update', 'user', user_id, changes)
         flash("User information updated successfully!", "success")
         return redirect(url_for('dashboard.user_dashboard'))
     
@@ -274,7 +687,8 @@ def delete_user(user_id):
             flash("You cannot delete your own account.", "error")
             return redirect(url_for('dashboard.user_dashboard'))
         
-        User.delete_user(user_id)
+        if User.delete_user(user_id):
+            _audit('delete', 'user', user_id)
         flash("User deleted successfully!", "success")
     except Exception as e:
         flash(f"Error deleting user: {e}", "error")
@@ -0,0 +1,21 @@
+import mongomock.collection
+
+"""mongomock 4.3 predates the `sort` argument that pymongo 4.11+ passes to
+bulk replace/update operations. Dropping it lets bulk_write run against
+mongomock in tests; the sort is only a tie-breaker for non-unique filters."""
+
+
+def _drop_sort(method):
+    def wrapper(self, *args, sort=None, **kwargs):
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+def patch_mongomock_bulk():
+    '''Make mongomock's bulk builder accept pymongo's newer keyword arguments.'''
+    builder = mongomock.collection.BulkOperationBuilder
+    if getattr(builder, '_sort_compat', False):
+        return
+    builder.add_update = _drop_sort(builder.add_update)
+    builder.add_replace = _drop_sort(builder.add_replace)
+    builder._sort_compat = True
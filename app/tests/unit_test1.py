@@ -67,6 +67,127 @@ class SimpleAppTests(unittest.TestCase):
         self.assertIsNotNone(self.app.application)
 
 
+class LazyStartupTests(unittest.TestCase):
+    """Test cases for LAZY_INIT startup and the readiness endpoint"""
+
+    def setUp(self):
+        """Create the app in lazy mode with every database call patched"""
+        self.patchers = [
+            patch.dict(os.environ, {"LAZY_INIT": "1"}),
+            patch('app.init_db'),
+            patch('app.mongo_init_db'),
+            patch('app.seed_mongo'),
+            patch('app.ensure_db', return_value=None),
+            patch('app.config.mongo_db.get_db'),
+        ]
+        mocks = [p.start() for p in self.patchers]
+        self.mock_sqlite, self.mock_mongo, self.mock_seed = mocks[1:4]
+
+        app = create_app()
+        app.testing = True
+        self.app = app.test_client()
+
+    def tearDown(self):
+        """Stop the patchers"""
+        for p in reversed(self.patchers):
+            p.stop()
+
+    def test_no_database_work_at_startup(self):
+        """Test that a lazy app does not connect or seed when created"""
+        self.mock_sqlite.assert_not_called()
+        self.mock_mongo.assert_not_called()
+        self.mock_seed.assert_not_called()
+
+    def test_healthz(self):
+        """Test that the readiness endpoint reports checks and seed progress"""
+        response = self.app.get('/healthz')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['status'], 'ready')
+        self.assertIn('state', response.json['seed'])
+        self.assertNotIn('mongo_pool', response.json)
+
+    def test_healthz_details_need_token(self):
+        """Test that pool, queue and cache internals are only shown to METRICS_TOKEN holders"""
+        with patch('utils.metrics.METRICS_TOKEN', 'secret'):
+            self.assertNotIn('audit', self.app.get('/healthz').json)
+            response = self.app.get('/healthz', headers={'Authorization': 'Bearer secret'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('mongo_pool', response.json)
+        self.assertIn('audit', response.json)
+
+
+class MetricsTests(unittest.TestCase):
+    """Test cases for request timing, /metrics and Server-Timing"""
+
+    def setUp(self):
+        """Create the app with the database setup patched"""
+        self.patchers = [patch('app.mongo_init_db'), patch('app.init_db'), patch('app.seed_mongo')]
+        for p in self.patchers:
+            p.start()
+        app = create_app()
+        app.testing = True
+        self.app = app.test_client()
+
+    def tearDown(self):
+        """Stop the patchers"""
+        for p in reversed(self.patchers):
+            p.stop()
+
+    def test_server_timing_header(self):
+        """Test that responses report total and template render time"""
+        response = self.app.get('/login')
+
+        timing = response.headers['Server-Timing']
+        self.assertTrue(timing.startswith('app;dur='))
+        self.assertIn('render;dur=', timing)
+
+    def test_metrics_endpoint(self):
+        """Test that /metrics lists request and render histograms in Prometheus format"""
+        from utils.metrics import REQUEST_SECONDS
+        before = REQUEST_SECONDS.count('/login', 'GET', '200')
+        self.app.get('/login')
+        self.assertEqual(REQUEST_SECONDS.count('/login', 'GET', '200'), before + 1)
+
+        with patch('utils.metrics.METRICS_TOKEN', 'secret'):
+            response = self.app.get('/metrics', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        body = response.get_data(as_text=True)
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertIn('http_request_duration_seconds_bucket{route="/login",method="GET",status="200",le="+Inf"}', body)
+        self.assertIn('template_render_seconds_count{template="login.html"}', body)
+
+    def test_metrics_token(self):
+        """Test that METRICS_TOKEN protects the endpoint, which is off without one"""
+        with patch('utils.metrics.METRICS_TOKEN', None):
+            self.assertEqual(self.app.get('/metrics').status_code, 404)
+        with patch('utils.metrics.METRICS_TOKEN', 'secret'):
+            self.assertEqual(self.app.get('/metrics').status_code, 401)
+            self.assertEqual(self.app.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code, 401)
+            response = self.app.get('/metrics', headers={'Authorization': 'Bearer secret'})
+            self.assertEqual(response.status_code, 200)
+
+    def test_data_calls_counted_once(self):
+        """Test that nested model calls are timed only at the outermost call"""
+        from utils.metrics import timed, DB_CALL_SECONDS
+
+        @timed('test', 'inner')
+        def inner():
+            return 1
+
+        @timed('test', 'outer')
+        def outer():
+            return inner() + inner()
+
+        self.assertEqual(outer(), 2)
+        self.assertEqual(DB_CALL_SECONDS.count('test', 'outer'), 1)
+        self.assertEqual(DB_CALL_SECONDS.count('test', 'inner'), 0)
+        self.assertEqual(inner(), 1)
+        self.assertEqual(DB_CALL_SECONDS.count('test', 'inner'), 1)
+
+
 if __name__ == "__main__":
     print("Running 5 tests...\n")
     
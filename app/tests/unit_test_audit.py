@@ -0,0 +1,217 @@
+import unittest
+import sys
+import os
+import sqlite3
+import tempfile
+from unittest.mock import patch
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import mongomock
+
+from app.config.sqlite import init_db
+from app.config.sqlite_pool import connection, close_pool
+from app.models import audit
+from app.models.audit import AuditLog, field_diff
+from app.models.patient import Patient
+from utils.fragment_cache import fragment_cache
+
+
+class AuditLogTests(unittest.TestCase):
+    """Test cases for the write-behind audit log on a temporary SQLite file"""
+
+    def setUp(self):
+        """Create a fresh database and a fresh writer for each test"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        init_db(os.path.join(self.tmpdir.name, "test.db"))
+        audit._forget_writer()
+
+    def tearDown(self):
+        """Stop the writer, close the pool and remove the database"""
+        AuditLog.shutdown()
+        audit._forget_writer()
+        close_pool()
+        self.tmpdir.cleanup()
+
+    def count_rows(self):
+        with connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM audit_log").fetchone()[0]
+
+    def test_events_are_written_in_batches(self):
+        """Test that queued events reach the table in a few inserts"""
+        for i in range(50):
+            AuditLog.record(1, 'update', 'patient', i, {'age': [40, 41]})
+
+        self.assertTrue(AuditLog.flush(timeout=5))
+        self.assertEqual(self.count_rows(), 50)
+        stats = AuditLog.stats()
+        self.assertEqual(stats['written'], 50)
+        self.assertLess(stats['batches'], 50)
+        self.assertEqual(stats['queued'], 0)
+
+    def test_shutdown_writes_queued_events(self):
+        """Test that events still queued at exit are written"""
+        with patch.object(audit, 'AUDIT_FLUSH_SECONDS', 60):
+            AuditLog.record(1, 'delete', 'user', 7)
+            AuditLog.shutdown()
+
+        self.assertEqual(self.count_rows(), 1)
+
+    def test_events_after_shutdown_are_written_directly(self):
+        """Test that nothing is left queued once the writer has stopped"""
+        AuditLog.shutdown()
+        AuditLog.record(1, 'delete', 'user', 8)
+
+        self.assertEqual(self.count_rows(), 1)
+        self.assertEqual(AuditLog.stats()['direct_writes'], 1)
+        self.assertTrue(AuditLog.flush(timeout=0))
+
+    def test_log_is_append_only(self):
+        """Test that the triggers refuse to change or remove events"""
+        AuditLog.record(1, 'create', 'user', 2)
+        AuditLog.flush(timeout=5)
+
+        with connection() as conn:
+            with self.assertRaises(sqlite3.IntegrityError):
+                conn.execute("UPDATE audit_log SET action = 'none'")
+            with self.assertRaises(sqlite3.IntegrityError):
+                conn.execute("DELETE FROM audit_log")
+            conn.rollback()
+        self.assertEqual(self.count_rows(), 1)
+
+    def test_full_queue_writes_on_the_caller(self):
+        """Test that a full queue slows the request down instead of losing events"""
+        writer = audit._AuditWriter()
+        writer.queue.maxsize = 1
+        writer._start = lambda: None  # nothing drains the queue
+        with patch.object(audit, '_writer', writer), patch.object(audit, 'AUDIT_PUT_TIMEOUT', 0.01):
+            AuditLog.record(1, 'update', 'patient', 1, {'bmi': [20.0, 21.0]})
+            AuditLog.record(1, 'update', 'patient', 2, {'bmi': [22.0, 23.0]})
+
+            self.assertEqual(AuditLog.stats()['direct_writes'], 1)
+            self.assertEqual(self.count_rows(), 1)
+            writer.shutdown()
+        self.assertEqual(self.count_rows(), 2)
+
+    def test_keyset_pages(self):
+        """Test newest-first paging with older/newer cursors and filters"""
+        for i in range(1, 8):
+            AuditLog.record(1 if i % 2 else 2, 'update', 'patient', i)
+        AuditLog.flush(timeout=5)
+
+        first, older, newer = AuditLog.get_page(per_page=3)
+        self.assertEqual([e['target_id'] for e in first], ['7', '6', '5'])
+        self.assertIsNone(newer)
+
+        second, older2, newer2 = AuditLog.get_page(before=older, per_page=3)
+        self.assertEqual([e['target_id'] for e in second], ['4', '3', '2'])
+        last, older3, _ = AuditLog.get_page(before=older2, per_page=3)
+        self.assertEqual([e['target_id'] for e in last], ['1'])
+        self.assertIsNone(older3)
+
+        back, _, _ = AuditLog.get_page(after=newer2, per_page=3)
+        self.assertEqual(back, first)
+
+        mine, _, _ = AuditLog.get_page(actor_id=2, per_page=10)
+        self.assertEqual([e['target_id'] for e in mine], ['6', '4', '2'])
+
+    def test_field_diff(self):
+        """Test that only changed fields are kept, creates diff against nothing"""
+        self.assertEqual(field_diff({'age': 40, 'bmi': 20.0}, {'age': 41, 'bmi': 20.0}), {'age': [40, 41]})
+        self.assertEqual(field_diff(None, {'role': 'doctor'}), {'role': [None, 'doctor']})
+
+
+class AuditRouteTests(unittest.TestCase):
+    """Test cases for the audit events recorded by the dashboard routes"""
+
+    def setUp(self):
+        """Create the app with a temporary SQLite file, mongomock and a logged-in admin"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        init_db(os.path.join(self.tmpdir.name, "test.db"))
+        audit._forget_writer()
+        fragment_cache.store.clear()
+        self.collection = mongomock.MongoClient().HealthcareDB.StrokeData
+        self.collection.insert_one({'id': 1, 'gender': 'Female', 'age': 40, 'hypertension': 0,
+                                    'heart_disease': 0, 'ever_married': 'Yes', 'work_type': 'Private',
+                                    'Residence_type': 'Urban', 'avg_glucose_level': 90.0, 'bmi': 25.0,
+                                    'smoking_status': 'never smoked', 'stroke': 0})
+        Patient.clear_count_cache()
+
+        self.patchers = [
+            patch.dict(os.environ, {"SECRET_KEY": "test"}),
+            patch('app.init_db'),
+            patch('app.mongo_init_db'),
+            patch('app.seed_mongo'),
+            patch('app.models.patient.get_collection', return_value=self.collection),
+            patch('app.models.user.User.get_cached', return_value=None),
+            patch('app.models.risk.RiskModel.current', return_value=None),
+            patch('app.models.patient.CohortStats.record_change'),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+        from app import create_app
+        app = create_app()
+        app.testing = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['user_id'] = 9
+            session['role'] = 'admin'
+
+    def tearDown(self):
+        """Stop the patchers and the writer"""
+        for patcher in reversed(self.patchers):
+            patcher.stop()
+        AuditLog.shutdown()
+        audit._forget_writer()
+        close_pool()
+        self.tmpdir.cleanup()
+        Patient.clear_count_cache()
+
+    def test_patient_update_records_the_diff(self):
+        """Test that an update is logged with the actor and only the changed fields"""
+        form = {'gender': 'Female', 'age': '41', 'hypertension': '0', 'heart_disease': '0',
+                'ever_married': 'Yes', 'work_type': 'Private', 'residence_type': 'Urban',
+                'avg_glucose_level': '90.0', 'bmi': '26.5', 'smoking_status': 'never smoked', 'stroke': '0'}
+        self.client.post('/dashboard/patients/1/update', data=form)
+        self.client.post('/dashboard/patients/1/update', data=form)  # no change, no event
+
+        events = self.client.get('/dashboard/audit?format=json&fresh=1').get_json()['events']
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['actor_id'], 9)
+        self.assertEqual((events[0]['action'], events[0]['target_type'], events[0]['target_id']),
+                         ('update', 'patient', '1'))
+        self.assertEqual(events[0]['changes'], {'age': [40, 41], 'bmi': [25.0, 26.5]})
+
+    def test_user_changes_are_logged(self):
+        """Test that creating and deleting a user are logged without the password"""
+        self.client.post('/register_user', data={'first_name': 'Ada', 'last_name': 'Lovelace',
+                                                 'email': 'ada@example.com', 'password': 'Secret#123',
+                                                 'role': 'doctor'})
+        with connection() as conn:
+            user_id = conn.execute("SELECT id FROM users WHERE email = 'ada@example.com'").fetchone()[0]
+        self.client.post(f'/dashboard/users/{user_id}/delete')
+
+        events = self.client.get('/dashboard/audit?format=json&target=user&fresh=1').get_json()['events']
+        self.assertEqual([e['action'] for e in events], ['delete', 'create'])
+        self.assertEqual(events[1]['changes']['email'], [None, 'ada@example.com'])
+        self.assertNotIn('password', str(events[1]['changes']))
+
+    def test_audit_page_renders(self):
+        """Test that the admin page lists events"""
+        AuditLog.record(9, 'delete', 'patient', 1)
+        AuditLog.flush(timeout=5)
+
+        with patch.object(AuditLog, 'flush') as flush:
+            response = self.client.get('/dashboard/audit')
+        flush.assert_not_called()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Audit Log', response.data)
+        self.assertIn(b'delete', response.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
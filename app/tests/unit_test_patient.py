@@ -0,0 +1,598 @@
+import unittest
+import sys
+import os
+import csv
+import gzip
+import io
+import json
+import tempfile
+from unittest.mock import patch
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import mongomock
+from pymongo import MongoClient
+
+from app.config import mongo_db
+from app.config.sqlite import init_db
+from app.config.sqlite_pool import close_pool
+from app.models.audit import AuditLog
+from app.config.mongo_db import ensure_indexes, PATIENT_INDEXES
+from app.models.patient import Patient
+from app.models.cohort import CohortStats
+from app.models.risk import RiskModel
+from app.models.snapshot import PatientSnapshot
+from app.tests.mongomock_compat import patch_mongomock_bulk
+from utils.fragment_cache import fragment_cache, FragmentCache, SQLiteFragmentStore
+
+patch_mongomock_bulk()
+
+# Optional real mongod for query plan checks, e.g. mongodb://localhost:27017
+MONGO_TEST_URL = os.getenv("MONGO_TEST_URL")
+
+
+class PatientModelTests(unittest.TestCase):
+    """Test cases for the Patient model against an in-memory MongoDB"""
+
+    def setUp(self):
+        """Point the Patient model at a fresh mongomock collection"""
+        self.db = mongomock.MongoClient().HealthcareDB
+        self.collection = self.db.StrokeData
+        self.collection.insert_many([
+            {'id': i, 'gender': 'Male', 'age': 40, 'stroke': 0} for i in range(1, 26)
+        ])
+
+        self.patchers = [
+            patch('app.models.patient.get_collection', return_value=self.collection),
+            patch('app.models.cohort.get_collection', return_value=self.collection),
+            patch('app.models.cohort.get_db', return_value=self.db),
+            patch('app.models.risk.get_db', return_value=self.db),
+            patch('app.models.risk.get_collection', return_value=self.collection),
+            patch('app.models.snapshot.get_collection', return_value=self.collection),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+        Patient.clear_count_cache()
+        RiskModel.clear_cache()
+        PatientSnapshot.reset()
+
+    def tearDown(self):
+        """Stop the patchers"""
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def test_keyset_first_page(self):
+        """Test that the first page is newest first with only a next cursor"""
+        patients, next_cursor, prev_cursor = Patient.get_keyset_patients(per_page=10)
+
+        self.assertEqual([p['patient_id'] for p in patients], list(range(25, 15, -1)))
+        self.assertIsNotNone(next_cursor)
+        self.assertIsNone(prev_cursor)
+
+    def test_keyset_walk_forward_and_back(self):
+        """Test that next and prev cursors walk the pages without gaps"""
+        _, next_cursor, _ = Patient.get_keyset_patients(per_page=10)
+        second, next_cursor, prev_cursor = Patient.get_keyset_patients(cursor=next_cursor, per_page=10)
+        self.assertEqual([p['patient_id'] for p in second], list(range(15, 5, -1)))
+
+        last, end_cursor, _ = Patient.get_keyset_patients(cursor=next_cursor, per_page=10)
+        self.assertEqual([p['patient_id'] for p in last], list(range(5, 0, -1)))
+        self.assertIsNone(end_cursor)
+
+        first, _, first_prev = Patient.get_keyset_patients(cursor=prev_cursor, per_page=10)
+        self.assertEqual([p['patient_id'] for p in first], list(range(25, 15, -1)))
+        self.assertIsNone(first_prev)
+
+    def test_keyset_matches_skip_pagination(self):
+        """Test that page numbers without a cursor still skip to the right rows"""
+        patients, total = Patient.get_paginated_patients(page=3, per_page=10)
+
+        self.assertEqual([p['patient_id'] for p in patients], list(range(5, 0, -1)))
+        self.assertEqual(total, 25)
+
+    def test_filtered_sorted_keyset_pages(self):
+        """Test that filters and a sort key with ties page without gaps or repeats"""
+        for i in range(1, 26):
+            self.collection.update_one({'id': i}, {'$set': {'age': i % 5, 'stroke': i % 2}})
+        filters = {'stroke': 1, 'age_min': 1}
+        expected = [
+            doc['id'] for doc in self.collection.find({'stroke': 1, 'age': {'$gte': 1}})
+            .sort([('age', 1), ('_id', 1)])
+        ]
+
+        seen, cursor, cursors = [], None, []
+        while True:
+            page, cursor, _ = Patient.get_keyset_patients(
+                cursor=cursor, per_page=3, filters=filters, sort_by='age', order=1)
+            seen += [p.patient_id for p in page]
+            if cursor is None:
+                break
+            cursors.append(cursor)
+        self.assertEqual(seen, expected)
+        self.assertEqual(Patient.get_total_count(filters), len(expected))
+
+        # Stepping back from the last page returns the page before it
+        last, _, prev_cursor = Patient.get_keyset_patients(
+            cursor=cursors[-1], per_page=3, filters=filters, sort_by='age', order=1)
+        before, _, _ = Patient.get_keyset_patients(
+            cursor=prev_cursor, per_page=3, filters=filters, sort_by='age', order=1)
+        self.assertEqual([p.patient_id for p in before], expected[-len(last) - 3:-len(last)])
+
+    def test_keyset_pages_include_missing_values(self):
+        """Test that rows without a score are reached through cursors in both orders"""
+        for i in range(1, 26):
+            if i % 3:
+                self.collection.update_one({'id': i}, {'$set': {'risk_score': round(i % 4 * 0.1, 1)}})
+        self.collection.update_one({'id': 3}, {'$set': {'risk_score': None}})
+
+        for order in (1, -1):
+            skipped = [p.patient_id for page in range(1, 6)
+                       for p in Patient.get_keyset_patients(per_page=5, skip=(page - 1) * 5,
+                                                            sort_by='risk_score', order=order)[0]]
+            seen, cursor, cursors = [], None, []
+            while True:
+                page, cursor, _ = Patient.get_keyset_patients(cursor=cursor, per_page=4,
+                                                              sort_by='risk_score', order=order)
+                seen += [p.patient_id for p in page]
+                if cursor is None:
+                    break
+                cursors.append(cursor)
+            self.assertEqual(len(seen), 25)
+            self.assertEqual(seen, skipped)
+
+            # And back again from the last page
+            last, _, prev_cursor = Patient.get_keyset_patients(cursor=cursors[-1], per_page=4,
+                                                               sort_by='risk_score', order=order)
+            before, _, _ = Patient.get_keyset_patients(cursor=prev_cursor, per_page=4,
+                                                       sort_by='risk_score', order=order)
+            self.assertEqual([p.patient_id for p in before], seen[-len(last) - 4:-len(last)])
+
+    def test_cursor_tied_to_sort(self):
+        """Test that a cursor made for one sort is rejected by another"""
+        _, next_cursor, _ = Patient.get_keyset_patients(per_page=10)
+        with self.assertRaises(ValueError):
+            Patient.get_keyset_patients(cursor=next_cursor, sort_by='age')
+
+    def test_invalid_cursor(self):
+        """Test that a tampered cursor raises ValueError"""
+        with self.assertRaises(ValueError):
+            Patient.get_keyset_patients(cursor='not-a-cursor')
+
+    def test_rows_are_slotted_and_projected(self):
+        """Test that reads return compact Patient rows without extra fields"""
+        self.collection.update_one({'id': 7}, {'$set': {'Residence_type': 'Urban', 'notes': 'x' * 1000}})
+
+        patient = Patient.get_by_id(7)
+
+        self.assertIsInstance(patient, Patient)
+        self.assertFalse(hasattr(patient, '__dict__'))
+        self.assertEqual(patient['Residence_type'], 'Urban')
+        self.assertEqual(patient.patient_id, 7)
+        self.assertNotIn('notes', patient.to_dict())
+
+    def test_count_cache_cleared_on_delete(self):
+        """Test that deleting a patient refreshes the cached total"""
+        self.assertEqual(Patient.get_total_count(), 25)
+        Patient.delete_patient(1)
+        self.assertEqual(Patient.get_total_count(), 24)
+
+    def test_cohort_summary_follows_writes(self):
+        """Test that incremental cohort updates match a full re-aggregation"""
+        before = CohortStats.get_summary()
+        self.assertEqual(before['total_patients'], 25)
+        self.assertEqual(before['cohorts']['age_band'][0]['value'], '40-59')
+
+        Patient.create_patient(100, 'Female', 72, 1, 0, 'Yes', 'Private', 'Urban', 150.0, 30.0, 'smokes', 1)
+        Patient.update(3, 'Male', 15, 0, 0, 'No', 'children', 'Rural', 90.0, 20.0, 'Unknown', 1)
+        Patient.delete_patient(4)
+        incremental = CohortStats.get_summary()
+
+        CohortStats.refresh()
+        rebuilt = CohortStats.get_summary()
+        self.assertEqual(incremental['cohorts'], rebuilt['cohorts'])
+        self.assertEqual(incremental['total_patients'], 25)
+        self.assertEqual(incremental['total_strokes'], 2)
+
+
+class PatientExportTests(unittest.TestCase):
+    """Test cases for the streaming patient export route"""
+
+    def setUp(self):
+        """Create the app with databases patched and a logged-in doctor"""
+        self.collection = mongomock.MongoClient().HealthcareDB.StrokeData
+        self.collection.insert_many([
+            {'id': i, 'gender': 'Female' if i % 2 else 'Male', 'age': 30 + i, 'stroke': 0} for i in range(1, 1201)
+        ])
+
+        self.patchers = [
+            patch.dict(os.environ, {"SECRET_KEY": "test"}),
+            patch('app.init_db'),
+            patch('app.mongo_init_db'),
+            patch('app.seed_mongo'),
+            patch('app.models.patient.get_collection', return_value=self.collection),
+            patch('app.models.user.User.get_cached', return_value=None),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+        from app import create_app
+        app = create_app()
+        app.testing = True
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['user_id'] = 1
+            session['role'] = 'doctor'
+
+    def tearDown(self):
+        """Stop the patchers"""
+        for patcher in reversed(self.patchers):
+            patcher.stop()
+
+    def test_csv_export_is_filtered_and_gzipped(self):
+        """Test that the CSV export applies filters and honours gzip"""
+        response = self.client.get('/dashboard/export?format=csv&gender=Male',
+                                   headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        rows = list(csv.DictReader(io.StringIO(gzip.decompress(response.data).decode())))
+        self.assertEqual(len(rows), 600)
+        self.assertTrue(all(row['gender'] == 'Male' for row in rows))
+
+    def test_ndjson_export(self):
+        """Test that the NDJSON export has one document per line"""
+        response = self.client.get('/dashboard/export?format=ndjson&age_max=40')
+
+        self.assertEqual(response.status_code, 200)
+        lines = response.data.decode().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], list(range(1, 11)))
+
+
+class PatientImportTests(unittest.TestCase):
+    """Test cases for the bulk patient import route"""
+
+    def setUp(self):
+        """Create the app with databases patched and a logged-in admin"""
+        # Imports are audited, the events go to a temporary SQLite file
+        self.tmpdir = tempfile.TemporaryDirectory()
+        init_db(os.path.join(self.tmpdir.name, "test.db"))
+        self.collection = mongomock.MongoClient().HealthcareDB.StrokeData
+        self.collection.insert_one({'id': 1, 'gender': 'Male', 'age': 50})
+
+        self.patchers = [
+            patch.dict(os.environ, {"SECRET_KEY": "test"}),
+            patch('app.init_db'),
+            patch('app.mongo_init_db'),
+            patch('app.seed_mongo'),
+            patch('app.models.patient.get_collection', return_value=self.collection),
+            patch('app.models.patient.CohortStats.record_changes'),
+            patch('app.models.patient.RiskModel.current', return_value=None),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+        from app import create_app
+        app = create_app()
+        app.testing = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['user_id'] = 1
+            session['role'] = 'admin'
+
+    def tearDown(self):
+        """Stop the patchers, write queued audit events while the temporary database is current"""
+        for patcher in reversed(self.patchers):
+            patcher.stop()
+        AuditLog.flush(timeout=5)
+        close_pool()
+        self.tmpdir.cleanup()
+
+    def upload(self, filename, text):
+        return self.client.post('/dashboard/patients/import',
+                                data={'file': (io.BytesIO(text.encode()), filename)},
+                                content_type='multipart/form-data')
+
+    def test_csv_import_reports_bad_rows(self):
+        """Test that valid rows are inserted and every bad row is reported"""
+        header = "id,gender,age,hypertension,heart_disease,ever_married,work_type,Residence_type,avg_glucose_level,bmi,smoking_status,stroke\n"
+        rows = [
+            "2,Female,61,0,0,Yes,Private,Rural,202.21,28.1,never smoked,1",
+            "3,Female,61,0,0,Yes,Private,Rural,202.21,5,never smoked,0",     # BMI out of range
+            "1,Male,40,0,0,No,Private,Urban,90,25,smokes,0",                 # already exists
+            "2,Male,40,0,0,No,Private,Urban,90,25,smokes,0",                 # repeated in upload
+            "4,Other,40,0,0,No,Private,Urban,90,25,smokes,0",                # bad gender
+            "5,Male,40,0,0,No,Private,Urban,90,25,smokes,0",
+        ]
+        response = self.upload("patients.csv", header + "\n".join(rows))
+
+        self.assertEqual(response.status_code, 200)
+        report = response.json
+        self.assertEqual((report['rows'], report['inserted'], report['failed']), (6, 2, 4))
+        self.assertEqual([e['row'] for e in report['errors']], [2, 3, 4, 5])
+        self.assertEqual([e['id'] for e in report['errors']], [3, 1, 2, 4])
+        self.assertTrue(all(type(e['id']) is int for e in report['errors']))
+        self.assertEqual(report['errors'][0]['error'], "Invalid BMI value.")
+        self.assertIn('rows_per_second', report)
+        self.assertEqual(self.collection.count_documents({}), 3)
+
+    def test_ndjson_import(self):
+        """Test that NDJSON uploads are accepted"""
+        line = {'id': 9, 'gender': 'Female', 'age': 30, 'ever_married': 'No', 'work_type': 'Private',
+                'residence_type': 'Urban', 'avg_glucose_level': 80, 'bmi': 22.5, 'smoking_status': 'Unknown'}
+        response = self.upload("patients.ndjson", json.dumps(line) + "\nnot json\n")
+
+        self.assertEqual(response.json['inserted'], 1)
+        self.assertEqual(response.json['errors'][0]['row'], 2)
+        self.assertEqual(self.collection.find_one({'id': 9})['Residence_type'], 'Urban')
+
+
+class AsyncDashboardTests(unittest.TestCase):
+    """Test cases for the async dashboard views"""
+
+    def setUp(self):
+        """Create the app with databases patched and a logged-in admin"""
+        self.collection = mongomock.MongoClient().HealthcareDB.StrokeData
+        self.collection.insert_many([{'id': i, 'gender': 'Female', 'age': 40 + i, 'stroke': 0} for i in range(1, 31)])
+        Patient.clear_count_cache()
+        fragment_cache.store.clear()
+
+        self.patchers = [
+            patch.dict(os.environ, {"SECRET_KEY": "test"}),
+            patch('app.init_db'),
+            patch('app.mongo_init_db'),
+            patch('app.seed_mongo'),
+            patch('app.models.patient.get_collection', return_value=self.collection),
+            patch('app.models.user.User.get_cached', return_value=None),
+            patch('app.models.risk.RiskModel.current', return_value=None),
+            patch('app.models.patient.CohortStats.record_change'),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+        from app import create_app
+        app = create_app()
+        app.testing = True
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['user_id'] = 1
+            session['role'] = 'admin'
+
+    def tearDown(self):
+        """Stop the patchers"""
+        for patcher in reversed(self.patchers):
+            patcher.stop()
+        Patient.clear_count_cache()
+
+    def test_dashboard_queries_run_concurrently(self):
+        """Test that the page, the count and current_user are fetched at the same time"""
+        import threading
+        barrier = threading.Barrier(3, timeout=5)
+
+        def together(func):
+            # Only the first call waits, current_user is looked up again while rendering
+            first = []
+            def wrapper(*args, **kwargs):
+                if not first:
+                    first.append(True)
+                    barrier.wait()
+                return func(*args, **kwargs)
+            return wrapper
+
+        with patch.object(Patient, 'get_keyset_patients', together(Patient.get_keyset_patients)), \
+             patch.object(Patient, 'get_total_count', together(Patient.get_total_count)), \
+             patch('app.models.user.User.get_cached', together(lambda user_id: None)):
+            response = self.client.get('/dashboard?per_page=10')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'of 30 patients', response.data)
+
+    def test_view_patient(self):
+        """Test that the async patient view renders and redirects when missing"""
+        self.assertEqual(self.client.get('/dashboard/patients/5').status_code, 200)
+        response = self.client.get('/dashboard/patients/999')
+        self.assertEqual(response.status_code, 302)
+
+    def test_patient_page_revalidates_with_etag(self):
+        """Test that an unchanged patient is answered with 304 until it is updated"""
+        first = self.client.get('/dashboard/patients/5')
+        etag = first.headers['ETag']
+        self.assertEqual(first.headers['Cache-Control'], 'private, no-cache')
+
+        with patch.object(Patient, 'get_by_id') as get_by_id:
+            cached = self.client.get('/dashboard/patients/5', headers={'If-None-Match': etag})
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.data, b'')
+        get_by_id.assert_not_called()
+
+        Patient.update(5, 'Male', 60, 0, 0, 'Yes', 'Private', 'Urban', 100.0, 25.0, 'never smoked', 0)
+        changed = self.client.get('/dashboard/patients/5', headers={'If-None-Match': etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers['ETag'], etag)
+        self.assertEqual(self.collection.find_one({'id': 5})['version'], 1)
+
+    def test_new_login_does_not_revalidate_old_pages(self):
+        """Test that a page cached before logging out is rendered again, with the new CSRF token"""
+        etag = self.client.get('/dashboard/patients/5').headers['ETag']
+        self.client.get('/logout')
+        with self.client.session_transaction() as session:
+            session['user_id'] = 1
+            session['role'] = 'admin'
+
+        response = self.client.get('/dashboard/patients/5', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        again = self.client.get('/dashboard/patients/5', headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(again.status_code, 304)
+
+    def test_dashboard_revalidates_until_a_write(self):
+        """Test that list pages turn stale on create and delete, and depend on the query"""
+        etag = self.client.get('/dashboard?page=2').headers['ETag']
+        self.assertEqual(self.client.get('/dashboard?page=2', headers={'If-None-Match': etag}).status_code, 304)
+        self.assertEqual(self.client.get('/dashboard?page=3', headers={'If-None-Match': etag}).status_code, 200)
+
+        Patient.delete_patient(7)
+        response = self.client.get('/dashboard?page=2', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Patient.collection_version(), 1)
+
+    def test_flash_message_is_not_swallowed_by_304(self):
+        """Test that a page with a waiting message is rendered even if unchanged"""
+        etag = self.client.get('/dashboard/patients/5').headers['ETag']
+        with self.client.session_transaction() as session:
+            session['_flashes'] = [('success', 'Saved')]
+        response = self.client.get('/dashboard/patients/5', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Saved', response.data)
+
+    def test_table_rows_are_cached_per_role(self):
+        """Test that a second viewer with the same role reuses the rendered rows"""
+        first = self.client.get('/dashboard?per_page=10')
+        self.assertIn(b'Delete', first.data)
+
+        with self.client.session_transaction() as session:
+            session['user_id'] = 2
+        with patch.object(Patient, 'get_keyset_patients') as keyset, \
+             patch.object(Patient, 'get_total_count') as count:
+            second = self.client.get('/dashboard?per_page=10')
+        keyset.assert_not_called()
+        count.assert_not_called()
+        self.assertIn(b'of 30 patients', second.data)
+        self.assertIn(b'Delete', second.data)
+
+        # Doctors get their own rows, without the admin's delete buttons
+        with self.client.session_transaction() as session:
+            session['role'] = 'doctor'
+        doctor = self.client.get('/dashboard?per_page=10')
+        self.assertNotIn(b'openDeleteModal(\'30\'', doctor.data)
+
+    def test_patient_write_invalidates_rows(self):
+        """Test that Patient writes retire the cached rows"""
+        self.client.get('/dashboard?per_page=10&sort=age&order=desc')
+        Patient.update(30, 'Male', 99, 0, 0, 'Yes', 'Private', 'Urban', 100.0, 25.0, 'never smoked', 0)
+        with patch('app.models.patient.Patient.collection_version', return_value=0):
+            response = self.client.get('/dashboard?per_page=10&sort=age&order=desc')
+        self.assertIn(b'>99<', response.data.replace(b' ', b''))
+
+    def test_user_dashboard(self):
+        """Test that the async user dashboard renders a page of users"""
+        with patch('app.models.user.User.get_keyset_users', return_value=([], None, None)) as keyset, \
+             patch('app.models.user.User.count_users', return_value=0) as count, \
+             patch('app.models.user.User.table_version', return_value=0):
+            response = self.client.get('/user_dashboard?page=2&q=ada')
+        self.assertEqual(response.status_code, 200)
+        keyset.assert_called_once_with(cursor=None, per_page=10, skip=10, search='ada')
+        count.assert_called_once_with('ada')
+
+    def test_decorators_guard_async_views(self):
+        """Test that the role checks still run before an async view"""
+        with self.client.session_transaction() as session:
+            session['role'] = 'doctor'
+        response = self.client.get('/user_dashboard')
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/login', response.headers['Location'])
+
+
+class FragmentCacheTests(unittest.TestCase):
+    """Test cases for the fragment cache and its shared SQLite store"""
+
+    def test_sqlite_store_is_shared_and_invalidated(self):
+        """Test that two caches on one file see each other's fragments and invalidations"""
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'fragments.db')
+            first = FragmentCache(SQLiteFragmentStore(path), ttl=60)
+            second = FragmentCache(SQLiteFragmentStore(path), ttl=60)
+
+            first.set('users', {'page': 1}, {'rows': '<tr></tr>', 'total': 1})
+            self.assertEqual(second.get('users', {'page': 1}), {'rows': '<tr></tr>', 'total': 1})
+            self.assertIsNone(second.get('users', {'page': 2}))
+
+            second.invalidate('users')
+            self.assertIsNone(first.get('users', {'page': 1}))
+            self.assertEqual((second.hits, second.misses), (1, 1))
+
+    def test_sqlite_store_expires_and_bounds_entries(self):
+        """Test that expired fragments are not returned and the table stays within maxsize"""
+        import tempfile
+        now = [1000.0]
+        with tempfile.TemporaryDirectory() as tmp:
+            store = SQLiteFragmentStore(os.path.join(tmp, 'fragments.db'), maxsize=3, clock=lambda: now[0])
+            for i in range(5):
+                store.set(f'k{i}', i, ttl=10 + i)
+            count = store._connect().execute("SELECT COUNT(*) FROM fragments").fetchone()[0]
+            self.assertEqual(count, 3)
+            self.assertEqual(store.get('k4'), 4)
+            now[0] += 100
+            self.assertIsNone(store.get('k4'))
+
+
+class PatientIndexTests(unittest.TestCase):
+    """Test cases for the patient index bootstrap"""
+
+    def test_ensure_indexes_is_idempotent(self):
+        """Test that indexes are created once and the id index is unique"""
+        collection = mongomock.MongoClient().HealthcareDB.StrokeData
+
+        created = ensure_indexes(collection)
+        self.assertEqual(created, [name for name, _, _ in PATIENT_INDEXES])
+        self.assertEqual(ensure_indexes(collection), [])
+
+        info = collection.index_information()
+        self.assertTrue(info['id_unique'].get('unique'))
+
+    @unittest.skipUnless(MONGO_TEST_URL, "MONGO_TEST_URL not set")
+    def test_id_lookup_uses_index(self):
+        """Test on a real mongod that lookups by id are index scans"""
+        client = MongoClient(MONGO_TEST_URL, serverSelectionTimeoutMS=3000)
+        collection = client.index_test_db.StrokeData
+        try:
+            collection.drop()
+            collection.insert_many([{'id': i, 'stroke': i % 2, 'age': i % 90} for i in range(500)])
+            ensure_indexes(collection)
+
+            plan = collection.find({'id': 42}).explain()['queryPlanner']['winningPlan']
+            self.assertIn('id_unique', str(plan))
+            self.assertNotIn('COLLSCAN', str(plan))
+
+            plan = collection.find({'stroke': 1}).sort('age', -1).explain()['queryPlanner']['winningPlan']
+            self.assertIn('stroke_age', str(plan))
+        finally:
+            client.drop_database('index_test_db')
+            client.close()
+
+
+class MongoClientTests(unittest.TestCase):
+    """Test cases for the shared MongoClient lifecycle"""
+
+    def setUp(self):
+        """Point the registry at an address nothing listens on (clients connect lazily)"""
+        self.url_patcher = patch.object(mongo_db, 'MONGO_URL', 'mongodb://127.0.0.1:1')
+        self.url_patcher.start()
+        mongo_db.close_db()
+
+    def tearDown(self):
+        """Close the client and restore the URL"""
+        mongo_db.close_db()
+        self.url_patcher.stop()
+
+    def test_client_is_shared_and_tuned(self):
+        """Test that one client is reused and carries the pool settings"""
+        first = mongo_db.get_client()
+
+        self.assertIs(mongo_db.get_client(), first)
+        self.assertEqual(first.options.pool_options.max_pool_size, mongo_db.CLIENT_OPTIONS['maxPoolSize'])
+        self.assertEqual(mongo_db.get_pool_stats()['in_use'], 0)
+
+    def test_client_recreated_after_fork(self):
+        """Test that a client inherited from another process is replaced"""
+        first = mongo_db.get_client()
+        mongo_db._client_pid = -1
+
+        self.assertIsNot(mongo_db.get_client(), first)
+        first.close()
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
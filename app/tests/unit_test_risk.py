@@ -0,0 +1,144 @@
+import unittest
+import sys
+import os
+from unittest.mock import patch
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import mongomock
+import numpy as np
+import pandas as pd
+
+from app.models.patient import Patient
+from app.models.snapshot import PatientSnapshot
+from app.models.risk import RiskModel, FEATURES, MODEL_COLLECTION, risk_band
+from app.tests.mongomock_compat import patch_mongomock_bulk
+
+patch_mongomock_bulk()
+
+
+def synthetic_patients(rows, seed=0):
+    """Random patients whose stroke odds rise with age, hypertension and glucose"""
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame({
+        'age': rng.integers(1, 90, rows),
+        'hypertension': rng.integers(0, 2, rows),
+        'heart_disease': rng.integers(0, 2, rows),
+        'avg_glucose_level': rng.uniform(55, 270, rows).round(2),
+        'bmi': np.where(rng.random(rows) < 0.05, 0.0, rng.uniform(15, 50, rows).round(1)),
+        'smoking_status': rng.choice(['never smoked', 'smokes', 'formerly smoked', 'Unknown'], rows),
+    })
+    logit = (-7 + 0.06 * frame['age'] + 0.8 * frame['hypertension']
+             + 0.5 * frame['heart_disease'] + 0.005 * frame['avg_glucose_level'])
+    frame['stroke'] = (rng.random(rows) < 1 / (1 + np.exp(-logit))).astype(int)
+    return frame
+
+
+class RiskModelTests(unittest.TestCase):
+    """Test cases for the stroke risk model"""
+
+    def setUp(self):
+        """Load synthetic patients into mongomock and point the models at it"""
+        self.db = mongomock.MongoClient().HealthcareDB
+        self.collection = self.db.StrokeData
+        frame = synthetic_patients(400)
+        frame['id'] = range(1, len(frame) + 1)
+        self.collection.insert_many(frame.to_dict('records'))
+
+        self.patchers = [
+            patch('app.models.risk.get_db', return_value=self.db),
+            patch('app.models.risk.get_collection', return_value=self.collection),
+            patch('app.models.snapshot.get_collection', return_value=self.collection),
+            patch('app.models.patient.get_collection', return_value=self.collection),
+            patch('app.models.patient.CohortStats.record_change'),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+        RiskModel.clear_cache()
+        PatientSnapshot.reset()
+        Patient.clear_count_cache()
+
+    def tearDown(self):
+        """Stop the patchers"""
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def test_fit_learns_known_effects(self):
+        """Test that the fitted coefficients point the way the data was generated"""
+        model = RiskModel.fit(synthetic_patients(20000, seed=1))
+        coef = dict(zip(FEATURES, model.coef))
+
+        self.assertGreater(coef['age'], 0)
+        self.assertGreater(coef['hypertension'], 0)
+        self.assertGreater(coef['avg_glucose_level'], 0)
+        self.assertAlmostEqual(model.bmi_fill, 32.5, delta=1.5)
+
+    def test_fit_needs_both_labels(self):
+        """Test that a frame without strokes cannot be fitted"""
+        frame = synthetic_patients(100)
+        frame['stroke'] = 0
+        with self.assertRaises(ValueError):
+            RiskModel.fit(frame)
+
+    def test_refresh_stores_scores_and_model(self):
+        """Test that a refresh scores every patient and a second one writes nothing"""
+        first = RiskModel.refresh()
+
+        self.assertEqual((first['patients'], first['updated']), (400, 400))
+        self.assertEqual(self.collection.count_documents({'risk_score': {'$gte': 0, '$lte': 1}}), 400)
+        self.assertIsNotNone(self.db[MODEL_COLLECTION].find_one({'_id': 'current'}))
+        self.assertEqual(RiskModel.refresh()['updated'], 0)
+
+    def test_vectorized_matches_single_scores(self):
+        """Test that scoring one document gives the same result as the batch pass"""
+        RiskModel.refresh()
+        RiskModel.clear_cache()
+        model = RiskModel.current()
+
+        doc = self.collection.find_one({'id': 10})
+        self.assertEqual(model.score_docs([doc])[0], doc['risk_score'])
+
+    def test_writes_are_scored_and_sortable(self):
+        """Test that new patients get a score and the dashboard can sort by it"""
+        RiskModel.refresh()
+        Patient.create_patient(5000, 'Male', 89, 1, 1, 'Yes', 'Private', 'Urban', 260.0, 35.0, 'smokes', 0)
+        Patient.create_patient(5001, 'Female', 2, 0, 0, 'No', 'children', 'Rural', 60.0, 18.0, 'Unknown', 0)
+
+        riskiest, _, _ = Patient.get_keyset_patients(per_page=1, sort_by='risk_score', order=-1)
+        safest, _, _ = Patient.get_keyset_patients(per_page=1, sort_by='risk_score', order=1)
+        self.assertEqual(riskiest[0].patient_id, 5000)
+        self.assertLess(safest[0].risk_score, riskiest[0].risk_score)
+        self.assertEqual(risk_band(Patient.get_by_id(5001).risk_score), 'Low')
+        self.assertEqual(risk_band(riskiest[0].risk_score), 'High')
+
+    def test_update_keeps_the_snapshot_score(self):
+        """Test that an update puts the stored risk score in the snapshot, not the old one"""
+        RiskModel.refresh()
+        Patient.update(10, 'Male', 88, 1, 1, 'Yes', 'Private', 'Urban', 250.0, 35.0, 'smokes', 0)
+
+        stored = self.collection.find_one({'id': 10})['risk_score']
+        self.assertEqual(PatientSnapshot.current().get(10)['risk_score'], stored)
+
+    def test_missing_model_is_not_fitted_on_read(self):
+        """Test that current() never fits and remembers a missing model briefly"""
+        with patch.object(RiskModel, 'refresh') as refresh, \
+                patch.object(self.db[MODEL_COLLECTION], 'find_one', return_value=None) as find_one:
+            self.assertIsNone(RiskModel.current())
+            self.assertIsNone(RiskModel.current())
+
+        refresh.assert_not_called()
+        self.assertEqual(find_one.call_count, 1)
+
+    def test_explain_lists_raising_factors(self):
+        """Test that explain names the features pushing a patient's risk up"""
+        model = RiskModel.fit(synthetic_patients(5000))
+        doc = {'age': 85, 'hypertension': 1, 'heart_disease': 0, 'avg_glucose_level': 90,
+               'bmi': 25, 'smoking_status': 'never smoked'}
+
+        labels = [label for label, _ in model.explain(doc)]
+        self.assertEqual(labels[:2], ['Age', 'Hypertension'])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
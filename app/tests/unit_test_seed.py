@@ -0,0 +1,189 @@
+import unittest
+import sys
+import os
+import tempfile
+from unittest.mock import patch
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import mongomock
+import numpy as np
+
+from app.tests.mongomock_compat import patch_mongomock_bulk
+from app.config.mongo_seed import (stream_seed, read_batches, delta_sync, parse_csv, cache_dir_for,
+                                   load_seed_frame, SEED_DONE, SEED_PROGRESS)
+from app.models.patient import Patient
+from utils.column_cache import load_table, build_table
+
+patch_mongomock_bulk()
+
+CSV_HEADER = "id,gender,age,hypertension,heart_disease,ever_married,work_type,Residence_type,avg_glucose_level,bmi,smoking_status,stroke\n"
+
+
+class SeedTests(unittest.TestCase):
+    """Test cases for the streaming CSV seeder"""
+
+    def setUp(self):
+        """Write a small CSV and point the seeder at mongomock"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.tmpdir.name, "stroke.csv")
+        with open(self.csv_path, "w") as f:
+            f.write(CSV_HEADER)
+            for i in range(1, 8):
+                bmi = "N/A" if i == 3 else "28.5"
+                f.write(f"{i},Female,{i}0.5,0,1,Yes,Private,Urban,100.25,{bmi},never smoked,{i % 2}\n")
+
+        db = mongomock.MongoClient().HealthcareDB
+        self.patients = db.StrokeData
+        self.markers = db.SeedMarkers
+        self.fingerprints = db.SeedFingerprints
+
+    def tearDown(self):
+        """Remove the CSV"""
+        self.tmpdir.cleanup()
+
+    def test_batches_and_coercion(self):
+        """Test that rows are streamed in batches with the seed type rules"""
+        batches = list(read_batches(self.csv_path, batch_size=3))
+
+        self.assertEqual([len(b) for b in batches], [3, 3, 1])
+        row = batches[0][2]
+        self.assertEqual(row['age'], 30)
+        self.assertEqual(row['bmi'], 0.0)
+        self.assertEqual(row['avg_glucose_level'], 100.25)
+        self.assertEqual(row['stroke'], 1)
+
+    def test_stream_seed(self):
+        """Test that a full seed writes every row and sets the done marker"""
+        written = stream_seed(self.patients, self.markers, self.csv_path, batch_size=3)
+
+        self.assertEqual(written, 7)
+        self.assertEqual(self.patients.count_documents({}), 7)
+        self.assertIsNotNone(self.markers.find_one({"name": SEED_DONE}))
+        self.assertIsNone(self.markers.find_one({"name": SEED_PROGRESS}))
+
+    def test_stream_seed_resumes(self):
+        """Test that an interrupted seed continues after the saved row count"""
+        self.patients.insert_many([{'id': i} for i in range(1, 4)])
+        self.markers.insert_one({"name": SEED_PROGRESS, "rows_done": 3})
+
+        written = stream_seed(self.patients, self.markers, self.csv_path, batch_size=3)
+
+        self.assertEqual(written, 4)
+        self.assertEqual(self.patients.count_documents({}), 7)
+
+    def test_delta_sync_touches_only_changes(self):
+        """Test that a refreshed CSV only upserts and deletes what changed"""
+        first = delta_sync(self.patients, self.fingerprints, self.csv_path, batch_size=3)
+        self.assertEqual(first['upserted'], 7)
+
+        # Patient added through the app must survive the sync
+        self.patients.insert_one({'id': 999, 'gender': 'Male'})
+
+        with open(self.csv_path) as f:
+            lines = f.readlines()
+        lines[2] = lines[2].replace("Private", "Govt_job")   # change patient 2
+        del lines[5]                                          # remove patient 5
+        lines.append("8,Male,45,1,0,No,Private,Rural,90.0,30.1,smokes,0\n")
+        with open(self.csv_path, "w") as f:
+            f.writelines(lines)
+
+        second = delta_sync(self.patients, self.fingerprints, self.csv_path, batch_size=3)
+
+        self.assertEqual(second, {'upserted': 2, 'deleted': 1, 'unchanged': 5})
+        self.assertEqual(self.patients.find_one({'id': 2})['work_type'], "Govt_job")
+        self.assertIsNone(self.patients.find_one({'id': 5}))
+        self.assertIsNotNone(self.patients.find_one({'id': 999}))
+        self.assertEqual(self.patients.count_documents({}), 8)
+
+    def test_delta_sync_bumps_versions(self):
+        """Test that changed patients and the collection get a new version, unchanged ones keep theirs"""
+        patcher = patch('app.models.patient.get_collection', return_value=self.patients)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        delta_sync(self.patients, self.fingerprints, self.csv_path, batch_size=3)
+        self.assertEqual(self.patients.find_one({'id': 2})['version'], 1)
+        collection_version = Patient.collection_version()
+
+        with open(self.csv_path) as f:
+            lines = f.readlines()
+        lines[2] = lines[2].replace("Private", "Govt_job")
+        with open(self.csv_path, "w") as f:
+            f.writelines(lines)
+        delta_sync(self.patients, self.fingerprints, self.csv_path, batch_size=3)
+
+        self.assertEqual(self.patients.find_one({'id': 2})['version'], 2)
+        self.assertEqual(self.patients.find_one({'id': 1})['version'], 1)
+        self.assertGreater(Patient.collection_version(), collection_version)
+
+        delta_sync(self.patients, self.fingerprints, self.csv_path, batch_size=3)
+        self.assertEqual(self.patients.find_one({'id': 2})['version'], 2)
+
+    def test_cache_matches_csv(self):
+        """Test that batches from the binary cache equal the parsed CSV rows"""
+        parsed = list(parse_csv(self.csv_path))
+        cached = [record for batch in read_batches(self.csv_path, batch_size=3) for record in batch]
+
+        self.assertEqual(cached, parsed)
+        self.assertEqual([type(v) for v in cached[2].values()], [type(v) for v in parsed[2].values()])
+        self.assertEqual(list(cached[0]), list(parsed[0]))
+
+    def test_cache_is_memory_mapped_and_follows_the_csv(self):
+        """Test that the cache is reused until the CSV changes, then rebuilt"""
+        cache_dir = cache_dir_for(self.csv_path)
+        _, cached = load_table(self.csv_path, parse_csv, cache_dir)
+        self.assertFalse(cached)
+
+        table, cached = load_table(self.csv_path, parse_csv, cache_dir)
+        self.assertTrue(cached)
+        self.assertIsInstance(table.arrays['bmi'], np.memmap)
+        self.assertEqual(table.arrays['age'].dtype, np.int64)
+
+        with open(self.csv_path, "a") as f:
+            f.write("8,Male,45,1,0,No,Private,Rural,90.0,30.1,smokes,0\n")
+        table, cached = load_table(self.csv_path, parse_csv, cache_dir)
+        self.assertFalse(cached)
+        self.assertEqual(len(table), 8)
+        self.assertEqual(len([name for name in os.listdir(cache_dir)
+                              if os.path.isdir(os.path.join(cache_dir, name))]), 1)
+
+        frame = load_seed_frame(self.csv_path)
+        self.assertEqual(frame['bmi'].sum(), 28.5 * 6 + 30.1)
+        self.assertEqual(list(frame['smoking_status'].cat.categories), ['never smoked', 'smokes'])
+
+    def test_unchanged_csv_is_not_hashed_again(self):
+        """Test that a cache hit with the same size and mtime skips hashing the CSV"""
+        cache_dir = cache_dir_for(self.csv_path)
+        load_table(self.csv_path, parse_csv, cache_dir)
+
+        with patch('utils.column_cache.file_hash', side_effect=AssertionError("hashed")):
+            _, cached = load_table(self.csv_path, parse_csv, cache_dir)
+        self.assertTrue(cached)
+
+        # A touched but identical file is hashed once, then found in the cache
+        os.utime(self.csv_path, ns=(0, 0))
+        _, cached = load_table(self.csv_path, parse_csv, cache_dir)
+        self.assertTrue(cached)
+
+    def test_chunked_build_matches_whole_build(self):
+        """Test that building in small chunks widens columns like one big chunk"""
+        rows = [{'a': 1, 'b': 1, 'c': 'x'}, {'a': 2, 'b': 2.5, 'c': 'y'},
+                {'a': 3, 'b': 3, 'c': 4}, {'a': 4, 'b': 4, 'c': 'x'}]
+        whole = build_table(rows, chunk_rows=100)
+        chunked = build_table(rows, chunk_rows=1)
+
+        self.assertEqual(chunked.arrays['a'].dtype, np.int64)
+        self.assertEqual(chunked.arrays['b'].dtype, np.float64)
+        self.assertEqual(list(chunked.batches(10))[0], list(whole.batches(10))[0])
+        self.assertEqual(chunked.categories['c'], ['x', 'y', '4'])
+
+    def test_resume_skips_rows_in_cache(self):
+        """Test that skipped rows are honoured when reading from the cache"""
+        batches = list(read_batches(self.csv_path, batch_size=4, skip_rows=5))
+
+        self.assertEqual([[r['id'] for r in b] for b in batches], [[6, 7]])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,157 @@
+import unittest
+import sys
+import os
+from unittest.mock import patch
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import mongomock
+from bson.objectid import ObjectId
+
+from app.models.patient import Patient
+from app.models.snapshot import PatientSnapshot
+
+
+class PatientSnapshotTests(unittest.TestCase):
+    """Test cases for the columnar patient snapshot"""
+
+    def setUp(self):
+        """Fill mongomock with patients and point the models at it"""
+        self.db = mongomock.MongoClient().HealthcareDB
+        self.collection = self.db.StrokeData
+        smoking = ['never smoked', 'smokes', 'formerly smoked', 'Unknown']
+        self.collection.insert_many([
+            {'id': i, 'gender': 'Male' if i % 2 else 'Female', 'age': 20 + i, 'hypertension': i % 2,
+             'heart_disease': 0, 'ever_married': 'Yes', 'work_type': 'Private', 'Residence_type': 'Urban',
+             'avg_glucose_level': 80.25 + i, 'bmi': 22.1, 'smoking_status': smoking[i % 4], 'stroke': 0}
+            for i in range(1, 51)
+        ])
+
+        self.patchers = [
+            patch('app.models.snapshot.get_collection', return_value=self.collection),
+            patch('app.models.patient.get_collection', return_value=self.collection),
+            patch('app.models.patient.CohortStats.record_change'),
+            patch('app.models.patient.RiskModel.current', return_value=None),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+        PatientSnapshot.reset()
+        Patient.clear_count_cache()
+
+    def tearDown(self):
+        """Stop the patchers and drop the snapshot"""
+        PatientSnapshot.reset()
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def test_load_is_compact_and_exact(self):
+        """Test that the snapshot holds every patient in a few dozen bytes each"""
+        snapshot = PatientSnapshot.current()
+
+        self.assertEqual(len(snapshot), 50)
+        self.assertLess(snapshot.nbytes / len(snapshot), 80)
+        self.assertEqual(snapshot.categories['smoking_status'],
+                         ['smokes', 'formerly smoked', 'Unknown', 'never smoked'])
+
+        doc = snapshot.get(7)
+        original = self.collection.find_one({'id': 7})
+        for field in ('_id', 'age', 'hypertension', 'avg_glucose_level', 'bmi', 'smoking_status', 'gender'):
+            self.assertEqual(doc[field], original[field])
+        self.assertIsNone(doc['risk_score'])
+
+        frame = snapshot.frame(('id', 'age', 'smoking_status'))
+        self.assertEqual(frame['age'].sum(), sum(range(21, 71)))
+        self.assertEqual((frame['smoking_status'] == 'smokes').sum(), 13)
+
+    def test_batched_load_matches_single_batch(self):
+        """Test that filling the arrays a few documents at a time gives the same snapshot"""
+        self.collection.insert_one({'id': 51, 'gender': '', 'smoking_status': None})
+        whole = PatientSnapshot.load(self.collection, batch_size=1000)
+        batched = PatientSnapshot.load(self.collection, batch_size=7)
+
+        self.assertEqual(len(batched), 51)
+        self.assertEqual(batched.categories, whole.categories)
+        self.assertTrue(batched.frame(with_object_ids=True).equals(whole.frame(with_object_ids=True)))
+        self.assertIsNone(batched.get(51)['gender'])
+
+    def test_patient_writes_are_reflected(self):
+        """Test that creates, updates and deletes through Patient reach the snapshot"""
+        snapshot = PatientSnapshot.current()
+
+        Patient.create_patient(100, 'Female', 70, 1, 1, 'Yes', 'Self-employed', 'Rural', 190.5, 31.0, 'smokes', 1)
+        Patient.update(3, 'Male', 45, 0, 0, 'No', 'Govt_job', 'Urban', 90.0, 25.0, 'Unknown', 1)
+        Patient.delete_patient(4)
+
+        self.assertEqual(len(snapshot), 50)
+        self.assertEqual(snapshot.get(100)['work_type'], 'Self-employed')
+        self.assertEqual(snapshot.get(3)['work_type'], 'Govt_job')
+        self.assertEqual(snapshot.get(3)['stroke'], 1)
+        self.assertIsNone(snapshot.get(4))
+        self.assertEqual(int(snapshot.frame(('stroke',))['stroke'].sum()), 2)
+
+    def test_change_stream_events(self):
+        """Test that change stream events update, add and remove rows"""
+        snapshot = PatientSnapshot.load(self.collection)
+        doc = self.collection.find_one({'id': 5})
+        new_id = ObjectId()
+
+        snapshot.apply_event({'operationType': 'update', 'documentKey': {'_id': doc['_id']},
+                              'fullDocument': {**doc, 'bmi': 40.5}})
+        snapshot.apply_event({'operationType': 'insert', 'documentKey': {'_id': new_id},
+                              'fullDocument': {'_id': new_id, 'id': 500, 'gender': 'Other'}})
+        snapshot.apply_event({'operationType': 'delete', 'documentKey': {'_id': doc['_id']}})
+
+        self.assertIsNone(snapshot.get(5))
+        self.assertEqual(snapshot.get(500)['gender'], 'Other')
+        self.assertIsNone(snapshot.get(500)['age'])
+        self.assertEqual(len(snapshot), 50)
+
+    def test_id_index_survives_writes(self):
+        """Test that updates, inserts and deletes are found without re-sorting the id index"""
+        snapshot = PatientSnapshot.load(self.collection)
+        snapshot.row_for(1)
+        order = snapshot._id_order
+
+        doc = self.collection.find_one({'id': 5})
+        snapshot.upsert({**doc, 'age': 99})
+        snapshot.upsert({'_id': ObjectId(), 'id': 500, 'age': 1})
+        snapshot.remove(self.collection.find_one({'id': 6})['_id'])
+
+        self.assertEqual(snapshot.get(5)['age'], 99)
+        self.assertEqual(snapshot.get(500)['age'], 1)
+        self.assertIsNone(snapshot.get(6))
+        self.assertIsNone(snapshot.get(501))
+        self.assertIs(snapshot._id_order, order)
+
+        snapshot.upsert({**doc, 'id': 501})  # a sorted row moving to another id
+        self.assertIsNone(snapshot.get(5))
+        self.assertEqual(snapshot.get(501)['age'], 25)
+
+    def test_object_id_with_trailing_zero_bytes(self):
+        """Test that _ids ending in zero bytes survive the fixed width array"""
+        snapshot = PatientSnapshot.load(self.collection)
+        object_id = ObjectId(b'\x65\x00\x00\x01' + b'\x02' * 5 + b'\x00\x00\x00')
+
+        for i in range(40):
+            snapshot.upsert({'_id': ObjectId(), 'id': 1000 + i})
+        snapshot.upsert({'_id': object_id, 'id': 999, 'age': 30})
+        snapshot.upsert({'_id': object_id, 'id': 999, 'age': 31})
+
+        self.assertEqual(snapshot.get(999)['_id'], object_id)
+        self.assertEqual(snapshot.get(999)['age'], 31)
+        self.assertEqual(len(snapshot), 91)
+
+    def test_stale_snapshot_is_rebuilt_when_polling(self):
+        """Test that without a change stream an old snapshot picks up outside writes"""
+        snapshot = PatientSnapshot.current()
+        self.assertEqual(snapshot.mode, 'poll')
+        self.collection.insert_one({'id': 77, 'gender': 'Female'})
+
+        self.assertIs(PatientSnapshot.current(), snapshot)
+        snapshot.built_at -= 3600
+        self.assertEqual(PatientSnapshot.current().get(77)['gender'], 'Female')
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,513 @@
+import unittest
+import sys
+import os
+import sqlite3
+import tempfile
+import threading
+from unittest.mock import patch
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from app.config.sqlite import init_db, get_user_by_email
+from app.config.sqlite_pool import get_pool, connection, close_pool
+from app.models.user import User, _user_cache, _unknown_emails
+from utils import passwords
+from utils.rate_limit import MemoryBucketStore, SQLiteBucketStore, TokenBucketLimiter
+
+
+class UserModelTests(unittest.TestCase):
+    """Test cases for the User model on a temporary SQLite file"""
+
+    def setUp(self):
+        """Create a fresh database and pool for each test"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        init_db(os.path.join(self.tmpdir.name, "test.db"))
+        _user_cache.clear()
+
+    def tearDown(self):
+        """Close the pool and remove the database"""
+        close_pool()
+        self.tmpdir.cleanup()
+
+    def test_pool_uses_wal(self):
+        """Test that pooled connections are opened in WAL mode"""
+        with connection() as conn:
+            mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+            sync = conn.execute("PRAGMA synchronous").fetchone()[0]
+
+        self.assertEqual(mode, "wal")
+        self.assertEqual(sync, 1)  # NORMAL
+
+    def test_pool_reuses_connections(self):
+        """Test that a released connection is handed out again"""
+        with connection() as first:
+            pass
+        with connection() as second:
+            pass
+
+        self.assertIs(first, second)
+        self.assertIs(get_pool().acquire(), first)
+
+    def test_create_and_read_user(self):
+        """Test that user writes and reads go through the pool"""
+        user_id = User.create_user("Ada", "Lovelace", "ada@example.com", "hash", "doctor")
+
+        self.assertEqual(User.get_by_id(user_id)['email'], "ada@example.com")
+        self.assertEqual(get_user_by_email("ada@example.com").id, user_id)
+        with self.assertRaises(ValueError):
+            User.create_user("Ada", "Lovelace", "ada@example.com", "hash", "doctor")
+
+    def test_failed_write_rolls_back(self):
+        """Test that an error inside a pooled block leaves no open transaction"""
+        with self.assertRaises(RuntimeError):
+            with connection() as conn:
+                conn.execute("INSERT INTO roles (role_name) VALUES ('nurse')")
+                raise RuntimeError("boom")
+
+        with connection() as conn:
+            count = conn.execute("SELECT COUNT(*) FROM roles WHERE role_name = 'nurse'").fetchone()[0]
+        self.assertEqual(count, 0)
+
+    def test_cached_user_skips_database(self):
+        """Test that repeated identity lookups only query SQLite once"""
+        user_id = User.create_user("Ada", "Lovelace", "ada@example.com", "hash", "doctor")
+
+        with patch('app.models.user.USER_CACHE_TTL', 60), \
+                patch.object(User, 'get_by_id', wraps=User.get_by_id) as spy:
+            for _ in range(3):
+                self.assertEqual(User.get_cached(user_id)['first_name'], "Ada")
+        self.assertEqual(spy.call_count, 1)
+
+    def test_user_cache_is_off_and_holds_no_hash(self):
+        """Test that the cache is off by default and cached users carry no password hash"""
+        user_id = User.create_user("Ada", "Lovelace", "ada@example.com", "hash", "doctor")
+
+        self.assertNotIn('password_hash', User.get_cached(user_id))
+        self.assertEqual(len(_user_cache), 0)
+        with patch('app.models.user.USER_CACHE_TTL', 60):
+            User.get_cached(user_id)
+        self.assertNotIn('password_hash', _user_cache.get(user_id))
+
+    def test_login_reads_the_database(self):
+        """Test that a login lookup sees a new password hash even while the user is cached"""
+        user_id = User.create_user("Ada", "Lovelace", "ada@example.com", "hash", "doctor")
+        with patch('app.models.user.USER_CACHE_TTL', 60):
+            User.get_cached(user_id)
+            with connection() as conn:
+                conn.execute("UPDATE users SET password_hash = 'new' WHERE id = ?", (user_id,))
+
+            self.assertEqual(User.get_for_login("ada@example.com").password_hash, "new")
+
+    def test_cached_user_invalidated_on_update(self):
+        """Test that updating or deleting a user drops the cached copy"""
+        user_id = User.create_user("Ada", "Lovelace", "ada@example.com", "hash", "doctor")
+        with patch('app.models.user.USER_CACHE_TTL', 60):
+            User.get_cached(user_id)
+
+            User.update(str(user_id), "Ada", "King", "admin")
+            self.assertEqual(User.get_cached(user_id)['role'], "admin")
+
+            User.delete_user(user_id)
+            self.assertIsNone(User.get_cached(user_id))
+
+    def test_search_follows_writes(self):
+        """Test that the search index is kept in step by the triggers"""
+        user_id = User.create_user("Ada", "Lovelace", "ada@example.com", "hash", "doctor")
+        self.assertEqual(User.count_users("lovel"), 1)
+
+        User.update(user_id, "Ada", "King", "doctor")
+        self.assertEqual(User.count_users("lovel"), 0)
+        self.assertEqual(User.count_users("kin ada"), 1)
+
+        User.delete_user(user_id)
+        self.assertEqual(User.count_users("ada"), 0)
+
+    def test_table_version_follows_writes(self):
+        """Test that every write shown in the user table bumps the version, from any connection"""
+        self.assertEqual(User.table_version(), 0)
+        user_id = User.create_user("Ada", "Lovelace", "ada@example.com", "hash", "doctor")
+        User.update(user_id, "Ada", "Lovelace", "admin")
+        self.assertEqual(User.table_version(), 2)
+
+        User.update_password(user_id, "new hash")
+        self.assertEqual(User.table_version(), 2)
+
+        # Another worker's write, outside the User model
+        other = sqlite3.connect(get_pool().path)
+        with other:
+            other.execute("DELETE FROM users WHERE id = ?", (user_id,))
+        other.close()
+        self.assertEqual(User.table_version(), 3)
+
+    def test_search_ranks_name_matches_first(self):
+        """Test prefix matching with name matches ahead of email matches"""
+        User.create_user("Bob", "Smith", "adams.family@example.com", "hash", "doctor")
+        User.create_user("Adam", "Jones", "aj@example.com", "hash", "doctor")
+        User.create_user("Carol", "White", "carol@example.com", "hash", "admin")
+
+        users, next_cursor, prev_cursor = User.get_keyset_users(search="ADA")
+
+        self.assertEqual([user['first_name'] for user in users], ["Adam", "Bob"])
+        self.assertIsNone(next_cursor)
+        self.assertIsNone(prev_cursor)
+        self.assertEqual(User.count_users("ada"), 2)
+        self.assertEqual(User.get_keyset_users(search="  ")[0], User.get_keyset_users()[0])
+
+    def test_keyset_pages_walk_both_ways(self):
+        """Test that next/prev cursors cover every user once, with and without a search"""
+        for i in range(7):
+            User.create_user("Grace", f"Hopper{i}", f"grace{i}@example.com", "hash", "doctor")
+
+        for search in (None, "grace"):
+            seen, cursor, pages = [], None, []
+            while True:
+                users, cursor, prev_cursor = User.get_keyset_users(cursor=cursor, per_page=3, search=search)
+                pages.append((users, prev_cursor))
+                seen += [user['id'] for user in users]
+                if cursor is None:
+                    break
+            self.assertEqual(sorted(seen), sorted(set(seen)))
+            self.assertEqual(len(seen), 7)
+
+            back, _, _ = User.get_keyset_users(cursor=pages[-1][1], per_page=3, search=search)
+            self.assertEqual(back, pages[-2][0])
+
+    def test_cursor_from_another_listing_is_rejected(self):
+        """Test that a browse cursor cannot be replayed on a search"""
+        for i in range(3):
+            User.create_user("Ada", f"L{i}", f"ada{i}@example.com", "hash", "doctor")
+        _, cursor, _ = User.get_keyset_users(per_page=1)
+
+        with self.assertRaises(ValueError):
+            User.get_keyset_users(cursor=cursor, search="ada")
+        with self.assertRaises(ValueError):
+            User.get_keyset_users(cursor="not-a-cursor")
+
+    def test_existing_users_are_indexed(self):
+        """Test that init_db indexes users stored before the search table existed"""
+        User.create_user("Ada", "Lovelace", "ada@example.com", "hash", "doctor")
+        with connection() as conn:
+            conn.execute("DROP TABLE users_fts")
+            conn.commit()
+        init_db(get_pool().path)
+
+        self.assertEqual(User.count_users("lovelace"), 1)
+
+
+
+def _run_entry_point_in_child():
+    """Run run.py the way a spawned worker re-imports it, report whether it built the app"""
+    import runpy
+    with patch('app.create_app') as create_app:
+        runpy.run_path(os.path.join(os.path.dirname(__file__), '../../run.py'), run_name='__mp_main__')
+    return create_app.called
+
+
+class PasswordHasherTests(unittest.TestCase):
+    """Test cases for the password hashing pool"""
+
+    def setUp(self):
+        """Use cheap hashing parameters and one worker process"""
+        self.patchers = [
+            patch.object(passwords, 'PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000'),
+            patch.object(passwords, 'PASSWORD_HASH_WORKERS', 1),
+            patch.object(passwords, '_method_prefix', None),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+        passwords._metrics.reset()
+
+    def tearDown(self):
+        """Stop the worker and the patchers"""
+        passwords.shutdown_hasher()
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def test_hash_and_verify_in_worker(self):
+        """Test that hashes made in the pool verify and are counted"""
+        password_hash = passwords.hash_password("Secret#123")
+
+        self.assertTrue(password_hash.startswith("pbkdf2:sha256:1000$"))
+        self.assertTrue(passwords.verify_password(password_hash, "Secret#123"))
+        self.assertFalse(passwords.verify_password(password_hash, "wrong"))
+        self.assertNotEqual(passwords._executor_pid, None)
+
+        stats = passwords.hasher_stats()
+        self.assertEqual(stats['completed'], 3)
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertIsNotNone(stats['latency_ms']['p95'])
+
+    def test_needs_rehash_when_cost_changes(self):
+        """Test that hashes with other parameters are flagged for an upgrade"""
+        current = passwords.hash_password("Secret#123")
+        with patch.object(passwords, 'PASSWORD_HASH_METHOD', 'pbkdf2:sha256:2000'):
+            old = passwords.hash_password("Secret#123")
+
+        self.assertFalse(passwords.needs_rehash(current))
+        self.assertTrue(passwords.needs_rehash(old))
+
+    def test_full_queue_is_rejected(self):
+        """Test that callers are turned away once the queue is full"""
+        with patch.object(passwords, '_slots', threading.BoundedSemaphore(1)), \
+                patch.object(passwords, 'PASSWORD_HASH_WAIT', 0.01):
+            passwords._slots.acquire()
+            with self.assertRaises(passwords.HasherBusyError):
+                passwords.hash_password("Secret#123")
+
+        self.assertEqual(passwords.hasher_stats()['rejected'], 1)
+
+    def test_slow_hash_is_reported_busy(self):
+        """Test that a hash outliving PASSWORD_HASH_TIMEOUT fails like a full queue, not with a 500"""
+        import time
+        with patch.object(passwords, 'PASSWORD_HASH_TIMEOUT', 0.01):
+            with self.assertRaises(passwords.HasherBusyError):
+                passwords._run(time.sleep, 1)
+
+        self.assertEqual(passwords.hasher_stats()['rejected'], 1)
+
+    def test_timed_out_hash_keeps_its_slot(self):
+        """Test that a hash still running after its timeout counts against the queue until it ends"""
+        import time
+        with patch.object(passwords, '_slots', threading.BoundedSemaphore(1)), \
+                patch.object(passwords, 'PASSWORD_HASH_WAIT', 0.05), \
+                patch.object(passwords, 'PASSWORD_HASH_WORKERS', 2):
+            passwords.shutdown_hasher()
+            # Both workers started, so a second job admitted would run at once
+            executor = passwords._get_executor()
+            list(executor.map(time.sleep, [0.2, 0.2]))
+            with patch.object(passwords, 'PASSWORD_HASH_TIMEOUT', 0.05):
+                with self.assertRaises(passwords.HasherBusyError):
+                    passwords._run(time.sleep, 1)
+                with self.assertRaises(passwords.HasherBusyError):
+                    passwords._run(int, 1)  # idle worker, but no slot while the first job runs
+
+            time.sleep(1.5)
+            self.assertEqual(passwords._run(int, 1), 1)
+
+    def test_workers_do_not_build_the_app(self):
+        """Test that a spawned hashing worker importing run.py skips create_app"""
+        self.assertFalse(passwords._get_executor().submit(_run_entry_point_in_child).result(timeout=60))
+
+    def test_login_upgrades_old_hash(self):
+        """Test that logging in with an outdated hash stores a new one"""
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.addCleanup(close_pool)
+        init_db(os.path.join(tmpdir.name, "test.db"))
+        with patch.object(passwords, 'PASSWORD_HASH_METHOD', 'pbkdf2:sha256:2000'):
+            old_hash = passwords.hash_password("Secret#123")
+        User.create_user("Ada", "Lovelace", "ada@example.com", old_hash, "doctor")
+
+        with patch.dict(os.environ, {"SECRET_KEY": "test"}), patch('app.init_db'), \
+                patch('app.mongo_init_db'), patch('app.seed_mongo'):
+            from app import create_app
+            app = create_app()
+        app.config['WTF_CSRF_ENABLED'] = False
+
+        threads = []
+
+        def rehash_later(*args):
+            threads.append(passwords.rehash_later(*args))
+
+        with patch('app.routes.auth.rehash_later', side_effect=rehash_later):
+            response = app.test_client().post('/login', data={'email': 'ada@example.com', 'password': 'Secret#123'})
+
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/dashboard', response.headers['Location'])
+        self.assertEqual(len(threads), 1)
+        threads[0].join(timeout=10)
+        new_hash = get_user_by_email("ada@example.com").password_hash
+        self.assertTrue(new_hash.startswith("pbkdf2:sha256:1000$"))
+
+
+
+class LoginRateLimitTests(unittest.TestCase):
+    """Test cases for login rate limiting and the unknown email cache"""
+
+    def setUp(self):
+        """Fresh database, inline cheap hashing and small limits"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        init_db(os.path.join(self.tmpdir.name, "test.db"))
+        _unknown_emails.clear()
+
+        self.patchers = [
+            patch.dict(os.environ, {"SECRET_KEY": "test"}),
+            patch.object(passwords, 'PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000'),
+            patch.object(passwords, 'PASSWORD_HASH_WORKERS', 0),
+            patch('app.init_db'),
+            patch('app.mongo_init_db'),
+            patch('app.seed_mongo'),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+        from app import create_app
+        from app.routes import auth
+        store = MemoryBucketStore()
+        for name, limiter in (('ip_limiter', TokenBucketLimiter("login-ip", 10, 60, store)),
+                              ('email_limiter', TokenBucketLimiter("login-email", 3, 300, store))):
+            patcher = patch.object(auth, name, limiter)
+            patcher.start()
+            self.patchers.append(patcher)
+        app = create_app()
+        app.config['WTF_CSRF_ENABLED'] = False
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Stop the patchers and remove the database"""
+        for patcher in reversed(self.patchers):
+            patcher.stop()
+        close_pool()
+        self.tmpdir.cleanup()
+
+    def login(self, email, password="Secret#123"):
+        return self.client.post('/login', data={'email': email, 'password': password})
+
+    def test_bucket_refills_over_time(self):
+        """Test that a bucket allows a burst, then one hit per refill interval"""
+        now = [0.0]
+        limiter = TokenBucketLimiter("t", 2, 10, MemoryBucketStore(clock=lambda: now[0]))
+
+        self.assertEqual([limiter.hit("k"), limiter.hit("k")], [0, 0])
+        self.assertAlmostEqual(limiter.hit("k"), 5.0)
+        now[0] = 5.0
+        self.assertEqual(limiter.hit("k"), 0)
+        self.assertEqual(limiter.hit("other"), 0)
+        self.assertEqual(limiter.stats()['limited'], 1)
+
+    def test_sqlite_store_is_shared(self):
+        """Test that two stores on the same file see the same buckets"""
+        path = os.path.join(self.tmpdir.name, "limits.db")
+        first = TokenBucketLimiter("t", 2, 60, SQLiteBucketStore(path))
+        second = TokenBucketLimiter("t", 2, 60, SQLiteBucketStore(path))
+
+        self.assertEqual(first.hit("k"), 0)
+        self.assertEqual(second.hit("k"), 0)
+        self.assertGreater(first.hit("k"), 0)
+        second.reset("k")
+        self.assertEqual(first.hit("k"), 0)
+
+    def test_sqlite_store_prunes_idle_buckets(self):
+        """Test that old buckets are deleted every prune_every takes, recent ones kept"""
+        path = os.path.join(self.tmpdir.name, "limits.db")
+        now = [0.0]
+        store = SQLiteBucketStore(path, clock=lambda: now[0], prune_every=3, keep_seconds=100)
+        limiter = TokenBucketLimiter("t", 2, 600, store)
+
+        limiter.hit("old")
+        now[0] = 500.0
+        limiter.hit("recent")
+        now[0] = 700.0
+        limiter.hit("new")  # third take prunes, keeping the 600s refill window
+
+        with sqlite3.connect(path) as conn:
+            keys = {row[0] for row in conn.execute("SELECT key FROM buckets")}
+        self.assertEqual(keys, {"t:recent", "t:new"})
+
+    def test_email_is_limited_after_failures(self):
+        """Test that repeated attempts for one email get a 429 with Retry-After"""
+        for _ in range(3):
+            response = self.login("nobody@example.com")
+            self.assertEqual(response.status_code, 302)
+
+        response = self.login("nobody@example.com")
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response.headers['Retry-After']), 0)
+        self.assertIn(b'Too many login attempts', response.data)
+
+    def test_successful_login_resets_email_bucket(self):
+        """Test that a correct password clears the failures for that email"""
+        User.create_user("Ada", "Lovelace", "ada@example.com", passwords.hash_password("Secret#123"), "doctor")
+        self.login("ada@example.com", "wrong")
+        self.login("ada@example.com", "wrong")
+        self.assertIn('/dashboard', self.login("ada@example.com").headers['Location'])
+
+        for _ in range(3):
+            self.assertEqual(self.login("ada@example.com", "wrong").status_code, 302)
+
+    def test_unknown_email_is_cached(self):
+        """Test that misses skip SQLite until the email is registered"""
+        self.assertIsNone(User.get_for_login("new@example.com"))
+        with connection() as conn:
+            conn.execute("INSERT INTO users (first_name, last_name, email, role, password_hash) "
+                         "VALUES ('A', 'B', 'new@example.com', 'doctor', 'x')")
+        self.assertIsNone(User.get_for_login("new@example.com"))
+
+        User.forget_unknown_email("new@example.com")
+        self.assertEqual(User.get_for_login("new@example.com").email, "new@example.com")
+
+    def test_unknown_email_still_checks_a_hash(self):
+        """Test that an unknown email costs one hash check, like a wrong password"""
+        with patch('app.routes.auth.check_dummy', wraps=passwords.check_dummy) as dummy:
+            response = self.login("ghost@example.com")
+
+        dummy.assert_called_once_with("Secret#123")
+        self.assertEqual(response.status_code, 302)
+
+
+class RequestConnectionTests(unittest.TestCase):
+    """Test cases for pooled SQLite connections inside requests"""
+
+    def setUp(self):
+        """Fresh database, the app with MongoDB patched and a logged-in admin"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        init_db(os.path.join(self.tmpdir.name, "test.db"))
+        self.user_id = User.create_user("Ada", "Lovelace", "ada@example.com", "hash", "admin")
+        _user_cache.clear()
+
+        self.patchers = [
+            patch.dict(os.environ, {"SECRET_KEY": "test"}),
+            patch('app.init_db'),
+            patch('app.mongo_init_db'),
+            patch('app.seed_mongo'),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+        from app import create_app
+        from utils.fragment_cache import fragment_cache
+        fragment_cache.store.clear()
+        app = create_app()
+        app.testing = True
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['user_id'] = self.user_id
+            session['role'] = 'admin'
+
+    def tearDown(self):
+        """Stop the patchers and remove the database"""
+        for patcher in reversed(self.patchers):
+            patcher.stop()
+        close_pool()
+        self.tmpdir.cleanup()
+
+    def test_concurrent_lookups_return_their_connections(self):
+        """Test that the user dashboard's parallel lookups each give their connection back"""
+        barrier = threading.Barrier(3, timeout=5)
+
+        def together(func):
+            # Only the first call waits, current_user is looked up again while rendering
+            first = []
+            def wrapper(*args, **kwargs):
+                if not first:
+                    first.append(True)
+                    barrier.wait()
+                return func(*args, **kwargs)
+            return wrapper
+
+        baseline = get_pool().stats()['open']
+        with patch.object(User, 'get_keyset_users', together(User.get_keyset_users)), \
+             patch.object(User, 'count_users', together(User.count_users)), \
+             patch.object(User, 'get_cached', together(User.get_cached)):
+            response = self.client.get('/user_dashboard')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'ada@example.com', response.data)
+        stats = get_pool().stats()
+        self.assertEqual(stats['open'], stats['idle'])
+        self.assertLessEqual(stats['open'], max(baseline, 3))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,8 @@
+from asgiref.wsgi import WsgiToAsgi
+from app import create_app
+
+
+
+# ASGI entry point, e.g. `uvicorn asgi:app --workers 4`. Each request still
+# holds a thread for its whole duration, scale with workers
+app = WsgiToAsgi(create_app())
@@ -0,0 +1,368 @@
+"""
+Latency and throughput of the main pages against a synthetic patient set.
+
+    python benchmarks/load_test.py                          # 10k rows, mongomock, Flask test client
+    python benchmarks/load_test.py --rows 1000000 --mongo-url mongodb://localhost:27017
+    python benchmarks/load_test.py --http --concurrency 16  # real server + concurrent HTTP clients
+    python benchmarks/load_test.py --save-baseline          # store these numbers as the baseline
+
+Patients are resampled from the seed CSV (with some jitter) up to --rows,
+into mongomock or the --mongo-url server (database --db-name, reused when
+it already holds that many rows). Users go into a temporary SQLite file.
+Each scenario reports p50/p95/p99 latency and requests/s, compared with
+benchmarks/baseline.json for the same mode and row count. With --check
+the exit status is 1 when a p95 is more than --tolerance slower.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+PASSWORD = 'Bench#Pass1'
+INSERT_BATCH = 50_000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10_000, help='patients to seed (10k to 5M)')
+    parser.add_argument('--users', type=int, default=500, help='users in the SQLite file')
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per scenario')
+    parser.add_argument('--warmup', type=int, default=10, help='untimed requests per scenario')
+    parser.add_argument('--mongo-url', help='use this MongoDB server instead of mongomock')
+    parser.add_argument('--db-name', default='StrokeBenchmark', help='database used on --mongo-url')
+    parser.add_argument('--http', action='store_true', help='serve the app and load it over HTTP')
+    parser.add_argument('--concurrency', type=int, default=8, help='HTTP client threads')
+    parser.add_argument('--only', help='comma separated scenario names')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--check', action='store_true', help='exit 1 on a p95 regression')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p95 slowdown, 0.25 = 25%%')
+    return parser.parse_args()
+
+
+def configure_environment(args):
+    """Settings the app reads at import time, so this runs before importing it"""
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    os.environ['LAZY_INIT'] = '1'
+    os.environ['SEED_ON_START'] = 'off'
+    # The rate limiter would otherwise turn the login scenario away
+    os.environ['LOGIN_IP_LIMIT'] = os.environ['LOGIN_EMAIL_LIMIT'] = str(10 ** 9)
+    os.environ['DB_NAME'] = args.db_name
+    if args.mongo_url:
+        os.environ['MONGO_URL'] = args.mongo_url
+
+
+def synthetic_patients(rows, model, seed=0):
+    """
+    Patients drawn from the seed CSV rows with age, glucose and bmi jittered,
+    numbered 1..rows and scored with model. Yields lists of documents
+    INSERT_BATCH long.
+    """
+    import numpy as np
+    from app.config.mongo_seed import load_seed_frame
+
+    source = load_seed_frame()
+    rng = np.random.default_rng(seed)
+    for start in range(0, rows, INSERT_BATCH):
+        size = min(INSERT_BATCH, rows - start)
+        frame = source.iloc[rng.integers(0, len(source), size)].reset_index(drop=True)
+        frame['id'] = np.arange(start + 1, start + size + 1)
+        frame['age'] = np.clip(frame['age'] + rng.integers(-2, 3, size), 0, 120)
+        frame['avg_glucose_level'] = (frame['avg_glucose_level'] * rng.normal(1, 0.05, size)).round(2)
+        frame['bmi'] = np.where(frame['bmi'] > 0, (frame['bmi'] * rng.normal(1, 0.05, size)).clip(10, 100), 0.0).round(1)
+        frame['risk_score'] = np.round(model.score(frame), 4)
+        yield frame.to_dict('records')
+
+
+def setup_mongo(args):
+    """Point app.config.mongo_db at mongomock or the server and seed it. Returns the collection."""
+    from app.config import mongo_db
+
+    if args.mongo_url:
+        collection = mongo_db.get_collection()
+    else:
+        import mongomock
+        from app.tests.mongomock_compat import patch_mongomock_bulk
+        patch_mongomock_bulk()
+        mongo_db.client = mongomock.MongoClient()
+        mongo_db.db = mongo_db.client[mongo_db.DB_NAME]
+        mongo_db._client_pid = os.getpid()
+        collection = mongo_db.db[mongo_db.COLLECTION_NAME]
+
+    if collection.estimated_document_count() == args.rows:
+        print(f"Reusing {args.rows:,} patients in {mongo_db.DB_NAME}.{mongo_db.COLLECTION_NAME}")
+        return collection
+
+    # Fit the risk model up front and store scores with the documents, as
+    # seeding does, so no request pays for (re)scoring every patient
+    from app.config.mongo_seed import load_seed_frame
+    from app.models.risk import RiskModel, MODEL_COLLECTION, MODEL_ID
+    model = RiskModel.fit(load_seed_frame())
+    mongo_db.get_db()[MODEL_COLLECTION].replace_one({'_id': MODEL_ID}, model.to_doc(), upsert=True)
+    RiskModel.clear_cache()
+
+    collection.delete_many({})
+    started = time.perf_counter()
+    for batch in synthetic_patients(args.rows, model):
+        collection.insert_many(batch, ordered=False)
+    # After the inserts: mongomock checks a unique index by scanning the collection
+    mongo_db.ensure_indexes(collection)
+    print(f"Seeded {args.rows:,} patients in {time.perf_counter() - started:.1f}s")
+    return collection
+
+
+def setup_sqlite(args, path):
+    """Create the users table in a temporary file with an admin, a doctor and --users more"""
+    from app.config.sqlite import init_db
+    from app.config.sqlite_pool import connection
+    from utils.passwords import hash_password
+
+    init_db(path)
+    password_hash = hash_password(PASSWORD)
+    users = [('Bench', 'Admin', 'admin@bench.test', password_hash, 'admin'),
+             ('Bench', 'Doctor', 'doctor@bench.test', password_hash, 'doctor')]
+    users += [(f'First{i}', f'Last{i}', f'user{i}@bench.test', password_hash, 'doctor') for i in range(args.users)]
+    with connection() as conn:
+        conn.executemany("INSERT INTO users (first_name, last_name, email, password_hash, role) VALUES (?, ?, ?, ?, ?)",
+                         users)
+
+
+def scenarios(collection, rows, users):
+    """
+    (name, method, path or path factory, form or None) for every scenario.
+    Fixed paths repeat one page, so after the warmup they measure the
+    fragment cache and warm path. The -varied scenarios ask for a different
+    page, cursor, filter or search each time, and -cold ones empty the
+    fragment cache before every request, to time the database path.
+    """
+    import random
+    from app.models.patient import encode_cursor
+    from utils.fragment_cache import fragment_cache
+
+    def cursor_at(position):
+        """Keyset cursor after this many rows of the newest-first list"""
+        doc = next(iter(collection.find({}, {'_id': 1}).sort('_id', -1).skip(position).limit(1)))
+        return encode_cursor('next', doc['_id'])
+
+    # One cursor halfway down the list, and a spread of them for -varied
+    middle_cursor = cursor_at(rows // 2)
+    cursors = [cursor_at(position) for position in range(0, rows, max(1, rows // 100))]
+    rng = random.Random(0)
+
+    def random_patient():
+        return rng.randint(1, rows)
+
+    def update_form():
+        return {'gender': 'Female', 'age': str(rng.randint(1, 90)), 'hypertension': '0', 'heart_disease': '0',
+                'ever_married': 'Yes', 'work_type': 'Private', 'residence_type': 'Urban',
+                'avg_glucose_level': f"{rng.uniform(60, 250):.2f}", 'bmi': f"{rng.uniform(18, 40):.1f}",
+                'smoking_status': 'never smoked', 'stroke': '0'}
+
+    def varied_filter():
+        return '/dashboard?' + urlencode({'age_min': rng.randint(0, 80), 'sort': rng.choice(['age', 'glucose', 'bmi']),
+                                          'stroke': rng.choice(['', '0', '1'])})
+
+    def user_search():
+        return '/user_dashboard?' + urlencode({'q': f'user{rng.randint(0, max(0, users - 1))}'})
+
+    def cold(path):
+        def factory():
+            fragment_cache.store.clear()
+            return path
+        return factory
+
+    last_page = max(1, rows // 10)
+    return [
+        ('login', 'POST', lambda: '/login', lambda: {'email': 'doctor@bench.test', 'password': PASSWORD}),
+        ('dashboard-page-1', 'GET', lambda: '/dashboard?page=1', None),
+        ('dashboard-page-1-cold', 'GET', cold('/dashboard?page=1'), None),
+        ('dashboard-page-100', 'GET', lambda: f'/dashboard?page={min(100, last_page)}', None),
+        ('dashboard-last-page', 'GET', lambda: f'/dashboard?page={last_page}', None),
+        ('dashboard-pages-varied', 'GET', lambda: f'/dashboard?page={rng.randint(1, last_page)}', None),
+        ('dashboard-cursor-middle', 'GET', lambda: '/dashboard?' + urlencode({'cursor': middle_cursor}), None),
+        ('dashboard-cursor-varied', 'GET', lambda: '/dashboard?' + urlencode(
+            {'cursor': rng.choice(cursors), 'per_page': rng.choice([10, 20, 25, 50])}), None),
+        ('dashboard-filtered', 'GET', lambda: '/dashboard?stroke=1&age_min=60&sort=glucose', None),
+        ('dashboard-filtered-varied', 'GET', varied_filter, None),
+        ('view-patient', 'GET', lambda: f'/dashboard/patients/{random_patient()}', None),
+        ('update-patient', 'POST', lambda: f'/dashboard/patients/{random_patient()}/update', update_form),
+        ('user-dashboard', 'GET', lambda: '/user_dashboard?page=1', None),
+        ('user-dashboard-cold', 'GET', cold('/user_dashboard?page=1'), None),
+        ('user-dashboard-deep', 'GET', lambda: '/user_dashboard?page=40', None),
+        ('user-dashboard-search', 'GET', user_search, None),
+    ]
+
+
+def summarize(latencies, wall_seconds):
+    import numpy as np
+    values = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'p50_ms': round(p50, 2), 'p95_ms': round(p95, 2), 'p99_ms': round(p99, 2),
+            'rps': round(len(latencies) / wall_seconds, 1), 'requests': len(latencies)}
+
+
+def run_test_client(app, scenario, args):
+    """Sequential requests through the Flask test client, logged in as admin"""
+    name, method, path, form = scenario
+    client = app.test_client()
+    client.post('/login', data={'email': 'admin@bench.test', 'password': PASSWORD})
+    latencies = []
+    for i in range(args.warmup + args.requests):
+        started = time.perf_counter()
+        response = client.open(path(), method=method, data=form() if form else None)
+        elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            raise RuntimeError(f"{name}: HTTP {response.status_code}")
+        if i >= args.warmup:
+            latencies.append(elapsed)
+    return latencies
+
+
+class HTTPSession:
+    """One client thread: its own connection per request and session cookie"""
+
+    def __init__(self, port):
+        self.port = port
+        self.cookie = None
+
+    def request(self, method, path, form=None):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        headers = {'Cookie': self.cookie} if self.cookie else {}
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            cookie = response.getheader('Set-Cookie')
+            if cookie:
+                self.cookie = cookie.split(';', 1)[0]
+            return response.status
+        finally:
+            conn.close()
+
+
+def run_http(port, scenario, args):
+    """--concurrency threads sharing --requests requests over real HTTP, logged in as admin"""
+    name, method, path, form = scenario
+    latencies = []
+    lock = threading.Lock()
+    per_thread = [args.requests // args.concurrency + (i < args.requests % args.concurrency)
+                  for i in range(args.concurrency)]
+
+    def worker(count):
+        session = HTTPSession(port)
+        session.request('POST', '/login', {'email': 'admin@bench.test', 'password': PASSWORD})
+        for _ in range(args.warmup // args.concurrency):
+            session.request(method, path(), form() if form else None)
+        mine = []
+        for _ in range(count):
+            started = time.perf_counter()
+            status = session.request(method, path(), form() if form else None)
+            mine.append(time.perf_counter() - started)
+            if status >= 400:
+                raise RuntimeError(f"{name}: HTTP {status}")
+        with lock:
+            latencies.extend(mine)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        for future in [pool.submit(worker, count) for count in per_thread]:
+            future.result()
+    return latencies, time.perf_counter() - started
+
+
+def compare(results, baseline, tolerance):
+    """Print the results next to the baseline. Returns the names whose p95 regressed."""
+    regressions = []
+    print(f"\n{'scenario':<26}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}   vs baseline p95")
+    for name, stats in results.items():
+        line = f"{name:<26}{stats['p50_ms']:>9.2f}{stats['p95_ms']:>9.2f}{stats['p99_ms']:>9.2f}{stats['rps']:>9.1f}"
+        base = baseline.get(name)
+        if base:
+            change = stats['p95_ms'] / base['p95_ms'] - 1 if base['p95_ms'] else 0.0
+            flag = '  REGRESSION' if change > tolerance else ''
+            line += f"   {change:+.0%}{flag}"
+            if flag:
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+def main():
+    args = parse_args()
+    configure_environment(args)
+
+    from app import create_app
+    from app.config import sqlite as sqlite_config
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_sqlite(args, os.path.join(tmp, 'bench.db'))
+        collection = setup_mongo(args)
+
+        app = create_app()
+        app.config['WTF_CSRF_ENABLED'] = False
+        assert sqlite_config._db_ready
+
+        selected = set(args.only.split(',')) if args.only else None
+        chosen = [s for s in scenarios(collection, args.rows, args.users) if not selected or s[0] in selected]
+
+        server = None
+        if args.http:
+            import logging
+            from werkzeug.serving import make_server
+            logging.getLogger('werkzeug').setLevel(logging.WARNING)
+            server = make_server('127.0.0.1', 0, app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        results = {}
+        try:
+            for scenario in chosen:
+                if server:
+                    latencies, wall = run_http(server.server_port, scenario, args)
+                else:
+                    started = time.perf_counter()
+                    latencies = run_test_client(app, scenario, args)
+                    # Sequential, so throughput is one over the mean latency
+                    wall = sum(latencies) or (time.perf_counter() - started)
+                results[scenario[0]] = summarize(latencies, wall)
+        finally:
+            if server:
+                server.shutdown()
+
+    mode = (f"http-c{args.concurrency}" if args.http else "test-client") + ("-mongod" if args.mongo_url else "-mongomock")
+    key = f"{mode}:{args.rows}"
+    stored = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            stored = json.load(f)
+
+    print(f"\n{key}, {args.requests} requests per scenario")
+    regressions = compare(results, stored.get(key, {}).get('results', {}), args.tolerance)
+
+    if args.save_baseline:
+        stored[key] = {'host': platform.node(), 'python': platform.python_version(),
+                       'saved': time.strftime('%Y-%m-%d'), 'results': results}
+        with open(args.baseline, 'w') as f:
+            json.dump(stored, f, indent=2, sort_keys=True)
+        print(f"Saved baseline {key} to {args.baseline}")
+
+    if args.check and regressions:
+        print(f"p95 regressed more than {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
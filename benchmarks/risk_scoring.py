@@ -0,0 +1,53 @@
+"""
+Time fitting and scoring the stroke risk model on synthetic patients.
+
+    python benchmarks/risk_scoring.py            # 1,000,000 rows
+    python benchmarks/risk_scoring.py 250000
+
+No database is needed, this measures the vectorized pass only.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import pandas as pd
+
+from app.models.risk import RiskModel
+
+
+def synthetic_frame(rows, seed=0):
+    """Patients shaped like the seed CSV, with a stroke rate of a few percent"""
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame({
+        'age': rng.integers(1, 90, rows),
+        'hypertension': rng.integers(0, 2, rows),
+        'heart_disease': rng.integers(0, 2, rows),
+        'avg_glucose_level': rng.uniform(55, 270, rows).round(2),
+        'bmi': np.where(rng.random(rows) < 0.04, 0.0, rng.uniform(15, 50, rows).round(1)),
+        'smoking_status': rng.choice(['never smoked', 'smokes', 'formerly smoked', 'Unknown'], rows),
+    })
+    logit = -7 + 0.06 * frame['age'] + 0.8 * frame['hypertension'] + 0.005 * frame['avg_glucose_level']
+    frame['stroke'] = (rng.random(rows) < 1 / (1 + np.exp(-logit))).astype(int)
+    return frame
+
+
+def main(rows):
+    frame = synthetic_frame(rows)
+
+    started = time.perf_counter()
+    model = RiskModel.fit(frame)
+    fitted = time.perf_counter()
+    scores = model.score(frame)
+    scored = time.perf_counter()
+
+    print(f"rows:    {rows:,}")
+    print(f"fit:     {fitted - started:.2f}s")
+    print(f"score:   {scored - fitted:.2f}s ({rows / (scored - fitted):,.0f} rows/s)")
+    print(f"mean risk {scores.mean():.4f}, stroke rate {frame['stroke'].mean():.4f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
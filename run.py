@@ -1,11 +1,15 @@
+import multiprocessing
 from app import create_app
 
 
 
-# App entry point with app initialization
-app = create_app()
+# App entry point with app initialization. Spawned child processes (the
+# password hashing workers) re-import this module as __mp_main__ and must
+# not build the app: that would connect to the databases and seed again
+if multiprocessing.parent_process() is None:
+    app = create_app()
 
 
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
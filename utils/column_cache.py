@@ -0,0 +1,234 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+META_FILE = "meta.json"
+
+
+def file_hash(path, chunk_size=1 << 20):
+    '''Content hash of a file, read in chunks.'''
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ColumnTable:
+    '''
+    Parsed rows of a file stored column by column.
+    Numbers are NumPy arrays (memory-mapped when loaded from the cache),
+    text columns are integer codes into a list of distinct values.
+    '''
+
+    def __init__(self, columns, arrays, categories):
+        self.columns = columns
+        self.arrays = arrays
+        self.categories = categories
+        self.rows = len(arrays[columns[0]]) if columns else 0
+
+    def __len__(self):
+        return self.rows
+
+    def _values(self, name, start, stop):
+        values = self.arrays[name][start:stop].tolist()
+        if name in self.categories:
+            lookup = self.categories[name]
+            values = [lookup[code] for code in values]
+        return values
+
+    def batches(self, batch_size, skip_rows=0):
+        '''Yield lists of row dicts (columns in file order), batch_size rows at a time.'''
+        for start in range(skip_rows, self.rows, batch_size):
+            stop = min(start + batch_size, self.rows)
+            columns = [self._values(name, start, stop) for name in self.columns]
+            yield [dict(zip(self.columns, row)) for row in zip(*columns)]
+
+    def frame(self):
+        '''pandas DataFrame over the arrays, numbers are not copied and text is Categorical.'''
+        data = {}
+        for name in self.columns:
+            if name in self.categories:
+                data[name] = pd.Categorical.from_codes(self.arrays[name], self.categories[name])
+            else:
+                data[name] = self.arrays[name]
+        return pd.DataFrame(data, copy=False)
+
+
+# Rows converted to arrays at a time while building, bounds the Python
+# objects alive during a build to one chunk
+BUILD_CHUNK_ROWS = 65536
+
+
+def _column_kind(values):
+    kinds = {type(value) for value in values}
+    if kinds <= {int}:
+        return "int"
+    if kinds <= {int, float}:
+        return "float"
+    return "text"
+
+
+class _ColumnBuilder:
+    '''One column being built chunk by chunk, widened int -> float -> text as values require.'''
+
+    def __init__(self):
+        self.kind = None
+        self.chunks = []
+        self.codes = {}
+
+    def _encode(self, values):
+        codes = self.codes
+        return np.fromiter((codes.setdefault(value, len(codes)) for value in values),
+                           dtype=np.int32, count=len(values))
+
+    def add(self, values):
+        kind = _column_kind(values)
+        if self.kind is None:
+            self.kind = kind
+        elif kind != self.kind and "text" in (kind, self.kind):
+            if self.kind != "text":
+                # Earlier numbers become text, as if the whole column had been text
+                self.chunks = [self._encode([str(value) for value in chunk.tolist()]) for chunk in self.chunks]
+            self.kind = "text"
+        elif kind != self.kind:
+            self.chunks = [chunk.astype(np.float64) for chunk in self.chunks]
+            self.kind = "float"
+
+        if self.kind == "int":
+            self.chunks.append(np.asarray(values, dtype=np.int64))
+        elif self.kind == "float":
+            self.chunks.append(np.asarray(values, dtype=np.float64))
+        else:
+            self.chunks.append(self._encode([str(value) for value in values]))
+
+    def finish(self):
+        '''(array, categories or None)'''
+        array = np.concatenate(self.chunks) if len(self.chunks) > 1 else self.chunks[0]
+        self.chunks = []
+        if self.kind != "text":
+            return array, None
+        if len(self.codes) < 2 ** 15:
+            array = array.astype(np.int16)
+        return array, list(self.codes)
+
+
+def build_table(rows, chunk_rows=BUILD_CHUNK_ROWS):
+    '''
+    ColumnTable from an iterable of dicts that all have the same keys.
+    Rows are read chunk_rows at a time and turned into arrays, so memory
+    holds the compact columns plus one chunk of row dicts.
+    '''
+    columns, builders, chunk = None, None, []
+
+    def flush():
+        for name in columns:
+            builders[name].add([row.get(name) for row in chunk])
+        chunk.clear()
+
+    for row in rows:
+        if columns is None:
+            columns = list(row)
+            builders = {name: _ColumnBuilder() for name in columns}
+        chunk.append(row)
+        if len(chunk) >= chunk_rows:
+            flush()
+    if columns is None:
+        return ColumnTable([], {}, {})
+    if chunk:
+        flush()
+
+    arrays, categories = {}, {}
+    for name in columns:
+        arrays[name], lookup = builders[name].finish()
+        if lookup is not None:
+            categories[name] = lookup
+    return ColumnTable(columns, arrays, categories)
+
+
+def save_table(table, directory, source_hash):
+    '''Write a table as one .npy file per column plus meta.json, replacing directory atomically.'''
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".building-", dir=parent)
+    try:
+        for index, name in enumerate(table.columns):
+            np.save(os.path.join(tmp, f"{index}.npy"), table.arrays[name])
+        meta = {"source_hash": source_hash, "rows": table.rows, "columns": table.columns,
+                "categories": table.categories}
+        with open(os.path.join(tmp, META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        try:
+            os.rename(tmp, directory)
+        except OSError:
+            # Another process built the same cache first
+            shutil.rmtree(tmp, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+
+def open_table(directory):
+    '''Load a saved table with every column memory-mapped read-only.'''
+    with open(os.path.join(directory, META_FILE), encoding="utf-8") as f:
+        meta = json.load(f)
+    arrays = {name: np.load(os.path.join(directory, f"{index}.npy"), mmap_mode="r")
+              for index, name in enumerate(meta["columns"])}
+    return ColumnTable(meta["columns"], arrays, meta["categories"])
+
+
+def _source_stamp(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _read_stamp(stamp_path):
+    try:
+        with open(stamp_path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_stamp(stamp_path, stamp):
+    tmp = f"{stamp_path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(stamp, f)
+    os.replace(tmp, stamp_path)
+
+
+def load_table(path, parse, cache_dir):
+    '''
+    Column table for the file at path, from cache_dir when the file's hash
+    has been seen before, otherwise parse(path) (an iterable of row dicts)
+    is run once and saved. Caches for older versions of the file are removed.
+    The file is only hashed when its size or mtime differ from the last load.
+    Returns (table, True if it came from the cache)
+    '''
+    stem = os.path.basename(path)
+    stamp_path = os.path.join(cache_dir, f"{stem}.stamp")
+    stamp = _source_stamp(path)
+    known = _read_stamp(stamp_path)
+    if known and known.get("size") == stamp["size"] and known.get("mtime_ns") == stamp["mtime_ns"]:
+        directory = os.path.join(cache_dir, f"{stem}-{known.get('hash')}")
+        if os.path.exists(os.path.join(directory, META_FILE)):
+            return open_table(directory), True
+
+    source_hash = file_hash(path)
+    directory = os.path.join(cache_dir, f"{stem}-{source_hash}")
+    os.makedirs(cache_dir, exist_ok=True)
+    if os.path.exists(os.path.join(directory, META_FILE)):
+        # Touched but unchanged, remember the new mtime
+        _write_stamp(stamp_path, {**stamp, "hash": source_hash})
+        return open_table(directory), True
+
+    save_table(build_table(parse(path)), directory, source_hash)
+    _write_stamp(stamp_path, {**stamp, "hash": source_hash})
+    for name in os.listdir(cache_dir):
+        if name.startswith(f"{stem}-") and name != os.path.basename(directory):
+            shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+    return open_table(directory), False
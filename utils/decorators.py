@@ -1,18 +1,42 @@
 from flask import session, redirect, url_for, flash
 from functools import wraps
+import inspect
+
+
+def _wrap(f, check):
+    '''
+    Wrap view f so check() runs first, its response (if any) replaces the view's.
+    Async views get an async wrapper so Flask still awaits them.
+    '''
+    if inspect.iscoroutinefunction(f):
+        @wraps(f)
+        async def decorated_async(*args, **kwargs):
+            denied = check()
+            if denied is not None:
+                return denied
+            return await f(*args, **kwargs)
+        return decorated_async
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        denied = check()
+        if denied is not None:
+            return denied
+        return f(*args, **kwargs)
+    return decorated_function
+
 
 def auth_required(f):
     '''Decorator to ensure that a user is logged in before accessing a route.'''
     
     
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
+    def check():
         if 'user_id' not in session:
             flash("You need to be logged in to access this page.", "error")
             return redirect(url_for('auth.login'))
-        return f(*args, **kwargs)
+        return None
 
-    return decorated_function
+    return _wrap(f, check)
 
 """Ensure the user is logged in before accessing the route.
     This decorator checks for 'user_id' in the session.
@@ -21,8 +45,7 @@ def auth_required(f):
 def admin_required(f):
     '''To ensure that the logged-in user has admin privileges.'''
     
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
+    def check():
         # Check if user is logged in
         if 'user_id' not in session:
             flash("You need to be logged in to access this page.", "error")
@@ -34,15 +57,14 @@ def admin_required(f):
             flash("You do not have permission to access this page.", "error")
             return redirect(url_for('auth.login'))
         
-        return f(*args, **kwargs)
+        return None
 
-    return decorated_function
+    return _wrap(f, check)
 
 def doctor_required(f):
     ''' Ensures that the logged-in user has doctor privileges.'''
     
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
+    def check():
         # user must be logged in
         if 'user_id' not in session:
             flash("You need to be logged in to access this page.", "error")
@@ -53,15 +75,14 @@ def doctor_required(f):
             flash("You do not have permission to access this page.", "error")
             return redirect(url_for('auth.login'))
         
-        return f(*args, **kwargs)
+        return None
 
-    return decorated_function
+    return _wrap(f, check)
 
 def admin_or_doctor_required(f):
     '''Ensures that the logged-in user has either admin or doctor privileges.'''
     
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
+    def check():
         # user must be logged in
         if 'user_id' not in session:
             flash("You need to be logged in to access this page.", "error")
@@ -72,6 +93,6 @@ def admin_or_doctor_required(f):
             flash("You do not have permission to access this page.", "error")
             return redirect(url_for('auth.login'))
         
-        return f(*args, **kwargs)
+        return None
 
-    return decorated_function
\ No newline at end of file
+    return _wrap(f, check)
\ No newline at end of file
@@ -0,0 +1,42 @@
+import csv
+import io
+import json
+import zlib
+
+
+def csv_chunks(docs, fields, rows_per_chunk=500):
+    '''Encode documents as CSV text, yielding a chunk every rows_per_chunk rows.'''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    count = 0
+    for doc in docs:
+        writer.writerow([doc.get(field) for field in fields])
+        count += 1
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def ndjson_chunks(docs, rows_per_chunk=500):
+    '''Encode documents as newline-delimited JSON, a chunk every rows_per_chunk rows.'''
+    lines = []
+    for doc in docs:
+        lines.append(json.dumps(doc, default=str))
+        if len(lines) >= rows_per_chunk:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def gzip_chunks(chunks, level=6):
+    '''Gzip a stream of text chunks without holding the whole output.'''
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31 = gzip header
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
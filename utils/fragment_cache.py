@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from utils.cache import TTLCache
+
+# Rendered table rows are reused for FRAGMENT_CACHE_TTL seconds at most,
+# FRAGMENT_CACHE_SIZE=0 turns the cache off. FRAGMENT_CACHE_STORE=sqlite
+# shares fragments and invalidations between the workers on a host
+FRAGMENT_CACHE_TTL = int(os.getenv("FRAGMENT_CACHE_TTL", 300))
+FRAGMENT_CACHE_SIZE = int(os.getenv("FRAGMENT_CACHE_SIZE", 512))
+
+
+class MemoryFragmentStore:
+    '''Fragments in an LRU in this process, generations in a dict.'''
+
+    def __init__(self, maxsize=512):
+        self._fragments = TTLCache(maxsize=maxsize)
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._fragments.get(key)
+
+    def set(self, key, value, ttl):
+        self._fragments.set(key, value, ttl=ttl)
+
+    def generation(self, namespace):
+        return self._generations.get(namespace, 0)
+
+    def bump(self, namespace):
+        '''Move namespace to a new generation, older fragments are never read again.'''
+        with self._lock:
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+
+    def clear(self):
+        self._fragments.clear()
+
+
+class SQLiteFragmentStore:
+    '''
+    Fragments and generations in a SQLite file shared by every worker
+    process on the host. Values are stored as JSON.
+    '''
+
+    def __init__(self, path, maxsize=512, clock=time.time):
+        self.path = path
+        self.maxsize = maxsize
+        self.clock = clock
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS fragments (key TEXT PRIMARY KEY, value TEXT, expires REAL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS generations (namespace TEXT PRIMARY KEY, generation INTEGER)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute("SELECT value FROM fragments WHERE key = ? AND expires > ?",
+                                      (key, self.clock())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl):
+        conn = self._connect()
+        now = self.clock()
+        conn.execute("INSERT OR REPLACE INTO fragments (key, value, expires) VALUES (?, ?, ?)",
+                     (key, json.dumps(value), now + ttl))
+        # Expired rows go first, then the ones closest to expiring past maxsize
+        conn.execute("DELETE FROM fragments WHERE expires <= ?", (now,))
+        conn.execute("DELETE FROM fragments WHERE key IN (SELECT key FROM fragments ORDER BY expires DESC "
+                     "LIMIT -1 OFFSET ?)", (self.maxsize,))
+
+    def generation(self, namespace):
+        row = self._connect().execute("SELECT generation FROM generations WHERE namespace = ?",
+                                      (namespace,)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, namespace):
+        self._connect().execute("INSERT INTO generations (namespace, generation) VALUES (?, 1) "
+                                "ON CONFLICT(namespace) DO UPDATE SET generation = generation + 1", (namespace,))
+
+    def clear(self):
+        self._connect().execute("DELETE FROM fragments")
+
+
+def make_store(kind="memory", path=None, maxsize=512):
+    '''Fragment store by name: "memory" (per process) or "sqlite" (shared through path).'''
+    if kind == "sqlite":
+        return SQLiteFragmentStore(path or "fragments.db", maxsize=maxsize)
+    if kind == "memory":
+        return MemoryFragmentStore(maxsize=maxsize)
+    raise ValueError(f"Unknown fragment cache store: {kind}")
+
+
+class FragmentCache:
+    '''
+    Rendered template fragments (plus whatever the page needs alongside
+    them) keyed by a namespace and the parts that shape them. Writes call
+    invalidate(namespace), which retires every fragment in it at once.
+    '''
+
+    def __init__(self, store, ttl=300, enabled=True):
+        self.store = store
+        self.ttl = ttl
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, namespace, parts):
+        digest = hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+        return f"{namespace}:{self.store.generation(namespace)}:{digest}"
+
+    def get(self, namespace, parts):
+        '''Cached value for parts, or None.'''
+        if not self.enabled:
+            return None
+        value = self.store.get(self._key(namespace, parts))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, namespace, parts, value):
+        '''Store a JSON-serializable value for parts.'''
+        if self.enabled:
+            self.store.set(self._key(namespace, parts), value, self.ttl)
+
+    def invalidate(self, namespace):
+        '''Forget every fragment in namespace, a cache failure must not fail the write.'''
+        try:
+            self.store.bump(namespace)
+        except Exception as e:
+            print(f"Could not invalidate {namespace} fragments: {e}")
+
+    def stats(self):
+        return {"enabled": self.enabled, "ttl": self.ttl, "hits": self.hits, "misses": self.misses}
+
+
+fragment_cache = FragmentCache(
+    make_store(os.getenv("FRAGMENT_CACHE_STORE", "memory"), os.getenv("FRAGMENT_CACHE_DB"), FRAGMENT_CACHE_SIZE),
+    ttl=FRAGMENT_CACHE_TTL,
+    enabled=FRAGMENT_CACHE_SIZE > 0,
+)
@@ -0,0 +1,292 @@
+import functools
+import hmac
+import inspect
+import os
+import threading
+import time
+from flask import g, has_request_context, request, template_rendered, before_render_template, Response
+from pymongo import monitoring
+
+# Latency histogram buckets, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# /metrics (and the details in /healthz) require "Authorization: Bearer
+# <METRICS_TOKEN>". Unset, /metrics is turned off
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Histogram:
+    '''Prometheus style histogram with cumulative buckets, one series per label set.'''
+
+    def __init__(self, name, help, labelnames=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[0][i] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def count(self, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            return series[2] if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, ('le', bound))} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, ('le', '+Inf'))} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class Gauge:
+    '''Value read when /metrics is scraped. read() returns a number or {label value: number}.'''
+
+    def __init__(self, name, help, read, labelname=None):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.labelname = labelname
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            value = self.read()
+        except Exception:
+            return lines
+        if isinstance(value, dict):
+            for label, number in sorted(value.items()):
+                lines.append(f"{self.name}{_labels((self.labelname,), (label,))} {number}")
+        elif value is not None:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+
+class Registry:
+    '''All metrics of this process, rendered in Prometheus text format.'''
+
+    def __init__(self):
+        self.metrics = []
+
+    def histogram(self, name, help, labelnames=()):
+        metric = Histogram(name, help, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, read, labelname=None):
+        self.metrics = [m for m in self.metrics if m.name != name]
+        metric = Gauge(name, help, read, labelname)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time to handle a request, by route rule.", ("route", "method", "status"))
+DB_CALL_SECONDS = REGISTRY.histogram(
+    "db_call_duration_seconds", "Time spent in User (sqlite) and Patient (mongo) data methods.", ("store", "call"))
+MONGO_COMMAND_SECONDS = REGISTRY.histogram(
+    "mongo_command_duration_seconds", "MongoDB round trips, by command.", ("command",))
+RENDER_SECONDS = REGISTRY.histogram(
+    "template_render_seconds", "Jinja render time, by template.", ("template",))
+
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+REGISTRY.gauge("http_requests_in_flight", "Requests being handled right now.", lambda: _in_flight)
+
+_depth = threading.local()
+_timings_lock = threading.Lock()
+
+
+def add_timing(name, seconds):
+    '''Add seconds (and one call) to the current request's Server-Timing entry name.'''
+    if has_request_context():
+        # Async views run data calls for one request on several threads
+        with _timings_lock:
+            timings = g.setdefault('_timings', {})
+            total, calls = timings.get(name, (0.0, 0))
+            timings[name] = (total + seconds, calls + 1)
+
+
+def timed(store, call):
+    '''
+    Decorator recording a data method in DB_CALL_SECONDS and the request's
+    Server-Timing. Calls made from inside another timed call are not
+    counted again. Generator functions are timed while they are consumed.
+    '''
+    def decorator(func):
+        def record(started):
+            seconds = time.perf_counter() - started
+            DB_CALL_SECONDS.observe(seconds, store, call)
+            add_timing(store, seconds)
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                busy = 0.0
+                iterator = func(*args, **kwargs)
+                try:
+                    while True:
+                        started = time.perf_counter()
+                        try:
+                            item = next(iterator)
+                        except StopIteration:
+                            return
+                        finally:
+                            busy += time.perf_counter() - started
+                        yield item
+                finally:
+                    DB_CALL_SECONDS.observe(busy, store, call)
+                    add_timing(store, busy)
+            generator_wrapper.__timed__ = True
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            depth = getattr(_depth, 'value', 0)
+            if depth:
+                return func(*args, **kwargs)
+            _depth.value = 1
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _depth.value = 0
+                record(started)
+        wrapper.__timed__ = True
+        return wrapper
+    return decorator
+
+
+def instrument_class(cls, store):
+    '''Wrap every public staticmethod of a model class with timed().'''
+    for name, attr in list(vars(cls).items()):
+        if isinstance(attr, staticmethod) and not name.startswith('_'):
+            func = attr.__func__
+            if not getattr(func, '__timed__', False):
+                setattr(cls, name, staticmethod(timed(store, f"{cls.__name__}.{name}")(func)))
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    '''Times every MongoDB command, including ones outside the model classes.'''
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        seconds = event.duration_micros / 1e6
+        MONGO_COMMAND_SECONDS.observe(seconds, event.command_name)
+        add_timing('mongo-cmd', seconds)
+
+    def failed(self, event):
+        self.succeeded(event)
+
+
+_mongo_listener_registered = False
+
+
+def server_timing(total, timings):
+    '''Server-Timing header value, durations in milliseconds.'''
+    parts = [f"app;dur={total * 1000:.1f}"]
+    for name, (seconds, calls) in sorted(timings.items()):
+        parts.append(f'{name};dur={seconds * 1000:.1f};desc="{calls} call{"s" if calls != 1 else ""}"')
+    return ", ".join(parts)
+
+
+def has_metrics_token():
+    '''True if the request carries the METRICS_TOKEN bearer token (never when it is unset).'''
+    if not METRICS_TOKEN:
+        return False
+    return hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {METRICS_TOKEN}")
+
+
+def init_metrics(app):
+    '''
+    Time every request (register this before other before_request hooks),
+    every template render and MongoDB command, add a Server-Timing header
+    and serve the collected metrics at /metrics.
+    '''
+    global _mongo_listener_registered
+    if not _mongo_listener_registered:
+        # Applies to MongoClients created from now on
+        monitoring.register(MongoCommandTimer())
+        _mongo_listener_registered = True
+
+    @app.before_request
+    def start_timer():
+        global _in_flight
+        g._request_started = time.perf_counter()
+        with _in_flight_lock:
+            _in_flight += 1
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('_request_started', None)
+        if started is None:
+            return response
+        total = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        REQUEST_SECONDS.observe(total, route, request.method, str(response.status_code))
+        response.headers['Server-Timing'] = server_timing(total, g.pop('_timings', {}))
+        return response
+
+    @app.teardown_request
+    def finish_request(exception=None):
+        global _in_flight
+        with _in_flight_lock:
+            _in_flight = max(0, _in_flight - 1)
+
+    def render_started(sender, template, context, **extra):
+        if has_request_context():
+            g.setdefault('_render_starts', []).append(time.perf_counter())
+
+    def render_finished(sender, template, context, **extra):
+        starts = g.get('_render_starts') if has_request_context() else None
+        if starts:
+            seconds = time.perf_counter() - starts.pop()
+            RENDER_SECONDS.observe(seconds, template.name or "string")
+            add_timing('render', seconds)
+
+    before_render_template.connect(render_started, app, weak=False)
+    template_rendered.connect(render_finished, app, weak=False)
+
+    @app.route('/metrics')
+    def metrics():
+        """Prometheus scrape endpoint, for holders of METRICS_TOKEN only"""
+        if not METRICS_TOKEN:
+            return Response("Metrics are off, set METRICS_TOKEN\n", status=404, mimetype='text/plain')
+        if not has_metrics_token():
+            return Response("Unauthorized\n", status=401, mimetype='text/plain')
+        return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,201 @@
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# werkzeug method string, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000".
+# Stored hashes made with other parameters are upgraded at the next login.
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+
+# Worker processes doing the hashing, 0 hashes on the calling thread
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+# Hashes queued or running at once, callers beyond that wait up to
+# PASSWORD_HASH_WAIT seconds for a slot and are then turned away
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", 32))
+PASSWORD_HASH_WAIT = float(os.getenv("PASSWORD_HASH_WAIT", 2))
+PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", 15))
+
+# Latency samples kept for the percentiles in hasher_stats
+LATENCY_SAMPLES = 512
+
+
+class HasherBusyError(ValueError):
+    '''Raised when the hashing queue is full, routes show it like any form error.'''
+
+
+class _Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+
+_metrics = _Metrics()
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_QUEUE)
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_method_prefix = None
+_dummy_hash = None
+
+
+def _forget_executor():
+    '''A forked child must not use the parent's worker processes.'''
+    global _executor, _executor_pid, _slots
+    _executor = None
+    _executor_pid = None
+    _slots = threading.BoundedSemaphore(PASSWORD_HASH_QUEUE)
+    _metrics.reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_executor)
+
+
+def _get_executor():
+    '''This process's hashing pool, started on first use. Workers are spawned, not forked.'''
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS,
+                                                mp_context=multiprocessing.get_context("spawn"))
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def shutdown_hasher():
+    '''Stop the worker processes (registered with atexit by the app).'''
+    global _executor
+    with _executor_lock:
+        if _executor is not None and _executor_pid == os.getpid():
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _finish(slots, started):
+    '''Free the job's queue slot and record it, once the job has really stopped.'''
+    slots.release()
+    with _metrics.lock:
+        _metrics.in_flight -= 1
+        _metrics.completed += 1
+        _metrics.latencies.append(time.perf_counter() - started)
+
+
+def _run(func, *args):
+    '''Run func in the pool, bounded by the queue and timed for the metrics.'''
+    slots = _slots
+    if not slots.acquire(timeout=PASSWORD_HASH_WAIT):
+        with _metrics.lock:
+            _metrics.rejected += 1
+        raise HasherBusyError("The server is busy, please try again in a moment.")
+
+    started = time.perf_counter()
+    with _metrics.lock:
+        _metrics.in_flight += 1
+        _metrics.peak_in_flight = max(_metrics.peak_in_flight, _metrics.in_flight)
+    if PASSWORD_HASH_WORKERS <= 0:
+        try:
+            return func(*args)
+        finally:
+            _finish(slots, started)
+
+    try:
+        future = _get_executor().submit(func, *args)
+    except BaseException:
+        _finish(slots, started)
+        raise
+    # A job that timed out keeps running in its worker (cancel cannot stop
+    # it), so it holds its slot until it is actually done
+    future.add_done_callback(lambda _: _finish(slots, started))
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except FutureTimeoutError:
+        future.cancel()
+        with _metrics.lock:
+            _metrics.rejected += 1
+        raise HasherBusyError("The server is busy, please try again in a moment.")
+
+
+def hash_password(password):
+    '''Hash a password with PASSWORD_HASH_METHOD, off the calling thread.'''
+    return _run(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+
+def verify_password(password_hash, password):
+    '''True if password matches the stored hash, checked off the calling thread.'''
+    return _run(check_password_hash, password_hash, password)
+
+
+def check_dummy(password):
+    '''
+    Run a full password check against a throwaway hash and return False.
+    Used for unknown emails so they take as long as a wrong password.
+    '''
+    global _dummy_hash
+    if _dummy_hash is None or not _dummy_hash.startswith(PASSWORD_HASH_METHOD):
+        _dummy_hash = hash_password(secrets.token_hex(16))
+    verify_password(_dummy_hash, password)
+    return False
+
+
+def needs_rehash(password_hash):
+    '''True if a stored hash was made with other parameters than PASSWORD_HASH_METHOD.'''
+    global _method_prefix
+    if _method_prefix is None:
+        # werkzeug fills in default parameters, e.g. "scrypt" -> "scrypt:32768:8:1"
+        _method_prefix = hash_password("").split("$", 1)[0]
+    return password_hash.split("$", 1)[0] != _method_prefix
+
+
+def rehash_later(password, save):
+    '''
+    Hash password in the background and pass the new hash to save(new_hash).
+    Used to upgrade old hashes after a successful login without delaying it.
+    '''
+    def work():
+        try:
+            save(hash_password(password))
+            with _metrics.lock:
+                _metrics.rehashed += 1
+        except Exception as e:
+            print(f"Password rehash failed: {e}")
+
+    thread = threading.Thread(target=work, name="password-rehash", daemon=True)
+    thread.start()
+    return thread
+
+
+def hasher_stats():
+    '''Queue depth and latency of the hashing pool in this process.'''
+    with _metrics.lock:
+        latencies = sorted(_metrics.latencies)
+        stats = {
+            "method": PASSWORD_HASH_METHOD,
+            "workers": PASSWORD_HASH_WORKERS,
+            "queue_limit": PASSWORD_HASH_QUEUE,
+            "in_flight": _metrics.in_flight,
+            "peak_in_flight": _metrics.peak_in_flight,
+            "completed": _metrics.completed,
+            "rejected": _metrics.rejected,
+            "rehashed": _metrics.rehashed,
+        }
+
+    def percentile(fraction):
+        if not latencies:
+            return None
+        return round(latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000, 1)
+
+    stats["latency_ms"] = {"p50": percentile(0.5), "p95": percentile(0.95), "max": percentile(1.0)}
+    return stats
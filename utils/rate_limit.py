@@ -0,0 +1,144 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def _refill(tokens, updated, now, capacity, rate):
+    '''Tokens in a bucket at `now`, topped up at `rate` per second since `updated`.'''
+    return min(capacity, tokens + max(0.0, now - updated) * rate)
+
+
+class MemoryBucketStore:
+    '''Token buckets in a dict in this process, least recently used dropped past maxsize.'''
+
+    def __init__(self, maxsize=10000, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, cost=1):
+        '''Take cost tokens if there are enough. Returns seconds to wait, 0 when allowed.'''
+        now = self.clock()
+        with self._lock:
+            tokens, updated = self._data.get(key, (capacity, now))
+            tokens = _refill(tokens, updated, now, capacity, rate)
+            wait = 0.0 if tokens >= cost else (cost - tokens) / rate
+            if not wait:
+                tokens -= cost
+            self._data[key] = (tokens, now)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            return wait
+
+    def reset(self, key):
+        '''Give a bucket back its full capacity.'''
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class SQLiteBucketStore:
+    '''
+    Token buckets in a SQLite file, so every worker process on the host
+    shares the same limits. Each take is one short IMMEDIATE transaction.
+    Every prune_every takes, buckets untouched for keep_seconds (or the
+    longest refill seen, if longer) are deleted so the file stays small.
+    '''
+
+    def __init__(self, path, clock=time.time, prune_every=1000, keep_seconds=3600):
+        self.path = path
+        self.clock = clock
+        self.prune_every = prune_every
+        self.keep_seconds = keep_seconds
+        self._takes = 0
+        self._longest_refill = 0.0
+        self._count_lock = threading.Lock()
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def take(self, key, capacity, rate, cost=1):
+        '''Take cost tokens if there are enough. Returns seconds to wait, 0 when allowed.'''
+        conn = self._connect()
+        now = self.clock()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = _refill(row[0], row[1], now, capacity, rate) if row else capacity
+            wait = 0.0 if tokens >= cost else (cost - tokens) / rate
+            if not wait:
+                tokens -= cost
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                         (key, tokens, now))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        with self._count_lock:
+            self._takes += 1
+            self._longest_refill = max(self._longest_refill, capacity / rate)
+            due = self.prune_every > 0 and self._takes % self.prune_every == 0
+        if due:
+            self.prune(max(self.keep_seconds, self._longest_refill))
+        return wait
+
+    def reset(self, key):
+        '''Give a bucket back its full capacity.'''
+        self._connect().execute("DELETE FROM buckets WHERE key = ?", (key,))
+
+    def prune(self, older_than):
+        '''Drop buckets untouched for older_than seconds (they would be full anyway).'''
+        self._connect().execute("DELETE FROM buckets WHERE updated < ?", (self.clock() - older_than,))
+
+
+def make_store(kind="memory", path=None):
+    '''Bucket store by name: "memory" (per process) or "sqlite" (shared through path).'''
+    if kind == "sqlite":
+        return SQLiteBucketStore(path or "rate_limits.db")
+    if kind == "memory":
+        return MemoryBucketStore()
+    raise ValueError(f"Unknown rate limit store: {kind}")
+
+
+class TokenBucketLimiter:
+    '''
+    Allows `capacity` hits per key in a burst, refilled evenly over
+    `per_seconds`. The buckets live in a pluggable store.
+    '''
+
+    def __init__(self, name, capacity, per_seconds, store):
+        self.name = name
+        self.capacity = capacity
+        self.rate = capacity / per_seconds
+        self.store = store
+        self.allowed = 0
+        self.limited = 0
+
+    def hit(self, key, cost=1):
+        '''Count one attempt for key. Returns seconds until it would be allowed, 0 if it is.'''
+        wait = self.store.take(f"{self.name}:{key}", self.capacity, self.rate, cost)
+        if wait:
+            self.limited += 1
+        else:
+            self.allowed += 1
+        return wait
+
+    def reset(self, key):
+        '''Forget the attempts made for key, e.g. after a successful login.'''
+        self.store.reset(f"{self.name}:{key}")
+
+    def stats(self):
+        return {"capacity": self.capacity, "allowed": self.allowed, "limited": self.limited}